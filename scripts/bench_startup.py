@@ -0,0 +1,118 @@
+"""
+Startup benchmark: runs tailer CLI modes in fresh interpreter and reports wall time and import time (python -X
+importtime) per mode, with the heaviest top level imports. Agent restarts tailers often, startup time matters.
+Exits with code 1 when wall or import time regresses past stored baseline. Windows only, as the tailer itself.
+
+Timings depend on host, store baseline on reference host after intended changes:
+
+    python scripts/bench_startup.py --update_baseline
+
+Usage: python scripts/bench_startup.py [-n RUNS] [-k MODE_SUBSTR] [--top N] [--baseline FILE] [--update_baseline]
+       [--tolerance PCT]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+from os import path
+
+ROOT = path.realpath(path.abspath(path.join(path.dirname(__file__), '..')))
+EVENTS_DIR = path.join(ROOT, 'tests', 'data', 'events')
+BASELINE_FILE = path.join(ROOT, 'scripts', 'bench_startup_baseline.json')
+
+# mode -> tailer CLI arguments
+MODES = {
+    'version': ['-v'],
+    'help': ['-h'],
+    'list': ['-l'],
+    'print_config': ['-e'],
+    'replay': ['--tailer_config', json.dumps({'replay': {'corpus': EVENTS_DIR, 'limit': 6}, 'lookback': -1})],
+}
+
+
+def parse_importtime(stderr: str) -> (float, list):
+    """
+    Returns (total import time ms, [(ms, module)] of top level imports) from python -X importtime output
+    """
+    top = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, module = line[len('import time:'):].split('|')
+        if not module.startswith('  '):  # nested imports are indented
+            top.append((int(cumulative) / 1000, module.strip()))
+    return sum(ms for ms, _ in top), sorted(top, reverse=True)
+
+
+def run_mode(args: list, cwd: str) -> dict:
+    cmd = [sys.executable, '-X', 'importtime', '-m', 'winevt_tailer.main'] + args
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    t0 = time.perf_counter()
+    proc = subprocess.run(cmd, cwd=cwd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    wall_ms = (time.perf_counter() - t0) * 1000
+    import_ms, top = parse_importtime(proc.stderr)
+    return {'exit_code': proc.returncode, 'wall_ms': wall_ms, 'import_ms': import_ms, 'top': top}
+
+
+def bench_mode(args: list, runs: int, cwd: str) -> dict:
+    # the first run warms up OS file cache and __pycache__, best of the rest is reported
+    run_mode(args, cwd)
+    results = [run_mode(args, cwd) for _ in range(runs)]
+    best = min(results, key=lambda res: res['wall_ms'])
+    return {
+        'exit_code': max(res['exit_code'] for res in results),
+        'wall_ms': round(best['wall_ms'], 1),
+        'wall_p50_ms': round(statistics.median(res['wall_ms'] for res in results), 1),
+        'import_ms': round(min(res['import_ms'] for res in results), 1),
+        'top': best['top'],
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Tailer startup benchmark')
+    parser.add_argument('-n', '--runs', type=int, default=5, help='Runs per mode, best run is reported')
+    parser.add_argument('-k', '--mode', default='', help='Run only modes with this substring in name')
+    parser.add_argument('--top', type=int, default=3, help='Heaviest top level imports to show')
+    parser.add_argument('--baseline', default=BASELINE_FILE, help='Baseline results file, JSON')
+    parser.add_argument('--update_baseline', action='store_true', help='Store results as new baseline')
+    parser.add_argument('--tolerance', type=float, default=25, help='Allowed wall/import time regression, percent')
+    args = parser.parse_args(argv)
+    baseline = {}
+    if path.isfile(args.baseline):
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+    results = {}
+    regressions = []
+    print(f'{"mode":<14}{"exit":>6}{"wall ms":>10}{"p50 ms":>10}{"import ms":>11}  heaviest imports', flush=True)
+    with tempfile.TemporaryDirectory() as cwd:  # bookmarks and logs of replay mode
+        for name, mode_args in MODES.items():
+            if args.mode not in name:
+                continue
+            res = bench_mode(mode_args, args.runs, cwd)
+            top = ', '.join(f'{module} {ms:.0f}' for ms, module in res.pop('top')[:args.top])
+            results[name] = res
+            print(f'{name:<14}{res["exit_code"]:>6}{res["wall_ms"]:>10.1f}{res["wall_p50_ms"]:>10.1f}'
+                  f'{res["import_ms"]:>11.1f}  {top}', flush=True)
+            base = baseline.get(name)
+            if base and not args.update_baseline:
+                for key in ('wall_ms', 'import_ms'):
+                    if res[key] > base[key] * (1 + args.tolerance / 100):
+                        regressions.append(f'{name}: {key} {res[key]} > baseline {base[key]}')
+    if args.update_baseline:
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=4, sort_keys=True)
+            f.write('\n')
+        print(f'Baseline updated: {args.baseline}')
+        return 0
+    for regression in regressions:
+        print(f'REGRESSION {regression}', file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,92 @@
+"""
+Measures Tailer throughput and latency of the full event path (render -> transforms -> tail_out) using
+replay event source, does not need Windows. Latency is measured from event scheduled time to output.
+
+Usage: python scripts/bench_tailer.py [-c CORPUS] [-n LIMIT] [-r RATE] [--pattern D:R,D:R] [--mix NAME:W,NAME:W]
+       [--channels NAME,NAME] [--transforms XFORM,XFORM] [--render xml|values] [--flush batch|bytes|time]
+       [--workers N] [--output FILE]
+"""
+import sys
+import time
+import logging
+import argparse
+from os import path, devnull
+
+ROOT = path.realpath(path.abspath(path.join(path.dirname(__file__), '..')))
+sys.path.insert(0, ROOT)
+
+import winevt_tailer.opts as opts  # noqa: E402
+from winevt_tailer.tailer import Tailer  # noqa: E402
+
+
+def pairs(arg_value: str, cast) -> list:
+    return [(k, cast(v)) for k, v in (item.rsplit(':', 1) for item in arg_value.split(',') if item)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Tailer replay benchmark')
+    parser.add_argument('-c', '--corpus', default=path.join(ROOT, 'tests', 'data', 'events'),
+                        help='Recorded events: JSON lines file or directory of *.xml files')
+    parser.add_argument('-n', '--limit', type=int, default=20000, help='Number of events to replay')
+    parser.add_argument('-r', '--rate', type=float, default=0, help='Events/sec, 0 - as fast as possible')
+    parser.add_argument('--pattern', default='', help='Burst pattern: duration_s:events_per_sec,...')
+    parser.add_argument('--mix', default='', help='Channel mix: channel_name:weight,...')
+    parser.add_argument('--channels', default='Application,System,Security',
+                        help='Tailer channels, comma separated')
+    parser.add_argument('--transforms', default=None, help='Tailer transforms, comma separated. Default: '
+                                                           'TailerConfig default')
+    parser.add_argument('--seed', type=int, default=0, help='Channel mix random seed')
+    parser.add_argument('--render', default='xml', choices=['xml', 'values'], help='Channels render mode')
+    parser.add_argument('--flush', default='batch', choices=['batch', 'bytes', 'time'], help='Output flush policy')
+    parser.add_argument('--workers', type=int, default=0, help='Worker threads, 0 - inline')
+    parser.add_argument('--output', default=devnull, help='Tail output file')
+    args = parser.parse_args(argv)
+    config_dict = {
+        'channels': [{'name': name, 'render': args.render} for name in args.channels.split(',')],
+        'exit_after_lookback': False,
+        'output': {'flush': args.flush},
+        'workers': args.workers,
+        'replay': {
+            'corpus': args.corpus,
+            'rate': args.rate,
+            'pattern': [(float(d), r) for d, r in pairs(args.pattern, float)],
+            'channel_mix': dict(pairs(args.mix, float)),
+            'limit': args.limit,
+            'seed': args.seed,
+        }
+    }
+    if args.transforms is not None:
+        config_dict['transforms'] = [xform for xform in args.transforms.split(',') if xform]
+    config = opts.parse_tailer_config(config_dict)
+    tailer = Tailer('bench', config)
+    # tail output as configured for console: message only, stream handler
+    out_file = open(args.output, 'w', encoding='utf-8')
+    handler = logging.StreamHandler(out_file)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    tailer.tail_out.handlers = [handler]
+    tailer.tail_out.setLevel(logging.INFO)
+    # latency from event scheduled time to output
+    latencies = []
+    emit = tailer.emit
+
+    def timed_emit(ch_idx, event_h, event_obj):
+        emit(ch_idx, event_h, event_obj)
+        latencies.append(time.perf_counter() - event_h.due_ts)
+
+    tailer.emit = timed_emit
+    start = time.perf_counter()
+    tailer.run()
+    elapsed = time.perf_counter() - start
+    out_file.close()
+    latencies.sort()
+    count = len(latencies)
+    print(f'events:   {count}')
+    print(f'elapsed:  {elapsed:.3f} s')
+    print(f'events/s: {count / elapsed:.0f}')
+    if count:
+        for name, q in [('p50', 50), ('p90', 90), ('p99', 99), ('max', 100)]:
+            print(f'{name} latency: {latencies[min(count - 1, count * q // 100)] * 1000:.3f} ms')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+"""
+Transforms micro-benchmark suite. Runs built-in transforms and default transform chains (console and service
+configs) over checked-in event corpus (tests/data/events/*.xml) and reports events/sec, p50/p99 latency and
+peak bytes allocated per event (tracemalloc). Exits with code 1 when events/s or allocations regress past stored
+baseline, latency percentiles are informational.
+xml_render_message and "values" render mode (ChannelConfig.render) run against stubbed win32evtlog: stub EvtRender
+returns ready XML string or values, so cost of rendering on Windows side is not included. Each case runs several
+rounds, best round is reported to filter out scheduling noise.
+
+Timings depend on host, refresh baseline on reference host after intended changes:
+
+    python scripts/bench_transforms.py --update_baseline
+
+Drop-heavy pipeline, raw XML regex drops information and verbose events (4 of 6 corpus events) before parsing vs
+parsing every event first:
+
+    python scripts/bench_transforms.py -k drop_
+
+Field projection vs full JSON serialization on Security events:
+
+    python scripts/bench_transforms.py -k chain_xml_ -e "security_*.xml"
+
+Usage: python scripts/bench_transforms.py [-n ITERATIONS] [-r ROUNDS] [-k CASE_SUBSTR] [-e EVENTS_GLOB]
+       [--baseline FILE] [--update_baseline] [--tolerance PCT] [--alloc_tolerance PCT]
+"""
+import gc
+import re
+import sys
+import json
+import glob
+import time
+import argparse
+import tracemalloc
+from os import path
+import yaml
+from lxml import etree
+
+ROOT = path.realpath(path.abspath(path.join(path.dirname(__file__), '..')))
+EVENTS_DIR = path.join(ROOT, 'tests', 'data', 'events')
+BASELINE_FILE = path.join(ROOT, 'scripts', 'bench_transforms_baseline.json')
+sys.path.insert(0, ROOT)
+
+import winevt_tailer.opts as opts  # noqa: E402
+import winevt_tailer.consts as consts  # noqa: E402
+import winevt_tailer.transforms as transforms  # noqa: E402
+import winevt_tailer.pipeline as pipeline  # noqa: E402
+import winevt_tailer.render as render  # noqa: E402
+from winevt_tailer.metadata import PublisherMetadataCache, MessageTemplateCatalog  # noqa: E402
+from winevt_tailer.projection import Projection  # noqa: E402
+from winevt_tailer.truncation import Truncator  # noqa: E402
+from tests.stubs import StubEvtlog, StubEvent  # noqa: E402
+
+DROP_REGEX = '<Level>[45]</Level>'  # drop_regex_* cases
+
+# message templates known to stub, other providers use EvtFormatMessage fallback (stub raises)
+STUB_PROVIDERS = ['Service Control Manager', 'Microsoft-Windows-Security-Auditing', 'Application Error']
+STUB_TEMPLATES = {
+    (16384 << 16) | 7036: 'The %1 service entered the %2 state.',
+    1000: 'Faulting application name: %1, version: %2, time stamp: 0x%3%nFaulting module name: %4, version: %5, '
+          'time stamp: 0x%6%nException code: 0x%7%nFault offset: 0x%8%nFaulting process id: 0x%9%n'
+          'Faulting application start time: 0x%10%nFaulting application path: %11%nFaulting module path: %12%n'
+          'Report Id: %13%nFaulting package full name: %14%nFaulting package-relative application ID: %15',
+}
+
+
+def load_corpus(events_glob: str = '*.xml') -> list:
+    corpus = []
+    for file_name in sorted(glob.glob(path.join(EVENTS_DIR, events_glob))):
+        with open(file_name, 'rb') as f:
+            corpus.append(f.read())
+    return corpus
+
+
+def new_context() -> dict:
+    evtlog = StubEvtlog(STUB_PROVIDERS, STUB_TEMPLATES)
+    metadata_cache = PublisherMetadataCache(evtlog=evtlog)
+    return {'publisher_metadata': metadata_cache,
+            'message_templates': MessageTemplateCatalog(metadata_cache, evtlog=evtlog),
+            'projection': Projection(opts.ProjectionConfig()),
+            'truncator': Truncator(opts.TruncateConfig()),
+            'drop_regex': re.compile(DROP_REGEX)}
+
+
+def chain_from_config(config_yaml: str) -> list:
+    return opts.parse_tailer_config(yaml.safe_load(config_yaml)).transforms
+
+
+def transform_case(xform):
+    # single transform on freshly parsed event, parsing is not measured
+    def setup(xml_bytes):
+        return etree.fromstring(xml_bytes)
+
+    def run(context, event_obj):
+        return xform(context, None, event_obj)
+
+    return setup, run
+
+
+def parse_case():
+    def setup(xml_bytes):
+        return xml_bytes
+
+    def run(context, xml_bytes):
+        return render.parse_xml(xml_bytes)
+
+    return setup, run
+
+
+def chain_case(chain: list):
+    # fused transforms on XML string, parsed before the first transform that needs tree, same work as
+    # Tailer.handle_event does
+    fused = pipeline.compile_pipeline(chain, pipeline.parse_position('bench', chain))
+
+    def setup(xml_bytes):
+        return xml_bytes.decode()
+
+    def run(context, xml_str):
+        return fused(context, None, xml_str)
+
+    return setup, run
+
+
+def eager_drop_case(chain: list):
+    # chain that starts with xml_drop_regex, every event is parsed before it, as if parsing was not deferred
+    drop = chain[0]
+    fused = pipeline.compile_pipeline(chain[1:])
+
+    def setup(xml_bytes):
+        return xml_bytes.decode()
+
+    def run(context, xml_str):
+        event_obj = render.parse_xml(xml_str)
+        if drop(context, None, xml_str) is None:
+            return None
+        return fused(context, None, event_obj)
+
+    return setup, run
+
+
+def values_case(chain: list):
+    # render values + build record + fused "values" transforms, same work as Tailer.handle_event does in
+    # "values" render mode
+    config = opts.parse_tailer_config({'channels': [{'name': 'bench', 'render': 'values'}], 'transforms': chain})
+    fused = pipeline.compile_pipelines(config)[0]
+    assert fused.render == 'values'
+    renderer = render.ValuesRenderer(StubEvtlog([]))
+
+    def setup(xml_bytes):
+        return StubEvent(xml_bytes.decode())
+
+    def run(context, event_h):
+        system, user = renderer.render(event_h)
+        return fused(context, event_h, render.build_record(system, user, []))
+
+    return setup, run
+
+
+def get_cases() -> dict:
+    service_chain = chain_from_config(consts.DEFAULT_CONFIG_FOR_SERVICE)
+    truncate_chain = service_chain[:-1] + [transforms.xml_truncate_fields, service_chain[-1]]
+    return {
+        'parse': parse_case(),
+        'xml_remove_binary': transform_case(transforms.xml_remove_binary),
+        'xml_render_message': transform_case(transforms.xml_render_message),
+        'xml_remove_eventdata': transform_case(transforms.xml_remove_eventdata),
+        'xml_to_json': transform_case(transforms.xml_to_json),
+        'xml_project_json': transform_case(transforms.xml_project_json),
+        'chain_xml_to_json': chain_case([transforms.xml_remove_binary, transforms.xml_to_json]),
+        'chain_xml_project_json': chain_case([transforms.xml_project_json]),
+        'chain_service_truncate': chain_case(truncate_chain),
+        'drop_regex_eager': eager_drop_case([transforms.xml_drop_regex] + service_chain),
+        'drop_regex_lazy': chain_case([transforms.xml_drop_regex] + service_chain),
+        'chain_console': chain_case(chain_from_config(consts.DEFAULT_CONFIG_FOR_CONSOLE)),
+        'chain_service': chain_case(service_chain),
+        'values_console': values_case(chain_from_config(consts.DEFAULT_CONFIG_FOR_CONSOLE)),
+        'values_service': values_case(chain_from_config(consts.DEFAULT_CONFIG_FOR_SERVICE)),
+    }
+
+
+def percentile(values: list, q: int):
+    return values[min(len(values) - 1, len(values) * q // 100)]
+
+
+def bench_round(setup, run, context: dict, corpus: list, iterations: int) -> dict:
+    inputs = [setup(corpus[i % len(corpus)]) for i in range(iterations)]
+    latencies = []
+    gc.collect()
+    gc.disable()  # same as timeit, collections are not attributed to random event
+    try:
+        for args in inputs:
+            t0 = time.perf_counter_ns()
+            run(context, args)
+            latencies.append(time.perf_counter_ns() - t0)
+    finally:
+        gc.enable()
+    elapsed = sum(latencies)
+    latencies.sort()
+    return {
+        'eps': round(iterations / (elapsed / 1e9)),
+        'p50_us': round(percentile(latencies, 50) / 1000, 2),
+        'p99_us': round(percentile(latencies, 99) / 1000, 2),
+    }
+
+
+def bench_case(setup, run, corpus: list, iterations: int, rounds: int) -> dict:
+    context = new_context()
+    for i in range(min(iterations, 100)):  # warm up caches
+        run(context, setup(corpus[i % len(corpus)]))
+    res = {'eps': 0, 'p50_us': float('inf'), 'p99_us': float('inf')}
+    for _ in range(rounds):
+        round_res = bench_round(setup, run, context, corpus, iterations)
+        res = {'eps': max(res['eps'], round_res['eps']),
+               'p50_us': min(res['p50_us'], round_res['p50_us']),
+               'p99_us': min(res['p99_us'], round_res['p99_us'])}
+    # allocations, separate pass - tracemalloc slows down execution
+    alloc_iterations = min(iterations, 20 * len(corpus))
+    alloc_total = 0
+    tracemalloc.start()
+    try:
+        for i in range(alloc_iterations):
+            args = setup(corpus[i % len(corpus)])
+            current, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            run(context, args)
+            _, peak = tracemalloc.get_traced_memory()
+            alloc_total += peak - current
+    finally:
+        tracemalloc.stop()
+    res['alloc_bytes'] = round(alloc_total / alloc_iterations)
+    return res
+
+
+def check_regressions(name: str, res: dict, base: dict, tolerance: float, alloc_tolerance: float) -> list:
+    regressions = []
+    if res['eps'] < base['eps'] * (1 - tolerance):
+        regressions.append(f'{name}: events/s {res["eps"]} < baseline {base["eps"]}')
+    if res['alloc_bytes'] > base['alloc_bytes'] * (1 + alloc_tolerance):
+        regressions.append(f'{name}: allocated {res["alloc_bytes"]} B/event > baseline {base["alloc_bytes"]} B/event')
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Transforms benchmark suite')
+    parser.add_argument('-n', '--iterations', type=int, default=1000, help='Iterations per round')
+    parser.add_argument('-r', '--rounds', type=int, default=5, help='Rounds per case, best round is reported')
+    parser.add_argument('-k', '--case', default='', help='Run only cases with this substring in name')
+    parser.add_argument('-e', '--events', default='*.xml', help='Event corpus files, glob in tests/data/events')
+    parser.add_argument('--baseline', default=BASELINE_FILE, help='Baseline results file, JSON')
+    parser.add_argument('--update_baseline', action='store_true', help='Store results as new baseline')
+    parser.add_argument('--tolerance', type=float, default=25, help='Allowed events/s regression, percent')
+    parser.add_argument('--alloc_tolerance', type=float, default=10, help='Allowed allocation regression, percent')
+    args = parser.parse_args(argv)
+    corpus = load_corpus(args.events)
+    if not corpus:
+        parser.error(f'No events match: {args.events}')
+    baseline = {}
+    if path.isfile(args.baseline):
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+    results = {}
+    regressions = []
+    print(f'{"case":<24}{"events/s":>12}{"p50 us":>12}{"p99 us":>12}{"alloc B/ev":>12}', flush=True)
+    for name, (setup, run) in get_cases().items():
+        if args.case not in name:
+            continue
+        res = results[name] = bench_case(setup, run, corpus, args.iterations, args.rounds)
+        print(f'{name:<24}{res["eps"]:>12}{res["p50_us"]:>12.1f}{res["p99_us"]:>12.1f}{res["alloc_bytes"]:>12}',
+              flush=True)
+        if name in baseline and not args.update_baseline:
+            regressions += check_regressions(name, res, baseline[name], args.tolerance / 100,
+                                             args.alloc_tolerance / 100)
+    if args.update_baseline:
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=4, sort_keys=True)
+            f.write('\n')
+        print(f'Baseline updated: {args.baseline}')
+        return 0
+    for regression in regressions:
+        print(f'REGRESSION {regression}', file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,96 @@
+"""
+Compares xml_to_json engines: native serializer vs XSLT (compatibility option).
+Reports events/sec and per-event latency for small, typical, 8 KB and 32 KB events.
+Note: single XSLT run on 32 KB event takes minutes, use --xslt_max_kb to skip XSLT on large events.
+
+Usage: python scripts/bench_xml_to_json.py [-n ITERATIONS] [-s MAX_SECONDS] [--xslt_max_kb KB]
+"""
+import sys
+import time
+import argparse
+import statistics
+from os import path
+from lxml import etree
+
+ROOT = path.realpath(path.abspath(path.join(path.dirname(__file__), '..')))
+EVENTS_DIR = path.join(ROOT, 'tests', 'data', 'events')
+sys.path.insert(0, ROOT)
+
+import winevt_tailer.transforms as transforms  # noqa: E402
+
+ENGINES = {
+    'native': transforms.xml_to_json,
+    'xslt': transforms.xml_to_json_xslt,
+}
+
+
+def load_events() -> dict:
+    with open(path.join(EVENTS_DIR, 'security_4624.xml'), 'rb') as f:
+        typical = f.read()
+    with open(path.join(EVENTS_DIR, 'powershell_4104.xml'), 'rb') as f:
+        large = etree.fromstring(f.read())
+    small = b"<Event xmlns='http://schemas.microsoft.com/win/2004/08/events/event'><System>" \
+            b"<Provider Name='EventLog'/><EventID Qualifiers='32768'>6005</EventID><Level>4</Level>" \
+            b"<TimeCreated SystemTime='2022-12-01T17:00:00.0000000Z'/><EventRecordID>1</EventRecordID>" \
+            b"<Channel>System</Channel><Computer>HOST</Computer><Security/></System><EventData/></Event>"
+    events = {
+        'small': etree.fromstring(small),
+        'typical': etree.fromstring(typical),
+    }
+    # grow ScriptBlockText, keep quotes, backslashes and new lines that need escaping
+    script = large.xpath("//event:Data[@Name='ScriptBlockText']", namespaces=transforms.g_event_ns)[0]
+    chunk = script.text
+    for size_kb in [8, 32]:
+        script.text = (chunk * (size_kb * 1024 // len(chunk) + 1))[0:size_kb * 1024]
+        events[f'{size_kb}KB'] = etree.fromstring(etree.tostring(large))
+    return events
+
+
+def bench(xform, event_obj, iterations: int, max_seconds: float) -> dict:
+    # stops after iterations or max_seconds, whichever comes first
+    latencies = []
+    output = None
+    start = time.perf_counter()
+    deadline = start + max_seconds
+    for _ in range(iterations):
+        t0 = time.perf_counter_ns()
+        output = xform({'json_drop_cr': True}, None, event_obj)  # native output is compared with XSLT one
+        latencies.append(time.perf_counter_ns() - t0)
+        if time.perf_counter() > deadline:
+            break
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        'output': output,
+        'eps': len(latencies) / elapsed,
+        'mean_us': statistics.fmean(latencies) / 1000,
+        'p50_us': latencies[len(latencies) // 2] / 1000,
+        'p99_us': latencies[min(len(latencies) - 1, len(latencies) * 99 // 100)] / 1000,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='xml_to_json engines benchmark')
+    parser.add_argument('-n', '--iterations', type=int, default=2000, help='Max iterations per run')
+    parser.add_argument('-s', '--max_seconds', type=float, default=5.0, help='Max seconds per run')
+    parser.add_argument('--xslt_max_kb', type=int, default=32, help='Skip XSLT engine for larger events')
+    args = parser.parse_args(argv)
+    events = load_events()
+    print(f'{"event":<10}{"engine":<10}{"events/s":>12}{"mean us":>12}{"p50 us":>12}{"p99 us":>12}', flush=True)
+    for event_name, event_obj in events.items():
+        event_size = len(etree.tostring(event_obj))
+        outputs = []
+        for engine_name, xform in ENGINES.items():
+            if engine_name == 'xslt' and event_size > (args.xslt_max_kb + 1) * 1024:
+                print(f'{event_name:<10}{engine_name:<10}{"skipped":>12}', flush=True)
+                continue
+            res = bench(xform, event_obj, args.iterations, args.max_seconds)
+            outputs.append(res['output'])
+            print(f'{event_name:<10}{engine_name:<10}{res["eps"]:>12.0f}{res["mean_us"]:>12.1f}'
+                  f'{res["p50_us"]:>12.1f}{res["p99_us"]:>12.1f}', flush=True)
+        # engines must agree
+        assert all(output == outputs[0] for output in outputs), f'engines output mismatch: {event_name}'
+
+
+if __name__ == "__main__":
+    main()
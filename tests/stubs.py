@@ -0,0 +1,333 @@
+"""
+win32evtlog compatible stubs, for testing without live Windows event log
+"""
+import os
+import re
+import gzip
+import logging
+import threading
+import collections
+import http.server
+import winevt_tailer.render as render
+from winevt_tailer.sources import EventSource, ReplayEvent, ReplayBookmark, ReplayEvtlog
+
+
+class StubHandle:
+    def __init__(self, name):
+        self.name = name
+        self.closed = False
+
+    def Close(self):
+        self.closed = True
+
+
+class StubEvent:
+    """
+    Event handle, rendered as XML or as values extracted from XML (strings)
+    """
+
+    def __init__(self, xml_str: str):
+        self.xml = xml_str
+        system, user = render.xml_to_values(xml_str)
+        self.system = [(value, 1) for value in system]  # EvtVarTypeString
+        self.user = [(value, 1) for value in user]
+
+
+class StubEvtlog:
+    """
+    Only providers from the list have metadata. Message templates are keyed by message id, see
+    MessageTemplateCatalog. Providers have no event metadata (classic providers) unless listed in events.
+    Events are rendered from StubEvent.
+    """
+    EvtFormatMessageEvent = 1
+    EvtFormatMessageId = 8
+    EvtEventMetadataEventID = 0
+    EvtEventMetadataEventVersion = 1
+    EvtEventMetadataEventMessageID = 7
+    EvtRenderEventValues = 0
+    EvtRenderEventXml = 1
+    EvtRenderContextValues = 0
+    EvtRenderContextSystem = 1
+    EvtRenderContextUser = 2
+
+    def __init__(self, providers, templates=None, events=None):
+        """
+        Args:
+            events: provider -> [(event_id, version, message_id)], event metadata of manifest based providers
+        """
+        self.providers = providers
+        self.templates = templates or {}
+        self.events = events or {}
+        self.enumerated = []
+        self.opened = []
+        self.formatted = []
+
+    def EvtOpenPublisherMetadata(self, name):
+        self.opened.append(name)
+        if name not in self.providers:
+            raise OSError(2, 'EvtOpenPublisherMetadata', 'The system cannot find the file specified.')
+        return StubHandle(name)
+
+    def EvtOpenEventMetadataEnum(self, metadata):
+        if metadata.name not in self.events:
+            raise OSError(15002, 'EvtOpenEventMetadataEnum', 'The publisher metadata cannot be found in the resource.')
+        self.enumerated.append(metadata.name)
+        return iter(self.events[metadata.name])
+
+    def EvtNextEventMetadata(self, events_h):
+        return next(events_h, None)
+
+    def EvtGetEventMetadataProperty(self, event_h, property_id):
+        event_id, version, message_id = event_h
+        value = {self.EvtEventMetadataEventID: event_id, self.EvtEventMetadataEventVersion: version,
+                 self.EvtEventMetadataEventMessageID: message_id}[property_id]
+        return value, 8  # EvtVarTypeUInt32
+
+    def EvtCreateRenderContext(self, flags):
+        return StubHandle(flags)
+
+    def EvtRender(self, event_h, flags, Context=None):
+        if flags == self.EvtRenderEventXml:
+            return event_h.xml
+        return event_h.system if Context.name == self.EvtRenderContextSystem else event_h.user
+
+    def EvtFormatMessage(self, metadata, event_h, flags, ResourceId=0):
+        self.formatted.append((metadata.name, flags, ResourceId))
+        if flags == self.EvtFormatMessageId and ResourceId in self.templates:
+            return self.templates[ResourceId]
+        raise OSError(15027, 'EvtFormatMessage', 'The message was not found in the message table.')
+
+
+class ListHandler(logging.Handler):
+    """
+    Collects tail output lines
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.lines = []
+
+    def emit(self, record):
+        self.lines += record.getMessage().split('\n')  # one record per output flush
+
+
+def run_tailer(tailer) -> list:
+    """
+    Runs tailer till exit, asserts exit code 0. Returns tail output lines
+    """
+    handler = ListHandler()
+    tailer.tail_out.addHandler(handler)
+    tailer.tail_out.setLevel(logging.INFO)
+    try:
+        assert tailer.run() == 0
+    finally:
+        tailer.tail_out.removeHandler(handler)
+    return handler.lines
+
+
+def track_emitted(tailer) -> list:
+    """
+    Wraps tailer.emit, returns list which gets (channel index, record id) of emitted events
+    """
+    emitted = []
+    emit = tailer.emit
+
+    def tracking_emit(ch_idx, event_h, event_obj):
+        emitted.append((ch_idx, event_h.record_id))
+        emit(ch_idx, event_h, event_obj)
+
+    tailer.emit = tracking_emit
+    return emitted
+
+
+def read_event(file_name: str) -> bytes:
+    with open(os.path.join(os.path.dirname(__file__), 'data', 'events', file_name), 'rb') as f:
+        return f.read()
+
+
+class StubEventSource(EventSource):
+    """
+    Event source with scripted events per channel: old events returned by query after seek, new events returned by
+    subscription. Events are ReplayEvent with given record ids and the same XML, EventRecordID is set to record id.
+    Channel subscription is signalled while it has events.
+    """
+    evtlog = ReplayEvtlog()
+
+    def __init__(self, old_events: list, new_events: list, xml_str: str):
+        """
+        Args:
+            old_events: per channel list of record ids
+            new_events: per channel list of record ids
+        """
+        self.old = [collections.deque(self.event(ch_idx, xml_str, record_id) for record_id in ids)
+                    for ch_idx, ids in enumerate(old_events)]
+        self.new = [collections.deque(self.event(ch_idx, xml_str, record_id) for record_id in ids)
+                    for ch_idx, ids in enumerate(new_events)]
+        self.subscribed = []
+        self.last_signalled = -1
+        self.next_calls = []  # (handle, count)
+
+    @staticmethod
+    def event(ch_idx: int, xml_str: str, record_id: int) -> ReplayEvent:
+        xml_str = re.sub(r'<EventRecordID>\d+</EventRecordID>', f'<EventRecordID>{record_id}</EventRecordID>', xml_str)
+        return ReplayEvent(ch_idx, xml_str, record_id, 0)
+
+    @property
+    def exhausted(self) -> bool:
+        return not any(self.old) and not any(self.new)
+
+    def query(self, ch_idx: int):
+        return 'query', ch_idx
+
+    def seek_bookmark(self, query, bookmark):
+        if bookmark.record_id == 0:
+            raise OSError(15032, 'EvtSeek', 'The bookmark was not found.')
+
+    def seek_last(self, query, offset: int):
+        pass
+
+    def subscribe(self, ch_idx: int, bookmark=None):
+        self.subscribed.append(ch_idx)
+        if bookmark is not None:
+            while self.new[ch_idx] and self.new[ch_idx][0].record_id <= bookmark.record_id:
+                self.new[ch_idx].popleft()
+        return 'sub', ch_idx
+
+    def next(self, handle, count: int, timeout_ms: int) -> list:
+        self.next_calls.append((handle, count))
+        kind, ch_idx = handle
+        events = self.old[ch_idx] if kind == 'query' else self.new[ch_idx]
+        return [events.popleft() for _ in range(min(count, len(events)))]
+
+    def wait(self, timeout_ms: int):
+        # signalled channels in turn, as auto-reset events are
+        for i in range(1, len(self.new) + 1):
+            ch_idx = (self.last_signalled + i) % len(self.new)
+            if ch_idx in self.subscribed and self.new[ch_idx]:
+                self.last_signalled = ch_idx
+                return ch_idx
+        return None
+
+    def render_xml(self, event_h) -> str:
+        return event_h.xml
+
+    def render_values(self, ch_idx: int, event_h) -> dict:
+        system, user = render.xml_to_values(event_h.xml)
+        return render.build_record(system, user, [])
+
+    def create_bookmark(self, xml_str: str = None):
+        return ReplayBookmark(int(xml_str) if xml_str else 0)
+
+    def update_bookmark(self, bookmark, event_h):
+        bookmark.record_id = event_h.record_id
+
+    def render_bookmark(self, bookmark) -> str:
+        return str(bookmark.record_id)
+
+
+class StubSignal:
+    def __init__(self, manual_reset: bool, state: bool):
+        self.manual_reset = manual_reset
+        self.state = state
+
+
+class StubWin32Event:
+    """
+    Win32 events and waits, all signals share one condition
+    """
+    MAXIMUM_WAIT_OBJECTS = 64
+    WAIT_OBJECT_0 = 0
+    WAIT_TIMEOUT = 258
+    INFINITE = 0xFFFFFFFF
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.max_handles = 0  # max number of handles waited at once
+
+    def CreateEvent(self, security_attributes, manual_reset, initial_state, name):
+        return StubSignal(bool(manual_reset), bool(initial_state))
+
+    def SetEvent(self, signal):
+        with self.condition:
+            signal.state = True
+            self.condition.notify_all()
+
+    def WaitForMultipleObjects(self, handles, wait_all, timeout_ms):
+        assert len(handles) <= self.MAXIMUM_WAIT_OBJECTS and not wait_all
+        self.max_handles = max(self.max_handles, len(handles))
+        timeout = None if timeout_ms == self.INFINITE else timeout_ms / 1000
+        with self.condition:
+            while True:
+                for idx, signal in enumerate(handles):
+                    if signal.state:
+                        if not signal.manual_reset:
+                            signal.state = False
+                        return self.WAIT_OBJECT_0 + idx
+                if not self.condition.wait(timeout):
+                    return self.WAIT_TIMEOUT
+
+    def WaitForMultipleObjectsEx(self, handles, wait_all, timeout_ms, alertable):
+        return self.WaitForMultipleObjects(handles, wait_all, timeout_ms)
+
+
+class StubIngestServer(http.server.ThreadingHTTPServer):
+    """
+    Local stand-in for ingest endpoint, collects POSTed NDJSON lines. Modes: ok, slow - responds after delay_s,
+    failing - responds 503, hold - waits till release() is called. The first fail_requests requests fail in any mode.
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), StubIngestHandler)
+        self.url = f'http://127.0.0.1:{self.server_address[1]}/ingest'
+        self.mode = 'ok'
+        self.delay_s = 0.2
+        self.fail_requests = 0
+        self.released = threading.Event()
+        self.lines = []
+        self.requests = 0
+        self.connections = 0
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+
+    def release(self):
+        self.released.set()
+
+    def close(self):
+        self.released.set()
+        self.shutdown()
+        self.server_close()
+
+
+class StubIngestHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            failing = server.requests <= server.fail_requests
+        if server.mode == 'slow':
+            threading.Event().wait(server.delay_s)
+        elif server.mode == 'hold':
+            server.released.wait()
+        if server.mode == 'failing' or failing:
+            self.send_response(503)
+        else:
+            if self.headers.get('Content-Encoding') == 'gzip':
+                body = gzip.decompress(body)
+            with server.lock:
+                server.lines.extend(body.decode().splitlines())
+            self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
@@ -0,0 +1,44 @@
+import os
+import logging
+import winevt_tailer.opts as opts
+from winevt_tailer.tailer import Tailer
+from winevt_tailer.batching import BatchSizer
+from tests.stubs import run_tailer
+
+EVENTS_DIR = os.path.join(os.path.dirname(__file__), 'data', 'events')
+
+
+def test_adaptive_batch_size():
+    sizer = BatchSizer(50, 100, adaptive=True, min_size=10, max_size=300)
+    for expected in [100, 200, 300, 300]:  # backlog, full batches
+        sizer.update(sizer.size)
+        assert sizer.size == expected
+    sizer.update(0)  # drained
+    assert sizer.size == 300
+    sizer.update(100)  # not sparse
+    assert sizer.size == 300
+    for expected in [150, 75, 37, 18, 10, 10]:  # sparse
+        sizer.update(1)
+        assert sizer.size == expected
+    stats = sizer.stats()
+    assert stats['peak_size'] == 300 and stats['full_batches'] == 4 and stats['batches'] == 11
+    assert sizer.stats()['batches'] == 0
+    # fixed size
+    sizer = BatchSizer(50, 100)
+    sizer.update(50)
+    sizer.update(1)
+    assert sizer.size == 50
+
+
+def test_tailer_batch_config(caplog):
+    cfg = opts.parse_tailer_config({'channels': [{'name': 'Application', 'batch_size': 5, 'adaptive_batch': True},
+                                                 {'name': 'System', 'batch_timeout_ms': 0}],
+                                    'exit_after_lookback': False, 'stats_report_s': 3600, 'wait_timeout_ms': 10,
+                                    'replay': {'corpus': EVENTS_DIR, 'limit': 2000}})
+    tailer = Tailer('test_batch', cfg)
+    assert [(s.size, s.timeout_ms, s.adaptive) for s in tailer.batch_sizers] == [(10, 100, True), (50, 0, False)]
+    with caplog.at_level(logging.INFO, logger='tailer'):
+        run_tailer(tailer)
+    batch_lines = [line.split() for line in caplog.messages
+                   if line.startswith('Application ') and len(line.split()) == 6]
+    assert int(batch_lines[0][2]) > 10  # peak size, grown on backlog
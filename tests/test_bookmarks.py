@@ -0,0 +1,54 @@
+import os
+from winevt_tailer.tailer import Tailer
+from winevt_tailer.bookmarks import BookmarkStore
+import winevt_tailer.opts as opts
+import winevt_tailer.utils as utils
+from tests.stubs import StubEventSource, read_event, run_tailer
+
+CHANNELS = [opts.ChannelConfig(name='Application'), opts.ChannelConfig(name='System')]
+
+
+class XmlSource:
+    def create_bookmark(self, xml_str=None):
+        return xml_str
+
+
+def test_journal_torn_write_and_compaction(tmp_path):
+    file_name = str(tmp_path / 'test.bookmarks')
+    store = BookmarkStore(file_name)
+    store.commit({'Application#*': 'a1'})
+    store.commit({'System#*': 's1'})
+    store.commit({'Application#*': 'a2'})
+    store.close()
+    assert not os.path.isfile(file_name)  # journal only
+    with open(store.journal_file_name, 'ab') as f:
+        f.write(b'0badc0de {"Application#*":"a3"')  # torn write
+    store = BookmarkStore(file_name)
+    assert store.load(CHANNELS, XmlSource()) == ['a2', 's1']
+    store.commit({'Application#*': 'a3'})
+    store.close()
+    assert BookmarkStore(file_name).load(CHANNELS, XmlSource()) == ['a3', 's1']
+    # compaction into bookmarks file in the same format
+    store = BookmarkStore(file_name, compact_bytes=100)
+    store.load(CHANNELS, XmlSource())
+    for i in range(10):
+        store.commit({'System#*': f's{i}'})
+    store.close()
+    assert os.path.getsize(store.journal_file_name) < 100 + 30  # compacted, one line over limit at most
+    assert utils.read_bookmarks_file(file_name) in ({'Application#*': 'a3', 'System#*': f's{i}'} for i in range(10))
+    assert utils.load_bookmarks(file_name, CHANNELS, XmlSource())[0] == 'a3'
+    assert BookmarkStore(file_name).load(CHANNELS, XmlSource()) == ['a3', 's9']
+
+
+def test_tailer_commits_changed_bookmarks(tmp_path):
+    xml_str = read_event('system_7036.xml').decode()
+    cfg = opts.parse_tailer_config({'channels': [{'name': 'Application'}, {'name': 'System'}], 'lookback': 0,
+                                    'exit_after_lookback': False, 'persistent': True, 'bookmarks_commit_s': 0,
+                                    'bookmarks_dir': str(tmp_path), 'batch_size': 10})
+    tailer = Tailer('test_bookmarks', cfg, StubEventSource([[], []], [range(1, 51), []], xml_str))
+    run_tailer(tailer)
+    with open(tailer.bookmark_store.journal_file_name) as f:
+        lines = f.read().splitlines()
+    assert len(lines) >= 1 and all('System' not in line for line in lines)  # System has not moved
+    tailer = Tailer('test_bookmarks', cfg, StubEventSource([[], []], [[], []], xml_str))
+    assert [bookmark.record_id for bookmark in tailer.bookmarks] == [50, 0]
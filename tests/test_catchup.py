@@ -0,0 +1,39 @@
+from winevt_tailer.tailer import Tailer
+from winevt_tailer.catchup import ChannelCatchUp
+import winevt_tailer.opts as opts
+from tests.stubs import StubEventSource, read_event, run_tailer, track_emitted
+
+
+def run_catchup(source, **config) -> (Tailer, list):
+    cfg = opts.parse_tailer_config({'channels': [{'name': 'Application'}, {'name': 'System'}], 'lookback': -1,
+                                    'batch_size': 50, **config})
+    tailer = Tailer('test_catchup', cfg, source)
+    emitted = track_emitted(tailer)
+    run_tailer(tailer)
+    return tailer, emitted
+
+
+def test_catchup_interleaved_with_live():
+    xml_str = read_event('application_1000.xml').decode()
+    # new events 190..200 are read by both query and subscription
+    source = StubEventSource([range(1, 201), []], [range(190, 221), range(1, 6)], xml_str)
+    tailer, emitted = run_catchup(source, exit_after_lookback=False)
+    assert [record_id for ch_idx, record_id in emitted if ch_idx == 0] == list(range(1, 221))
+    assert [record_id for ch_idx, record_id in emitted if ch_idx == 1] == list(range(1, 6))
+    assert emitted.index((1, 1)) < emitted.index((0, 200))  # live channel is not blocked by catch-up
+    assert [bookmark.record_id for bookmark in tailer.bookmarks] == [220, 5]
+    assert [catchup.stats()['state'] for catchup in tailer.catchup_stats.values()] == ['live', 'live']
+    # old events only
+    source = StubEventSource([range(1, 201), []], [range(190, 221), range(1, 6)], xml_str)
+    tailer, emitted = run_catchup(source, exit_after_lookback=True)
+    assert emitted == [(0, record_id) for record_id in range(1, 201)]
+
+
+def test_catchup_rate_limit():
+    catchup = ChannelCatchUp(None, 'lookback', rate=100)
+    assert catchup.budget(50) == 50 and catchup.delay(catchup.start_ts) == 0
+    assert not catchup.update([object()] * 50, catchup.start_ts)
+    assert catchup.delay(catchup.start_ts) == 0.5
+    assert ChannelCatchUp(None, 'lookback', rate=10).budget(50) == 10
+    assert catchup.update([], catchup.start_ts + 1) is False
+    assert catchup.is_live and catchup.stats()['events_per_s'] == 50
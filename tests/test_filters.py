@@ -0,0 +1,67 @@
+import pytest
+import winevt_tailer.opts as opts
+import winevt_tailer.errors as errors
+import winevt_tailer.utils as utils
+from winevt_tailer.filters import build_query, parse_id_ranges, subtract_ranges
+
+
+def test_id_ranges():
+    assert parse_id_ranges([4625, '4624', '4700-4799', '4750 - 4800', 1]) == [(1, 1), (4624, 4625), (4700, 4800)]
+    assert subtract_ranges([(1, 10), (20, 30)], [(0, 2), (5, 5), (25, 40)]) == [(3, 4), (6, 10), (20, 24)]
+    with pytest.raises(ValueError):
+        parse_id_ranges(['4700-4600'])
+
+
+def test_build_query():
+    assert build_query('*') == '*'
+    assert build_query('*[System[(EventID=1)]]', opts.FilterConfig()) == '*[System[(EventID=1)]]'
+    config = opts.FilterConfig(levels=[1, 2, 3, 4], exclude_levels=[4], event_ids=['4624-4625', 4672],
+                               exclude_event_ids=[4625], providers=['Microsoft-Windows-Security-Auditing', "O'Brien"],
+                               exclude_keywords='0x10000000000000', since='2023-01-01T00:00:00Z', max_age_s=3600)
+    query = build_query('*', config)
+    assert query == ("*[System[(Level>=1 and Level<=3) and (EventID=4624 or EventID=4672) and "
+                     "Provider[@Name='Microsoft-Windows-Security-Auditing' or @Name=\"O'Brien\"] and "
+                     "band(Keywords,4503599627370496)=0 and "
+                     "TimeCreated[@SystemTime>='2023-01-01T00:00:00Z' and timediff(@SystemTime)<=3600000]]]")
+    assert utils.is_valid_xpath(query)
+    # merged into predicate of user query, top level "or" is parenthesized
+    config = opts.FilterConfig(keywords='0x1')
+    assert build_query('*[System[Level=4 or Level=5]]', config) == \
+           '*[System[(Level=4 or Level=5) and band(Keywords,1)]]'
+    assert build_query("*[System[Level=4] and EventData[Data='x']]", config) == \
+           "*[System[Level=4] and EventData[Data='x'] and System[band(Keywords,1)]]"
+    assert build_query("*[System[Level=4] or EventData[Data='x']]", config) == \
+           "*[(System[Level=4] or EventData[Data='x']) and System[band(Keywords,1)]]"
+    with pytest.raises(ValueError):
+        build_query('Event/System[Level=4]', config)
+    # union of paths: QueryList, one Select per path, exclusions only
+    config = opts.FilterConfig(exclude_levels=[5], exclude_event_ids=['100-200', 7], exclude_providers=['A', 'B'])
+    query = build_query("*[System[Level=4]] or *[EventData[Data[@Name='x']='y']]", config, 'Security')
+    conditions = ("Level!=5 and EventID!=7 and (EventID&lt;100 or EventID&gt;200) and "
+                  "Provider[@Name!='A' and @Name!='B']")
+    assert query == ('<QueryList><Query Id="0" Path="Security">'
+                     f'<Select Path="Security">*[System[Level=4 and {conditions}]]</Select>'
+                     f"<Select Path=\"Security\">*[EventData[Data[@Name='x']='y'] and System[{conditions}]]</Select>"
+                     '</Query></QueryList>')
+    assert utils.is_valid_query(query)
+    # QueryList: filter is merged into each Select, Suppress is kept
+    query_list = ('<QueryList><Query Id="0" Path="Security"><Select Path="Security">*[System[Level=4]]</Select>'
+                  '<Suppress Path="Security">*[System[EventID=4624]]</Suppress></Query></QueryList>')
+    assert utils.is_valid_query(query_list) and not utils.is_valid_query('<QueryList/>')
+    assert build_query(query_list, opts.FilterConfig(keywords='0x1')) == \
+           query_list.replace('Level=4', 'Level=4 and band(Keywords,1)')
+
+
+def test_channel_filter_config():
+    cfg = opts.parse_tailer_config({'channels': [{'name': 'Security', 'filter': {'event_ids': [4624]}}]})
+    channel = cfg.channels[0]
+    assert channel.query == '*' and channel.effective_query == '*[System[EventID=4624]]'
+    assert utils.bookmark_key(channel) == 'Security#*[System[EventID=4624]]'
+    query_list = '<QueryList><Query Id="0" Path="Security"><Select>*</Select></Query></QueryList>'
+    cfg = opts.parse_tailer_config({'channels': [{'name': 'Security', 'query': query_list,
+                                                  'filter': {'event_ids': [4624]}}]})
+    assert cfg.channels[0].effective_query == query_list.replace('>*<', '>*[System[EventID=4624]]<')
+    for bad in ({'event_ids': [4624], 'exclude_event_ids': ['4000-5000']}, {'since': '2023-01-01'},
+                {'keywords': 'abc'}, {'providers': ['a\'"b']}):
+        with pytest.raises(errors.ConfigError):
+            opts.parse_tailer_config({'channels': [{'name': 'Security', 'filter': bad}]})
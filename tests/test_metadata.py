@@ -0,0 +1,114 @@
+import json
+import logging
+import pytest
+from winevt_tailer.tailer import Tailer
+import winevt_tailer.opts as opts
+from winevt_tailer.metadata import PublisherMetadataCache, MessageTemplateCatalog, UnsafeTemplateError, \
+    substitute_inserts
+from tests.stubs import StubEvtlog, StubEventSource, read_event, run_tailer
+
+
+def test_publisher_metadata_cache_lru():
+    evtlog = StubEvtlog(['A', 'B', 'C'])
+    cache = PublisherMetadataCache(max_size=2, evtlog=evtlog)
+    a = cache.acquire('A')
+    assert cache.acquire('A') is a
+    b = cache.acquire('B')
+    cache.release(b)
+    cache.acquire('A')  # B becomes least recently used
+    c = cache.acquire('C')
+    assert b.closed and not a.closed and not c.closed
+    assert evtlog.opened == ['A', 'B', 'C']
+    assert cache.stats() == {'size': 2, 'hits': 2, 'misses': 3, 'negative_hits': 0, 'evictions': 1}
+    # evicted handle in use is closed on last release
+    cache.acquire('B')
+    assert not a.closed and cache.stats()['evictions'] == 2
+    for _ in range(2):
+        cache.release(a)
+    assert not a.closed
+    cache.release(a)
+    assert a.closed
+    cache.close()
+    assert c.closed
+
+
+def test_publisher_metadata_cache_negative_ttl():
+    now = [0.0]
+    evtlog = StubEvtlog([])
+    cache = PublisherMetadataCache(negative_ttl_s=10, evtlog=evtlog, clock=lambda: now[0])
+    assert cache.acquire('X') is None
+    now[0] = 9
+    assert cache.acquire('X') is None
+    assert evtlog.opened == ['X']
+    now[0] = 11  # expired, retry
+    evtlog.providers.append('X')
+    assert cache.acquire('X').name == 'X'
+    assert evtlog.opened == ['X', 'X']
+    assert cache.stats()['negative_hits'] == 1
+
+
+def test_substitute_inserts():
+    assert substitute_inserts('The %1 service entered the %2!s! state.%n100%%', ['BITS', 'running']) == \
+           'The BITS service entered the running state.\r\n100%'
+    assert substitute_inserts('Empty: "%1"', [None]) == 'Empty: ""'
+    for template, values in [('%3', ['a', 'b']), ('%1!d!', ['1']), ('%0', []), ('50% off', []),
+                             ('Level: %1', ['%%1833'])]:
+        with pytest.raises(UnsafeTemplateError):
+            substitute_inserts(template, values)
+
+
+def test_message_template_catalog(tmp_path):
+    message_id = (16384 << 16) | 7036
+    evtlog = StubEvtlog(['Service Control Manager'], {message_id: 'The %1 service entered the %2 state.'})
+    templates = MessageTemplateCatalog(PublisherMetadataCache(evtlog=evtlog), locale=1033, evtlog=evtlog)
+    for state in ['running', 'stopped']:
+        message = templates.format('Service Control Manager', 7036, 0, 16384, ['BITS', state])
+        assert message == f'The BITS service entered the {state} state.'
+    # template is fetched once
+    assert evtlog.formatted == [('Service Control Manager', evtlog.EvtFormatMessageId, message_id)]
+    assert templates.format('Service Control Manager', 7036, 0, 16384, ['BITS']) is None  # unsafe, fallback
+    assert templates.format('Unknown', 1, 0, 0, []) is None
+    assert templates.stats() == {'size': 2, 'hits': 2, 'misses': 2, 'fallbacks': 2}
+    # persisted catalog starts warm, other locales are ignored
+    file_name = str(tmp_path / 'test.templates')
+    templates.store(file_name)
+    with open(file_name) as f:
+        assert json.load(f) == {'Service Control Manager#7036#0#16384#1033': 'The %1 service entered the %2 state.'}
+    evtlog = StubEvtlog([])
+    warm = MessageTemplateCatalog(PublisherMetadataCache(evtlog=evtlog), locale=1033, evtlog=evtlog)
+    warm.load(file_name)
+    assert warm.format('Service Control Manager', 7036, 0, 16384, ['BITS', 'running']) == \
+           'The BITS service entered the running state.'
+    assert evtlog.opened == []
+    other = MessageTemplateCatalog(PublisherMetadataCache(evtlog=evtlog), locale=1049, evtlog=evtlog)
+    other.load(file_name)
+    assert other.stats()['size'] == 0
+
+
+def test_message_template_catalog_manifest():
+    # manifest based provider: message id is looked up by (EventID, version) in enumerated event metadata
+    evtlog = StubEvtlog(['Manifest', 'Classic'],
+                        {0xB00003E8: 'Started %1.', 0xB00103E8: 'Started %1 v1.', (16384 << 16) | 7036: 'Classic %1.'},
+                        {'Manifest': [(1000, 0, 0xB00003E8), (1000, 1, 0xB00103E8), (1001, 0, 0xFFFFFFFF)]})
+    templates = MessageTemplateCatalog(PublisherMetadataCache(max_size=1, evtlog=evtlog), evtlog=evtlog)
+    assert templates.format('Manifest', 1000, 0, None, ['A']) == 'Started A.'
+    assert templates.format('Manifest', 1000, 1, None, ['A']) == 'Started A v1.'
+    assert templates.format('Manifest', 1001, 0, None, ['A']) is None  # event has no message
+    assert templates.format('Manifest', 1002, 0, None, ['A']) is None  # unknown event
+    assert evtlog.enumerated == ['Manifest']  # once per provider
+    assert templates.format('Classic', 7036, 0, 16384, ['A']) == 'Classic A.'
+    # enumerated message ids are bounded as publisher metadata handles
+    assert list(templates.message_ids) == ['Classic']
+    assert templates.format('Manifest', 1000, 2, None, ['A']) is None
+    assert evtlog.enumerated == ['Manifest', 'Manifest']
+
+
+def test_tailer_reports_metadata_counters(caplog):
+    source = StubEventSource([[]], [range(1, 11)], read_event('system_7036.xml').decode())
+    cfg = opts.parse_tailer_config({'channels': [{'name': 'System'}], 'lookback': 0, 'exit_after_lookback': False,
+                                    'transforms': ['winevt_tailer.transforms.xml_render_message',
+                                                   'winevt_tailer.transforms.xml_to_json']})
+    with caplog.at_level(logging.INFO, logger='tailer'):
+        run_tailer(Tailer('test_metadata', cfg, source))
+    assert 'publisher metadata: 1 size, 0 hits, 1 misses, 10 negative_hits, 0 evictions' in caplog.messages
+    assert 'message templates: 1 size, 9 hits, 1 misses, 10 fallbacks' in caplog.messages
@@ -0,0 +1,72 @@
+import os
+import time
+import logging
+from winevt_tailer.tailer import Tailer
+import winevt_tailer.metrics as metrics
+import winevt_tailer.opts as opts
+from tests.stubs import run_tailer
+
+EVENTS_DIR = os.path.join(os.path.dirname(__file__), 'data', 'events')
+
+
+def test_stage_stats():
+    stats = metrics.StageStats(60)
+    timer = stats.timer('System', 'parse')
+    assert stats.timer('System', 'parse') is timer
+    stats.timer('System', 'render')
+    metrics.StageStats.add(timer, 2000)
+    metrics.StageStats.add(timer, 4000)
+    timer[1] += 1
+    assert timer == [2, 1, 6000, 4000]
+    lines = stats.report()
+    assert len(lines) == 3  # header lines + parse, render had no calls
+    assert lines[2].split()[:4] == ['System', 'parse', '2', '1']
+    assert timer == [0, 0, 0, 0]
+    assert metrics.callable_name(metrics.callable_name) == 'winevt_tailer.metrics.callable_name'
+
+
+def test_sampling_profiler(tmp_path):
+    file_name = str(tmp_path / 'test.folded')
+    profiler = metrics.SamplingProfiler(file_name, interval_ms=1)
+    profiler.start()
+    deadline = time.monotonic() + 5
+    while profiler.samples < 5 and time.monotonic() < deadline:
+        sum(range(10000))
+    assert profiler.stop() >= 5
+    assert not profiler.is_running
+    with open(file_name) as f:
+        lines = f.read().splitlines()
+    assert lines and all(line.startswith('MainThread;') for line in lines)
+    assert any('test_metrics:test_sampling_profiler' in line for line in lines)
+    assert profiler.top(1)[0][1] > 0
+
+
+def test_tailer_stats_and_profiler(tmp_path, caplog):
+    cfg = opts.parse_tailer_config({'channels': [{'name': 'Application'}, {'name': 'System'}],
+                                    'exit_after_lookback': False, 'stats_report_s': 3600,
+                                    'profile_dir': str(tmp_path),
+                                    'replay': {'corpus': EVENTS_DIR, 'limit': 50}})
+    tailer = Tailer('test_stats', cfg)
+    assert tailer.start_profiler(max_events=10)
+    assert not tailer.start_profiler()
+    with caplog.at_level(logging.INFO, logger='tailer'):
+        run_tailer(tailer)
+    assert tailer.profiler is None and tailer.process_event == tailer.process_event_timed
+    assert len(os.listdir(tmp_path)) == 1
+    stages = [line.split()[1] for line in caplog.messages if line.startswith('System ') and len(line.split()) == 8]
+    assert stages == ['render', 'parse', 'winevt_tailer.transforms.xml_remove_binary',
+                      'winevt_tailer.transforms.xml_render_message', 'winevt_tailer.transforms.xml_to_json',
+                      'tail_out']
+
+
+def test_tailer_counters_without_stats(caplog):
+    cfg = opts.parse_tailer_config({'channels': [{'name': 'Application'}, {'name': 'System'}],
+                                    'exit_after_lookback': False, 'counters_report_s': 3600,
+                                    'replay': {'corpus': EVENTS_DIR, 'limit': 50}})
+    tailer = Tailer('test_counters', cfg)
+    assert tailer.stats is None
+    tailer.counters_report_ts = 0  # report is due
+    with caplog.at_level(logging.INFO, logger='tailer'):
+        run_tailer(tailer)
+    counters = [line for line in caplog.messages if line.startswith('output: ')]
+    assert len(counters) == 2 and counters[-1].startswith('output: 50 lines')  # main loop and exit
@@ -0,0 +1,76 @@
+import re
+import pytest
+import winevt_tailer.opts as opts
+import winevt_tailer.errors as errors
+import winevt_tailer.pipeline as pipeline
+from winevt_tailer.projection import Projection
+from tests.stubs import read_event
+
+
+def append_a(context, event_h, event_obj):
+    return event_obj + 'a'
+
+
+def drop_b(context, event_h, event_obj):
+    return None if event_obj.endswith('b') else event_obj
+
+
+def test_compile_pipeline():
+    calls = []
+
+    def track(context, event_h, event_obj):
+        calls.append(event_obj)
+        return event_obj
+
+    fused = pipeline.compile_pipeline([append_a, drop_b, track])
+    assert fused.transforms == (append_a, drop_b, track)
+    assert fused({}, None, 'x') == 'xa'
+    assert fused({}, None, 'b') == 'ba'
+    assert calls == ['xa', 'ba']
+    assert pipeline.compile_pipeline([drop_b, track])({}, None, 'b') is None
+    assert calls == ['xa', 'ba']
+    assert pipeline.compile_pipeline([])({}, None, 'x') == 'x'
+
+
+def test_describe_plan():
+    config = opts.parse_tailer_config({'channels': [{'name': 'System', 'transforms': ['tests.test_pipeline.drop_b']}],
+                                       'transforms': ['tests.test_pipeline.append_a']})
+    pipelines = pipeline.compile_pipelines(config)
+    assert pipelines[0].transforms == (drop_b, append_a)
+    assert pipeline.describe_plan(config.channels, pipelines) == [
+        'compiled pipelines:',
+        '  channel: System, query: *, render: xml',
+        '    1. render',
+        '    2. parse',
+        '    3. tests.test_pipeline.drop_b',
+        '    4. tests.test_pipeline.append_a',
+        '    5. tail_out']
+
+
+def drop_b_xml(context, event_h, event_obj):
+    return None if '<b/>' in event_obj else event_obj
+
+
+drop_b_xml.needs = 'xml'
+
+
+def test_lazy_parse():
+    config = opts.parse_tailer_config({'channels': [{'name': 'Security',
+                                                     'transforms': ['winevt_tailer.transforms.xml_drop_regex']}],
+                                       'drop_regex': ['<EventID>4625<'],
+                                       'transforms': ['winevt_tailer.transforms.xml_project_json']})
+    fused = pipeline.compile_pipelines(config)[0]
+    assert fused.parse_at == 1
+    assert pipeline.describe_plan(config.channels, [fused])[2:5] == [
+        '    1. render', '    2. winevt_tailer.transforms.xml_drop_regex', '    3. parse']
+    context = {'drop_regex': re.compile(config.drop_regex[0]), 'projection': None}
+    xml_str = read_event('security_4624.xml').decode()
+    assert fused(context, None, xml_str.replace('<EventID>4624<', '<EventID>4625<')) is None  # not parsed
+    context['projection'] = Projection(config.projection)
+    assert '"EventID":"4624"' in fused(context, None, xml_str)
+    # no transform needs tree: not parsed
+    assert pipeline.compile_pipeline([drop_b_xml], None)({}, None, '<a/>') == '<a/>'
+    # raw XML string is gone after parsing
+    config.channels[0].transforms = [append_a, drop_b_xml]
+    with pytest.raises(errors.ConfigError):
+        pipeline.compile_pipelines(config)
@@ -0,0 +1,31 @@
+import json
+import pytest
+import pydantic
+from lxml import etree
+import winevt_tailer.opts as opts
+import winevt_tailer.transforms as transforms
+from winevt_tailer.projection import Projection
+from tests.stubs import read_event
+
+
+def test_project_json():
+    event_obj = etree.fromstring(read_event('security_4624.xml'))
+    context = {'projection': Projection(opts.ProjectionConfig())}
+    record = json.loads(transforms.xml_project_json(context, None, event_obj))
+    assert record == {'TimeCreated': '2022-12-01T17:12:40.9175324Z', 'Computer': 'EC2AMAZ-B48FPS0',
+                      'Channel': 'Security', 'Provider': 'Microsoft-Windows-Security-Auditing', 'EventID': '4624',
+                      'Level': '0', 'Task': '12544', 'Keywords': '0x8020000000000000', 'EventRecordID': '184025',
+                      'ProcessID': '704'}
+    # numbers, booleans, node lists, EventData flattening
+    config = opts.ProjectionConfig(fields={'count': 'count(event:EventData/event:Data)',
+                                           'has_system': 'boolean(event:System)',
+                                           'sids': "event:EventData/event:Data[contains(@Name, 'Sid')]",
+                                           'missing': 'number(event:System/event:Nope)'},
+                                   flatten_eventdata=True)
+    record = json.loads(Projection(config).project(event_obj))
+    assert record['count'] == 27 and record['has_system'] is True
+    assert record['sids'] == ['S-1-5-18', 'S-1-5-18']
+    assert 'missing' not in record
+    assert record['TargetUserName'] == 'SYSTEM' and record['LogonType'] == '5'
+    with pytest.raises(pydantic.ValidationError):
+        opts.ProjectionConfig(fields={'bad': 'event:System['})
@@ -0,0 +1,50 @@
+import json
+import logging
+from winevt_tailer.tailer import Tailer
+from winevt_tailer.sampling import EventSampler
+import winevt_tailer.opts as opts
+import winevt_tailer.transforms as transforms
+from tests.stubs import StubEventSource, read_event, run_tailer
+
+XML_STR = read_event('system_7036.xml').decode()
+
+
+def test_sample_events():
+    channel = opts.ChannelConfig(name='system', sampling=[{'levels': [4], 'rate': 0.25}])
+    context = {'sampler': EventSampler([channel], 60)}
+    passed = [transforms.xml_sample_events(context, None, XML_STR.replace('31862', str(i))) is not None
+              for i in range(1, 1001)]
+    assert 240 <= sum(passed) <= 260
+    # deterministic by record id: the same events pass again, in "values" mode too
+    record = {'Event': {'System': {'Channel': 'System', 'Level': '4', 'EventRecordID': '0'}}}
+    for i in range(1, 1001):
+        record['Event']['System']['EventRecordID'] = str(i)
+        assert (transforms.values_sample_events(context, None, record) is not None) == passed[i - 1]
+    # errors always pass, other levels and channels are not sampled
+    for xml_str in (XML_STR.replace('<Level>4<', '<Level>2<'), XML_STR.replace('<Level>4<', '<Level>3<'),
+                    XML_STR.replace('>System<', '>Application<')):
+        assert all(transforms.xml_sample_events(context, None, xml_str) is not None for _ in range(10))
+    assert context['sampler'].stats() == {'sampled_in': sum(passed) * 2, 'sampled_out': 2000 - sum(passed) * 2,
+                                          'aggregated': 0, 'records': 0}
+
+
+def test_tailer_aggregates_events(caplog):
+    for render in ('xml', 'values'):
+        caplog.clear()
+        source = StubEventSource([[]], [range(1, 51)], XML_STR)
+        cfg = opts.parse_tailer_config({'channels': [{'name': 'System', 'render': render,
+                                                      'sampling': [{'levels': [4], 'mode': 'aggregate'}]}],
+                                        'lookback': 0, 'exit_after_lookback': False,
+                                        'transforms': ['winevt_tailer.transforms.xml_sample_events',
+                                                       'winevt_tailer.transforms.xml_to_json']})
+        tailer = Tailer('test_sampling', cfg, source)
+        assert tailer.pipelines[0].render == render
+        assert tailer.pipelines[0].parse_at == (1 if render == 'xml' else None)  # sampled out events are not parsed
+        with caplog.at_level(logging.INFO, logger='tailer'):
+            lines = run_tailer(tailer)
+        assert 'sampling: 0 sampled in, 0 sampled out, 50 aggregated into 1 records' in caplog.messages
+        [event] = [json.loads(line)['Event'] for line in lines]
+        assert event['System'] == {'Provider': {'Name': 'Service Control Manager'}, 'EventID': '7036', 'Level': '4',
+                                   'Channel': 'System'}
+        assert event['Aggregate']['Count'] == '50'
+        assert event['Aggregate']['FirstTime'] == event['Aggregate']['LastTime'] == '2022-12-01T17:05:43.2296781Z'
@@ -0,0 +1,39 @@
+import logging
+from winevt_tailer.tailer import Tailer
+from winevt_tailer.scheduler import FairScheduler
+import winevt_tailer.opts as opts
+from tests.stubs import StubEventSource, read_event, run_tailer, track_emitted
+
+
+def test_fair_scheduler():
+    scheduler = FairScheduler([100, 300, 100])
+    scheduler.push(0, 1.0)
+    scheduler.push(2, 1.5)
+    scheduler.push(0, 2.0)  # queued already
+    assert len(scheduler) == 2
+    assert scheduler.pop(3.0) == 0
+    scheduler.push(0, 3.0)  # more events, back of the queue
+    assert scheduler.pop(3.5) == 2
+    assert scheduler.pop(4.0) == 0
+    assert scheduler.pop(4.0) is None
+    assert scheduler.stats(0) == {'turns': 2, 'avg_delay_ms': 1500.0, 'max_delay_ms': 2000.0}
+    assert scheduler.stats(0)['turns'] == 0
+
+
+def test_noisy_channel_does_not_starve_others(caplog):
+    xml_str = read_event('system_7036.xml').decode()
+    source = StubEventSource([[], [], []], [range(1, 2001), range(1, 6), range(1, 6)], xml_str)
+    cfg = opts.parse_tailer_config({'channels': [{'name': 'Security', 'weight': 2}, {'name': 'System'},
+                                                 {'name': 'Application'}],
+                                    'lookback': 0, 'exit_after_lookback': False, 'channel_budget': 100,
+                                    'stats_report_s': 3600})
+    tailer = Tailer('test_scheduler', cfg, source)
+    emitted = track_emitted(tailer)
+    with caplog.at_level(logging.INFO, logger='tailer'):
+        run_tailer(tailer)
+    assert len(emitted) == 2010
+    # first turn of Security is 200 events (weight 2), then other channels
+    assert emitted.index((1, 1)) == 200 and emitted.index((2, 1)) == 205
+    assert [record_id for ch_idx, record_id in emitted if ch_idx == 0] == list(range(1, 2001))
+    delay_lines = [line.split() for line in caplog.messages if line.startswith('Security ') and len(line.split()) == 4]
+    assert int(delay_lines[0][1]) == 10  # turns of 200 events
@@ -0,0 +1,246 @@
+import io
+import os
+import gzip
+import threading
+import time
+import logging
+import winevt_tailer.opts as opts
+import winevt_tailer.sinks as sinks
+import winevt_tailer.consts as consts
+from winevt_tailer.tailer import Tailer
+from tests.stubs import StubIngestServer, StubEventSource, read_event
+
+
+def test_flush_policies():
+    stream = io.StringIO()
+    sink = sinks.create_sink(opts.OutputConfig(sink='stdout'), None)
+    sink.stream = stream
+    sink.write('a')
+    sink.write('b')
+    assert stream.getvalue() == ''
+    sink.end_batch()
+    assert stream.getvalue() == 'a\nb\n'
+    # bytes policy, flush_bytes applies in all policies
+    sink = sinks.StreamSink(opts.OutputConfig(flush='bytes', flush_bytes=4), stream)
+    sink.write('cc')
+    sink.end_batch()
+    assert stream.getvalue() == 'a\nb\n'
+    sink.write('dd')
+    assert stream.getvalue() == 'a\nb\ncc\ndd\n'
+    # time policy
+    sink = sinks.StreamSink(opts.OutputConfig(flush='time', flush_ms=50), stream)
+    sink.write('e')
+    sink.end_batch()
+    assert stream.getvalue().endswith('dd\n')
+    time.sleep(0.06)
+    sink.end_batch()
+    assert stream.getvalue().endswith('dd\ne\n')
+    assert sink.stats() == {'lines': 1, 'flushes': 1}
+
+
+def test_logging_sink():
+    stream = io.StringIO()
+    logger = logging.getLogger('test_logging_sink')
+    logger.propagate = False
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    sink = sinks.LoggingSink(opts.OutputConfig(), logger)
+    sink.write('x')
+    sink.write_now(consts.STARTUP_HELLO % 'tail1')
+    sink.write('{"a" : "b"}')
+    sink.close()
+    assert stream.getvalue() == 'x\n' + consts.STARTUP_HELLO % 'tail1' + '\n{"a" : "b"}\n'
+
+
+def test_file_sink_rotation(tmp_path):
+    file_name = str(tmp_path / 'tail.log')
+    config = opts.OutputConfig(sink='file', file=file_name, rotate_bytes=1000, retain_bytes=200)
+    sink = sinks.create_sink(config, None)
+    lines = [f'{{"n":{i:05d},"pad":"{"x" * 80}"}}' for i in range(100)]
+    for line in lines:
+        sink.write(line)
+        sink.end_batch()
+    sink.close()
+    segments = sink.list_segments()
+    assert sink.stats()['rotations'] == 10 and 0 < len(segments) < 10
+    assert all(segment.endswith('.gz') for segment in segments)
+    assert sum(os.path.getsize(segment) for segment in segments) <= 200
+    # the newest segments are retained, output is complete from the oldest retained segment on
+    output = []
+    for segment in segments:
+        with gzip.open(segment, 'rt') as f:
+            output += f.read().splitlines()
+    with open(file_name) as f:
+        output += f.read().splitlines()
+    assert output == lines[-len(output):]
+
+
+def wait_for(condition, timeout_s: float = 5):
+    deadline = time.monotonic() + timeout_s
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_http_sink_acks_and_spool(tmp_path):
+    server = StubIngestServer()
+    config = opts.OutputConfig(sink='http', url=server.url, spool_dir=str(tmp_path), connections=1, retries=1,
+                               retry_backoff_ms=10)
+    sink = sinks.create_sink(config, None)
+    try:
+        sink.write_now(consts.STARTUP_HELLO % 'tail1')  # not sent to ingest
+        # bookmark marks are acknowledged only after endpoint responds
+        server.mode = 'hold'
+        sink.write('{"n":1}')
+        sink.mark(0, 'e1')
+        sink.end_batch()
+        wait_for(lambda: server.requests == 1)
+        assert sink.take_acked() == []
+        server.release()
+        acked = []
+        wait_for(lambda: acked.extend(sink.take_acked()) or acked)
+        assert acked == [(0, 'e1')]
+        # endpoint is down: batches are retried, then spooled and acknowledged
+        server.mode = 'failing'
+        for n in (2, 3):
+            sink.write(f'{{"n":{n}}}')
+            sink.mark(1, f'e{n}')
+            sink.end_batch()
+        wait_for(lambda: acked.extend(sink.take_acked()) or len(acked) == 3)
+        assert acked[1:] == [(1, 'e2'), (1, 'e3')] and len(sink.list_spool()) == 2
+        # spool has batches: new batch goes there too, so order is kept
+        sink.write('{"n":4}')
+        sink.end_batch()
+        assert len(sink.list_spool()) == 3
+        # endpoint recovers: spool is sent
+        server.mode = 'ok'
+        wait_for(lambda: not sink.list_spool())
+        sink.close()
+        assert server.lines == ['{"n":1}', '{"n":2}', '{"n":3}', '{"n":4}']
+        assert server.connections <= 3  # sender and spool connections are reused
+        # batch 3 is spooled after batch 2 without retries
+        assert sink.stats() == {'lines': 4, 'flushes': 4, 'batches_sent': 1, 'retries': 1, 'spooled': 3,
+                                'spool_sent': 3, 'rejected': 0}
+    finally:
+        sink.close()
+        server.close()
+
+
+def test_http_sink_order_after_failed_batch(tmp_path):
+    server = StubIngestServer()
+    server.fail_requests = 1
+    config = opts.OutputConfig(sink='http', url=server.url, spool_dir=str(tmp_path), retries=0, retry_backoff_ms=10)
+    sink = sinks.create_sink(config, None)
+    try:
+        # the first batch is spooled, batches after it are spooled too till spool is sent
+        for n in range(1, 21):
+            sink.write(f'{{"n":{n}}}')
+            sink.end_batch()
+        wait_for(lambda: len(server.lines) == 20)
+        sink.close()
+        assert server.lines == [f'{{"n":{n}}}' for n in range(1, 21)]
+        assert sink.stats()['spooled'] >= 1
+    finally:
+        sink.close()
+        server.close()
+
+
+def test_http_sink_interrupt(tmp_path):
+    server = StubIngestServer()
+    server.mode = 'hold'  # endpoint does not respond
+    config = opts.OutputConfig(sink='http', url=server.url, spool_dir=str(tmp_path), max_in_flight=4, timeout_s=30,
+                               spool_max_mb=0)
+    sink = sinks.create_sink(config, None)
+    try:
+        for n in range(1, 5):
+            sink.write(f'{{"n":{n}}}')
+            sink.mark(0, f'e{n}')
+            sink.end_batch()
+        wait_for(lambda: server.requests == 1)
+        t0 = time.monotonic()
+        sink.interrupt()
+        sink.close()
+        assert time.monotonic() - t0 < 2  # request in progress is aborted, queued batches are dropped
+        assert sink.take_acked() == [] and server.requests == 1
+    finally:
+        sink.close()
+        server.close()
+
+
+def test_tailer_http_sink_bookmarks(tmp_path):
+    xml_str = read_event('system_7036.xml').decode()
+    server = StubIngestServer()
+    cfg = opts.parse_tailer_config({'channels': [{'name': 'System'}], 'lookback': 0, 'exit_after_lookback': False,
+                                    'persistent': True, 'bookmarks_dir': str(tmp_path), 'batch_size': 10,
+                                    'transforms': ['winevt_tailer.transforms.xml_to_json'],
+                                    'output': {'sink': 'http', 'url': server.url, 'retry_backoff_ms': 10,
+                                               'spool_max_mb': 0}})
+    try:
+        tailer = Tailer('test_http', cfg, StubEventSource([[]], [range(1, 51)], xml_str))
+        assert tailer.run() == 0
+        assert len(server.lines) == 50
+        # endpoint is down and spool is full: bookmark does not advance, events are tailed again after restart
+        server.mode = 'failing'
+        tailer = Tailer('test_http', cfg, StubEventSource([[]], [range(51, 61)], xml_str))
+        assert [bookmark.record_id for bookmark in tailer.bookmarks] == [50]
+        assert tailer.run() == 0
+        tailer = Tailer('test_http', cfg, StubEventSource([[]], [[]], xml_str))
+        assert [bookmark.record_id for bookmark in tailer.bookmarks] == [50] and len(server.lines) == 50
+    finally:
+        server.close()
+
+
+class StalledStream(io.StringIO):
+    """
+    Stream whose consumer stalls till resume() is called
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.resumed = threading.Event()
+
+    def write(self, s):
+        self.resumed.wait()
+        return super().write(s)
+
+    def resume(self):
+        self.resumed.set()
+
+
+def test_queued_sink_spills_when_consumer_stalls(tmp_path):
+    stream = StalledStream()
+    config = opts.OutputConfig(sink='stdout', queue_kb=1, spill_mb=1, spill_file=str(tmp_path / 'out.spill'))
+    sink = sinks.QueuedSink(config, sinks.StreamSink(config, stream))
+    lines = [f'{{"n":{i:04d},"pad":"{"x" * 80}"}}' for i in range(100)]
+    for i, line in enumerate(lines):
+        sink.write(line)
+        sink.mark(0, i)
+        sink.end_batch()  # does not block: memory queue, then spill
+    stats = sink.stats()
+    assert stats['queued'] >= 90 and stats['spilled_bytes'] > 0 and stats['blocked_s'] == 0
+    assert sink.take_acked() == []  # nothing is written yet
+    stream.resume()
+    sink.close()
+    assert stream.getvalue().splitlines() == lines  # in order
+    assert [event_h for _, event_h in sink.take_acked()] == list(range(100))
+    assert sink.stats()['queued'] == 0 and not tmp_path.joinpath('out.spill').exists()
+
+
+def test_queued_sink_splits_batch_larger_than_spill(tmp_path):
+    stream = StalledStream()
+    config = opts.OutputConfig(sink='stdout', queue_kb=1, spill_mb=1, flush_bytes=1 << 30,
+                               spill_file=str(tmp_path / 'out.spill'))
+    sink = sinks.QueuedSink(config, sinks.StreamSink(config, stream))
+    lines = [f'{{"n":{i:04d},"pad":"{"x" * 1000}"}}' for i in range(2500)]  # 2.5MB
+    threading.Timer(0.5, stream.resume).start()
+    for i in range(2):  # the first batch is queued in memory, the second is spilled by records as consumer resumes
+        for line in lines:
+            sink.write(line)
+        sink.mark(0, i)
+        sink.flush()
+    assert sink.stats()['spilled_bytes'] > 0
+    sink.close()
+    assert stream.getvalue().splitlines() == lines + lines
+    assert [event_h for _, event_h in sink.take_acked()] == [0, 1]
@@ -0,0 +1,35 @@
+import os
+import json
+from winevt_tailer.tailer import Tailer
+from winevt_tailer.sources import ReplayEventSource, load_corpus
+import winevt_tailer.opts as opts
+from tests.stubs import run_tailer
+
+EVENTS_DIR = os.path.join(os.path.dirname(__file__), 'data', 'events')
+
+
+def test_replay_source_channel_mix():
+    channels = [opts.ChannelConfig(name='Application'), opts.ChannelConfig(name='System')]
+    replay_cfg = opts.ReplayConfig(corpus=EVENTS_DIR, channel_mix={'System': 1}, limit=5)
+    source = ReplayEventSource(replay_cfg, channels)
+    sub = source.subscribe(1)
+    assert source.next(source.query(1), 10, 0) == []
+    events = source.next(sub, 10, 0)
+    assert [event_h.record_id for event_h in events] == [1, 2, 3, 4, 5]
+    assert all('<Channel>System</Channel>' in source.render_xml(event_h) for event_h in events)
+    assert source.exhausted
+    bookmark = source.create_bookmark()
+    source.update_bookmark(bookmark, events[-1])
+    assert source.create_bookmark(source.render_bookmark(bookmark)).record_id == 5
+
+
+def test_tailer_replay():
+    cfg = opts.parse_tailer_config({'channels': [{'name': 'Application'}, {'name': 'System'}],
+                                    'exit_after_lookback': False,
+                                    'replay': {'corpus': EVENTS_DIR, 'limit': 100}})
+    tailer = Tailer('test_replay', cfg)
+    lines = run_tailer(tailer)
+    assert len(lines) == 100
+    channels = {json.loads(line)['Event']['System']['Channel'] for line in lines}
+    assert channels == {'Application', 'System'}
+    assert len(load_corpus(EVENTS_DIR)) == 6
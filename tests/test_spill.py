@@ -0,0 +1,18 @@
+from winevt_tailer.spill import SpillRing
+
+
+def test_spill_ring(tmp_path):
+    ring = SpillRing(str(tmp_path / 'out.spill'), 64)
+    assert ring.read() is None
+    records = [bytes([65 + i]) * 10 for i in range(8)]  # 14 bytes each with header
+    assert all(ring.write(record) for record in records[:4])
+    assert not ring.write(records[4])  # 56 of 64 bytes used
+    assert ring.read() == records[0] and ring.read() == records[1]
+    assert ring.write(records[4]) and ring.write(records[5])  # wrapped to file start
+    assert not ring.write(records[6])
+    assert [ring.read() for _ in range(4)] == records[2:6]
+    assert len(ring) == 0 and ring.used == 0 and ring.read() is None
+    assert ring.write(b'x' * 60) and not ring.write(b'')  # empty ring starts at file start
+    assert ring.read() == b'x' * 60
+    ring.close()
+    assert not tmp_path.joinpath('out.spill').exists()
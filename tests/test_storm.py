@@ -0,0 +1,51 @@
+import json
+import logging
+import pytest
+from lxml import etree
+from winevt_tailer.tailer import Tailer
+from winevt_tailer.storm import StormSuppressor
+import winevt_tailer.opts as opts
+import winevt_tailer.errors as errors
+from tests.stubs import StubEventSource, read_event, run_tailer
+
+XML_STR = read_event('system_7036.xml').decode()
+
+
+def test_storm_suppressor():
+    storm = StormSuppressor(opts.StormConfig(data=['param2'], forward=2, max_fingerprints=2))
+    stopped = etree.fromstring(XML_STR.replace('>running<', '>stopped<'))
+    fingerprint = storm.xml_fingerprint(etree.fromstring(XML_STR))
+    assert fingerprint == ('System', 'Service Control Manager', '7036', '4', 'running')
+    assert storm.xml_fingerprint(stopped) != fingerprint
+    passed = [storm.fold(fingerprint, i, etree.fromstring(XML_STR), f'T{i}') for i in range(5)]
+    assert passed == [True, True, False, False, False]
+    assert storm.fold(storm.xml_fingerprint(stopped), 5, stopped, 'T5')
+    assert storm.fold(('other',), 6, None, 'T6')  # table is full, the least recently seen is evicted
+    assert storm.stats() == {'fingerprints': 2, 'passed': 4, 'folded': 3, 'summaries': 1, 'evicted': 1}
+    [(event_h, summary)] = storm.sweep(0)  # evicted summary is output on next sweep
+    assert event_h == 4
+    assert dict(summary.find('Folded').attrib) == {'Count': '3', 'FirstTime': 'T2', 'LastTime': 'T4'}
+    assert storm.sweep(0, flush=True) == []  # nothing folded in other windows
+
+
+def test_tailer_folds_storm(caplog):
+    for render in ('xml', 'values'):
+        caplog.clear()
+        source = StubEventSource([[]], [range(1, 51)], XML_STR)
+        cfg = opts.parse_tailer_config({'channels': [{'name': 'System', 'render': render}], 'lookback': 0,
+                                        'exit_after_lookback': False, 'storm': {'forward': 5},
+                                        'transforms': ['winevt_tailer.transforms.xml_fold_storms',
+                                                       'winevt_tailer.transforms.xml_to_json']})
+        tailer = Tailer('test_storm', cfg, source)
+        assert tailer.pipelines[0].render == render
+        with caplog.at_level(logging.INFO, logger='tailer'):
+            lines = run_tailer(tailer)
+        assert 'storm suppression: 0 fingerprints, 5 passed, 45 folded, 1 summaries, 0 evicted' in caplog.messages
+        events = [json.loads(line)['Event'] for line in lines]
+        assert len(events) == 6 and all('Folded' not in event for event in events[:5])
+        assert events[5]['Folded']['Count'] == '45'
+        assert events[5]['Folded']['FirstTime'] == '2022-12-01T17:05:43.2296781Z'
+    # summaries pass through transforms that follow suppressor, same for all channels in top level transforms only
+    with pytest.raises(errors.ConfigError):
+        opts.parse_tailer_config({'channels': [{'name': 'System',
+                                                'transforms': ['winevt_tailer.transforms.xml_fold_storms']}]})
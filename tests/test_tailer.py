@@ -1,6 +1,9 @@
+import os
 from winevt_tailer.tailer import Tailer
 import winevt_tailer.opts as opts
 
+EVENTS_DIR = os.path.join(os.path.dirname(__file__), 'data', 'events')
+
 
 def test_stop():
     cfg_dic = {'channels': [{'name': 'Test'}]}
@@ -12,3 +15,15 @@ def test_stop():
     assert tailer.is_stop is True
     res2 = tailer.stop()
     assert res2 is False
+
+
+def test_stop_interrupts_output():
+    cfg = opts.parse_tailer_config({'channels': [{'name': 'Application'}], 'replay': {'corpus': EVENTS_DIR}})
+    for force in (False, True):
+        tailer = Tailer('test_stop', cfg)
+        interrupts = []
+        tailer.sink.interrupt = lambda: interrupts.append(True)
+        assert tailer.stop(force) is True
+        assert len(interrupts) == int(force)  # queued output is drained on graceful stop
+        assert tailer.stop() is False
+        assert len(interrupts) == int(force) + 1  # repeated stop interrupts output
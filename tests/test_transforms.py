@@ -1,7 +1,16 @@
+import os
+import glob
 import winevt_tailer.transforms as transforms
+import winevt_tailer.render as render
+import winevt_tailer.opts as opts
+import winevt_tailer.pipeline as pipeline
 import lxml
 from lxml import etree
 import json
+from winevt_tailer.metadata import PublisherMetadataCache, MessageTemplateCatalog
+from tests.stubs import StubEvtlog, StubEvent, read_event
+
+EVENTS_DIR = os.path.join(os.path.dirname(__file__), 'data', 'events')
 
 
 def test_xml_to_json():
@@ -43,3 +52,82 @@ def test_xml_to_json():
     json_str: str = transforms.xml_to_json({}, None, event_obj)
     json.loads(json_str)
     assert json_str.find('\n') == -1
+
+
+def test_xml_to_json_golden():
+    # with json_drop_cr native serializer output must be byte-identical to XSLT output for golden corpus,
+    # by default carriage returns are escaped
+    for xml_file in sorted(glob.glob(os.path.join(EVENTS_DIR, '*.xml'))):
+        with open(xml_file, 'rb') as f:
+            event_obj = lxml.etree.fromstring(f.read())
+        with open(xml_file[:-4] + '.json', 'r', encoding='utf-8', newline='') as f:
+            golden = f.read().rstrip('\n')
+        assert transforms.xml_to_json({'json_drop_cr': True}, None, event_obj) == golden, xml_file
+        assert transforms.xml_to_json_xslt({}, None, event_obj) == golden, xml_file
+        json_str = transforms.xml_to_json({}, None, event_obj)
+        assert json_str.replace('\\r', '') == golden, xml_file
+        assert ('\\r' in json_str) == ('\r' in ''.join(event_obj.itertext())), xml_file
+
+
+def test_xml_to_json_escape():
+    event_obj = lxml.etree.fromstring('<Event><EventData><Data Name="a\\&quot;b">x\ty&#13;\nz\\"</Data>'
+                                      '</EventData></Event>')
+    json_str: str = transforms.xml_to_json({}, None, event_obj)
+    assert json_str.find('\n') == -1
+    data = json.loads(json_str)['Event']['EventData']['Data']
+    assert data['Name'] == 'a\\"b'
+    assert data['text'] == 'x\ty\r\nz\\"'
+    json_str = transforms.xml_to_json({'json_drop_cr': True}, None, event_obj)
+    assert json.loads(json_str)['Event']['EventData']['Data']['text'] == 'x\ty\nz\\"'
+
+
+def test_xml_render_message():
+    message_id = (16384 << 16) | 7036
+    evtlog = StubEvtlog(['Service Control Manager'], {message_id: 'The %1 service entered the %2 state.'})
+    metadata_cache = PublisherMetadataCache(evtlog=evtlog)
+    context = {'publisher_metadata': metadata_cache,
+               'message_templates': MessageTemplateCatalog(metadata_cache, evtlog=evtlog)}
+    for _ in range(2):
+        event_obj = lxml.etree.fromstring(read_event('system_7036.xml'))
+        event_obj = transforms.xml_render_message(context, None, event_obj)
+        message = event_obj.xpath("/event:Event/Message", namespaces=transforms.g_event_ns)
+        assert message[0].text == 'The Windows Modules Installer service entered the running state.'
+    # template fetched once, EvtFormatMessage is not called per event
+    assert evtlog.formatted == [('Service Control Manager', evtlog.EvtFormatMessageId, message_id)]
+
+
+def test_values_render_mode():
+    message_id = (16384 << 16) | 7036
+    evtlog = StubEvtlog(['Service Control Manager'], {message_id: 'The %1 service entered the %2 state.'})
+    metadata_cache = PublisherMetadataCache(evtlog=evtlog)
+    context = {'publisher_metadata': metadata_cache,
+               'message_templates': MessageTemplateCatalog(metadata_cache, evtlog=evtlog)}
+    config = opts.parse_tailer_config({'channels': [{'name': 'System', 'render': 'values',
+                                                     'value_names': ['service']},
+                                                    {'name': 'Application', 'render': 'values',
+                                                     'transforms': ['winevt_tailer.transforms.xml_to_json_xslt']}],
+                                       'transforms': ['winevt_tailer.transforms.xml_remove_binary',
+                                                      'winevt_tailer.transforms.xml_render_message']})
+    pipelines = pipeline.compile_pipelines(config)
+    assert pipelines[0].render == 'values'
+    assert pipelines[0].transforms == (transforms.values_render_message,)
+    assert pipelines[1].render == 'values'
+    event_h = StubEvent(read_event('system_7036.xml').decode())
+    system, user = render.ValuesRenderer(evtlog).render(event_h)
+    record = pipelines[0](context, event_h, render.build_record(system, user, config.channels[0].value_names))
+    assert record['Event']['System']['EventID'] == {'Qualifiers': '16384', 'text': '7036'}
+    assert record['Event']['System']['Execution'] == {'ProcessID': '648', 'ThreadID': '5104'}
+    assert record['Event']['EventData'] == {'service': 'Windows Modules Installer', 'Data': ['running']}
+    assert record['Event']['Message'] == 'The Windows Modules Installer service entered the running state.'
+    # System part is the same as in xml_to_json output, except attributes that are not rendered as values
+    xml_system = json.loads(transforms.xml_to_json({}, None, lxml.etree.fromstring(read_event('system_7036.xml'))))
+    xml_system = xml_system['Event']['System']
+    del xml_system['Provider']['EventSourceName'], xml_system['Correlation'], xml_system['Security']
+    assert record['Event']['System'] == xml_system
+    json_str = transforms.values_to_json(context, event_h, transforms.values_remove_eventdata(context, None, record))
+    assert 'EventData' not in json.loads(json_str)['Event']
+    # custom transforms need XML tree
+    def custom(context, event_h, event_obj):
+        return event_obj
+
+    assert pipeline.tree_transforms([transforms.xml_to_json, custom]) == [custom]
@@ -0,0 +1,63 @@
+import hashlib
+import logging
+from lxml import etree
+from winevt_tailer.tailer import Tailer
+import winevt_tailer.opts as opts
+import winevt_tailer.transforms as transforms
+from winevt_tailer.truncation import Truncator, water_level
+from tests.stubs import StubEventSource, read_event, run_tailer
+
+XML_STR = read_event('powershell_4104.xml').decode()
+
+
+def test_truncate_fields():
+    assert water_level([10, 100, 1000], 300) == 190
+    assert water_level([10, 20], 300) == 20
+    context = {'truncator': Truncator(opts.TruncateConfig(field_bytes=100, event_bytes=0, marker='~',
+                                                          hash='sha256'))}
+    event_obj = etree.fromstring(XML_STR)
+    script = event_obj.xpath("//event:Data[@Name='ScriptBlockText']", namespaces=transforms.g_event_ns)[0]
+    text = script.text
+    assert transforms.xml_truncate_fields(context, None, event_obj) is event_obj
+    assert script.text == text[:99] + '~'
+    assert script.get('OriginalLength') == str(len(text))
+    assert script.get('TruncatedHash') == hashlib.sha256(text[99:].encode()).hexdigest()
+    assert context['truncator'].stats() == {'Microsoft-Windows-PowerShell': {'events': 1, 'fields': 1,
+                                                                             'bytes': len(text) - 99}}
+    # event limit: the largest fields are truncated further, small ones are kept
+    context = {'truncator': Truncator(opts.TruncateConfig(field_bytes=0, event_bytes=150, marker='~'))}
+    event_obj = etree.fromstring(XML_STR)
+    script, path = event_obj.xpath("//event:Data[@Name='ScriptBlockText' or @Name='Path']",
+                                   namespaces=transforms.g_event_ns)
+    script.text = 'x' * 50
+    path.text = 'é' * 80  # 160 bytes in UTF-8, multi-byte char is not split
+    transforms.xml_truncate_fields(context, None, event_obj)
+    assert script.text == 'x' * 50 and script.get('OriginalLength') is None
+    assert path.text == 'é' * 30 + '~'  # 150 - 2 - 36 (ScriptBlockId) - 50 - 1 (marker) = 61 bytes
+    assert path.get('OriginalLength') == '160' and path.get('TruncatedHash') is None
+
+
+def test_values_truncate_fields():
+    context = {'truncator': Truncator(opts.TruncateConfig(field_bytes=24, event_bytes=0))}
+    record = {'Event': {'System': {'Provider': {'Name': 'P'}},
+                        'EventData': {'Short': 'abc', 'Long': 'a' * 30, 'Data': ['b' * 30, 'c']},
+                        'Message': 'd' * 25}}
+    assert transforms.xml_truncate_fields.values_xform(context, None, record) is record
+    assert record['Event']['EventData'] == {'Short': 'abc',
+                                            'Long': {'OriginalLength': '30', 'text': 'a' * 10 + '...[truncated]'},
+                                            'Data': [{'OriginalLength': '30', 'text': 'b' * 10 + '...[truncated]'},
+                                                     'c']}
+    assert record['Event']['Message'] == {'OriginalLength': '25', 'text': 'd' * 10 + '...[truncated]'}
+    assert context['truncator'].stats() == {'P': {'events': 1, 'fields': 3, 'bytes': 20 + 20 + 15}}
+
+
+def test_tailer_reports_truncations(caplog):
+    source = StubEventSource([[]], [range(1, 11)], read_event('system_7036.xml').decode())
+    cfg = opts.parse_tailer_config({'channels': [{'name': 'System'}], 'lookback': 0, 'exit_after_lookback': False,
+                                    'truncate': {'field_bytes': 16},
+                                    'transforms': ['winevt_tailer.transforms.xml_truncate_fields',
+                                                   'winevt_tailer.transforms.xml_to_json']})
+    with caplog.at_level(logging.INFO, logger='tailer'):
+        run_tailer(Tailer('test_truncation', cfg, source))
+    counts = [line.split()[-3:] for line in caplog.messages if line.startswith('Service Control Manager ')]
+    assert counts == [['10', '20', '970']]  # events, fields, bytes removed
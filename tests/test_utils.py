@@ -1,3 +1,5 @@
+import sys
+import subprocess
 import winevt_tailer.utils as utils
 
 
@@ -10,3 +12,17 @@ def test_is_valid_xpath():
         assert utils.is_valid_xpath(q)
     for q in bad:
         assert not utils.is_valid_xpath(q)
+
+
+def test_process_ancestry():
+    ancestry = utils.get_process_ancestry(limit=2)
+    assert 0 < len(ancestry) <= 2
+    assert utils.is_service(['cmd.exe', 'services.exe']) and not utils.is_service(['explorer.exe'])
+    assert utils.is_agent_child(['mezmo-agent.exe', 'services.exe']) and not utils.is_agent_child([])
+    # --version does not import heavy modules
+    code = ('import sys, winevt_tailer.args as a\n'
+            'try:\n    a.parse_cmd_args(["-v"])\nexcept SystemExit:\n    pass\n'
+            'assert not {"pydantic", "lxml", "yaml", "psutil"} & set(sys.modules), sys.modules.keys()')
+    proc = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True)
+    assert proc.returncode == 0, proc.stderr
+    assert proc.stdout.startswith('winevt-tailer ')
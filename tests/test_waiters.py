@@ -0,0 +1,74 @@
+import random
+import threading
+from winevt_tailer.tailer import Tailer
+from winevt_tailer.waiters import ChannelWaiter
+import winevt_tailer.opts as opts
+from winevt_tailer.sources import ReplayEvent
+from tests.stubs import StubEventSource, StubWin32Event, read_event, run_tailer, track_emitted
+
+CHANNELS = 300
+
+
+class SignalledEventSource(StubEventSource):
+    """
+    New events are added by feed() when Tailer waits for them, signalled and waited by ChannelWaiter
+    """
+
+    def __init__(self, count: int, xml_str: str, win32event):
+        super().__init__([[] for _ in range(count)], [[] for _ in range(count)], xml_str)
+        self.xml_str = xml_str
+        self.waiter = ChannelWaiter(count, win32event)
+        self.fed = False
+        self.waiting = threading.Event()
+
+    @property
+    def exhausted(self) -> bool:
+        return self.fed and super().exhausted
+
+    def feed(self, events: list):
+        self.waiting.wait()
+        for ch_idx, record_id in events:
+            self.new[ch_idx].append(ReplayEvent(ch_idx, self.xml_str, record_id, 0))
+            self.waiter.win32event.SetEvent(self.waiter.signals[ch_idx])
+        self.fed = True
+
+    def wait(self, timeout_ms: int):
+        self.waiting.set()
+        return self.waiter.wait(timeout_ms)
+
+    def close(self):
+        self.waiter.close()
+
+
+def test_channel_waiter_sharding():
+    win32event = StubWin32Event()
+    waiter = ChannelWaiter(CHANNELS, win32event)
+    assert len(waiter.threads) == 5  # 63 channels per thread
+    for ch_idx in (0, 62, 63, 150, 299):
+        win32event.SetEvent(waiter.signals[ch_idx])
+    win32event.SetEvent(waiter.signals[150])  # queued once
+    assert sorted(waiter.wait(1000) for _ in range(5)) == [0, 62, 63, 150, 299]
+    assert waiter.wait(10) is None
+    waiter.close()
+    assert not waiter.threads and win32event.max_handles == 64
+    assert ChannelWaiter(64, win32event).threads == []
+
+
+def test_tailer_many_channels():
+    win32event = StubWin32Event()
+    source = SignalledEventSource(CHANNELS, read_event('system_7036.xml').decode(), win32event)
+    cfg = opts.parse_tailer_config({'channels': [{'name': f'Channel{i}'} for i in range(CHANNELS)],
+                                    'lookback': 0, 'exit_after_lookback': False, 'wait_timeout_ms': 10})
+    tailer = Tailer('test_waiters', cfg, source)
+    emitted = track_emitted(tailer)
+    events = [(ch_idx, record_id) for record_id in range(1, 4) for ch_idx in range(CHANNELS)]
+    random.Random(0).shuffle(events)
+    events.sort(key=lambda event: event[1])  # per channel in order
+    feeder = threading.Thread(target=source.feed, args=(events,))
+    feeder.start()
+    run_tailer(tailer)
+    feeder.join()
+    assert [[record_id for idx, record_id in emitted if idx == ch_idx] for ch_idx in range(CHANNELS)] == \
+        [[1, 2, 3]] * CHANNELS
+    assert [bookmark.record_id for bookmark in tailer.bookmarks] == [3] * CHANNELS
+    assert not source.waiter.threads
@@ -0,0 +1,61 @@
+import os
+import time
+import random
+import threading
+import pytest
+from winevt_tailer.tailer import Tailer
+import winevt_tailer.opts as opts
+import winevt_tailer.workers as workers
+from tests.stubs import run_tailer, track_emitted
+
+EVENTS_DIR = os.path.join(os.path.dirname(__file__), 'data', 'events')
+
+
+def jitter(context, event_h, event_obj):
+    time.sleep(random.random() / 1000)  # workers finish out of order
+    return None if event_h.record_id % 7 == 0 else event_obj
+
+
+def test_pipelined_tailer_order_and_bookmarks():
+    cfg = opts.parse_tailer_config({'channels': [{'name': 'Application'}, {'name': 'System'}],
+                                    'exit_after_lookback': False, 'workers': 4, 'queue_depth': 4,
+                                    'transforms': ['tests.test_workers.jitter',
+                                                   'winevt_tailer.transforms.xml_to_json'],
+                                    'replay': {'corpus': EVENTS_DIR, 'limit': 300}})
+    tailer = Tailer('test_workers', cfg)
+    emitted = track_emitted(tailer)
+    run_tailer(tailer)
+    assert len(emitted) == 300 - 300 // 7
+    for ch_idx in range(2):
+        ids = [record_id for idx, record_id in emitted if idx == ch_idx]
+        assert ids == sorted(ids)
+        assert tailer.bookmarks[ch_idx].record_id == ids[-1]
+
+
+def test_pipelined_processor_error():
+    class Handler:
+        output_lock = threading.Lock()
+        emitted = []
+
+        def process_event(self, ch_idx, event_h):
+            if event_h == 3:
+                raise ValueError('bad event')
+            return event_h
+
+        def emit(self, ch_idx, event_h, event_obj):
+            self.emitted.append(event_obj)
+
+        def end_batch(self):
+            pass
+
+        def batch_done(self, ch_idx, last_event_h):
+            pass
+
+    handler = Handler()
+    processor = workers.create_processor(handler, 2, 2)
+    processor.submit(0, [1, 2])
+    processor.submit(0, [3, 4])
+    processor.submit(0, [5])
+    with pytest.raises(ValueError):
+        processor.close()
+    assert handler.emitted == [1, 2]
@@ -1,9 +1,10 @@
-from pathlib import Path
-from single_source import get_version
-import os
-import winevt_tailer.errors as errors
-
-__version__ = get_version(__name__, Path(__file__).parent.parent)
-
-if os.name != 'nt':
-    raise errors.TailerError("This code is designed to run only on Windows!")
+def __getattr__(name):
+    # __version__ is resolved on first access: single_source pulls in importlib.metadata, that is the most of import
+    # time of the package
+    if name == '__version__':
+        from pathlib import Path
+        from single_source import get_version
+        global __version__
+        __version__ = get_version(__name__, Path(__file__).parent.parent)
+        return __version__
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -0,0 +1,96 @@
+import argparse
+import sys
+import os
+import re
+import winevt_tailer.errors as errors
+import winevt_tailer.consts as consts
+
+# Command line arguments. Imports nothing heavy (pydantic, lxml, pywin32), so --version and --help do not pay for them,
+# see scripts/bench_startup.py
+
+
+class VersionAction(argparse.Action):
+    # same as argparse "version" action, version is resolved only when it is printed
+    def __init__(self, option_strings, dest=argparse.SUPPRESS, default=argparse.SUPPRESS, help=None):
+        super().__init__(option_strings=option_strings, dest=dest, default=default, nargs=0, help=help)
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        import winevt_tailer
+        print(f'{consts.TAILER_TYPE} {winevt_tailer.__version__}')
+        parser.exit()
+
+
+def str_regex_type(arg_value, regex_str):
+    pat = re.compile(regex_str)
+    if not pat.match(arg_value):
+        raise errors.ArgError(f"Invalid 'name' value: '{arg_value}', allowed: '{regex_str}'")
+    return arg_value
+
+
+def yaml_regex_type(arg_value):
+    import yaml
+    try:
+        yaml.safe_load(arg_value)
+    except Exception as ex:
+        raise errors.ArgError(ex)
+    return arg_value
+
+
+def transforms_path_type(arg_value):
+    # can be directory or file (zip)
+    if not os.path.exists(arg_value):
+        raise errors.ArgError(f"Transform path does exist: '{arg_value}'")
+    if not os.access(arg_value, os.R_OK):
+        raise errors.ArgError(f"Cannot access: '{arg_value}'")
+    return arg_value
+
+
+def parse_cmd_args(argv=None):
+    """
+    Args:
+        argv[str]: argv list, default: sys.argv[1:]
+    Returns:
+        dict: parsed arguments as argparse dict
+    """
+    parser = argparse.ArgumentParser(description='Tail Windows Event logs using single-line JSON format',
+                                     add_help=False)
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('-v', '--version', action=VersionAction, help="Show program version info and exit.")
+    group.add_argument('-h', '--help', action='help', default=argparse.SUPPRESS,
+                       help='Show this help message and exit.')
+    group.add_argument('-l', '--list', action='store_true', help='List event channel names accessible to current '
+                                                                 'user. Some channels may need Admin rights.')
+    group.add_argument('-e', '--print_config', action='store_true', help='Print effective config and exit.')
+    group.add_argument('-i', '--install_service', action='store_true', help='Install windows service.')
+    group.add_argument('-u', '--uninstall_service', action='store_true', help='Uninstall windows service.')
+    group.add_argument('-r', '--reset', action='store_true', help='Reset persistent state - delete event bookmarks.')
+    group.add_argument('--toggle_profiler', action='store_true', help='Start or stop sampling profiler in running '
+                                                                      'tailer with the same name and exit.')
+    parser.add_argument('-f', '--follow', action='store_true', help='Follow and output new events as they arrive. '
+                                                                    'True in service mode.')
+    parser.add_argument('-p', '--persistent', action='store_true',
+                        help='Remember last tailed event for each channel and '
+                             'tail only new events after restart. Default: off', default=None)
+    parser.add_argument('-c', '--config', dest='config_file', help='Config file path, file format: YAML',
+                        type=argparse.FileType('r'), metavar='filepath')
+    parser.add_argument('-n', '--name', help='Tailer name. Also defines where to look for config: '
+                                             f'{consts.TAILER_TYPE}/<name> in YAML file; TAILER_CONFIG_<name> and '
+                                             'TAILER_LOGGING_<name> in env vars (as YAML string)',
+                        type=lambda val: str_regex_type(val, regex_str=r'^[^\s]+$'), default=consts.DEFAULT_TAILER_NAME)
+    parser.add_argument('-b', '--lookback', type=int, help='Defines how many old events to tail. -1 means all '
+                                                           f'available events. default is {consts.DEFAULT_LOOKBACK}. '
+                                                           'Applied in non-persistent mode or when event channel '
+                                                           'persistent state was not stored.')
+    parser.add_argument('--tailer_config', help='Named tailer config section as YAML string', type=yaml_regex_type)
+    parser.add_argument('--logging_config', help='Logging config section as YAML string', type=yaml_regex_type)
+    parser.add_argument('-t', '--transforms_path', help='Path to custom transforms', type=transforms_path_type)
+    parser.add_argument('-s', '--startup_hello', action='store_true',
+                        help='Output Startup Hello line. Part of Mezmo Agent Tailer API. Default: off', default=None)
+    parser.add_argument('--profile', type=int, metavar='EVENTS',
+                        help='Run sampling profiler from start and stop it after EVENTS events, 0 - until exit. '
+                             'Profile is stored to profile_dir as collapsed stacks.')
+    #
+    if argv is None:
+        argv = sys.argv[1:]
+    args = parser.parse_args(argv)
+    return args
@@ -0,0 +1,46 @@
+class BatchSizer:
+    """
+    EvtNext batch size and timeout of one channel. In adaptive mode batch size doubles while channel keeps returning
+    full batches (backlog, e.g. lookback or catch-up after restart) and halves when batches are sparse - less than
+    a quarter full, so events are output sooner on quiet channels. Empty batches mean channel is drained and do not
+    change the size.
+    """
+
+    def __init__(self, size: int, timeout_ms: int, adaptive: bool = False, min_size: int = 1, max_size: int = 1000):
+        self.adaptive = adaptive
+        self.min_size = max(1, min_size)
+        self.max_size = max(self.min_size, max_size)
+        self.size = min(max(size, self.min_size), self.max_size) if adaptive else max(1, size)
+        self.timeout_ms = timeout_ms
+        # since last stats reset
+        self.batches = 0
+        self.events = 0
+        self.full_batches = 0
+        self.peak_size = self.size
+
+    def update(self, fetched: int):
+        """
+        Called after each EvtNext with number of events returned
+        """
+        if fetched == 0:
+            return
+        self.batches += 1
+        self.events += fetched
+        if fetched >= self.size:
+            self.full_batches += 1
+            if self.adaptive and self.size < self.max_size:
+                self.size = min(self.size * 2, self.max_size)
+                self.peak_size = max(self.peak_size, self.size)
+        elif self.adaptive and fetched < self.size // 4:
+            self.size = max(self.size // 2, self.min_size)
+
+    def stats(self) -> dict:
+        """
+        Returns stats since last call and resets them
+        """
+        stats = {'size': self.size, 'peak_size': self.peak_size, 'batches': self.batches,
+                 'avg_batch': round(self.events / self.batches, 1) if self.batches else 0,
+                 'full_batches': self.full_batches}
+        self.batches = self.events = self.full_batches = 0
+        self.peak_size = self.size
+        return stats
@@ -0,0 +1,134 @@
+import os
+import json
+import zlib
+import logging
+import winevt_tailer.utils as utils
+import winevt_tailer.errors as errors
+
+
+class BookmarkStore:
+    """
+    Persistent bookmarks: snapshot file (JSON, channel key -> bookmark XML, see utils.store_bookmarks) plus append-only
+    journal next to it (<snapshot>.journal). Each commit appends one line with changed channels only:
+
+      <crc32 of JSON, 8 hex digits> <JSON: channel key -> bookmark XML>
+
+    so commit is cheap and can be done after every batch. Journal is compacted into snapshot when it grows over
+    compact_bytes. On load journal is replayed over snapshot, replay stops at first line with bad checksum (torn write
+    on crash) and journal is truncated there, so the latest complete commit is recovered.
+    """
+
+    def __init__(self, file_name: str, fsync: bool = False, compact_bytes: int = 1024 * 1024):
+        """
+        Args:
+            file_name: snapshot file name
+            fsync: flush journal and snapshot to disk on each commit, survives OS crash, not only process crash
+            compact_bytes: max journal size
+        """
+        self.log = logging.getLogger('tailer')
+        self.file_name = file_name
+        self.journal_file_name = file_name + '.journal'
+        self.fsync = fsync
+        self.compact_bytes = compact_bytes
+        self.state = {}  # channel key -> bookmark XML, snapshot + journal
+        self.journal = None  # open journal file, append mode
+        self.journal_size = 0
+
+    def exists(self) -> bool:
+        return os.path.isfile(self.file_name) or os.path.isfile(self.journal_file_name)
+
+    def load(self, channels: list, source) -> list:
+        """
+        Returns list of bookmark handles corresponding to channels. New bookmarks are created for channels missing
+        in snapshot and journal
+        """
+        try:
+            if os.path.isfile(self.file_name):
+                self.state = utils.read_bookmarks_file(self.file_name)
+            self.replay_journal()
+            return [source.create_bookmark(self.state.get(utils.bookmark_key(ch))) for ch in channels]
+        except Exception as ex:
+            raise errors.BookmarksError(ex)
+
+    def replay_journal(self):
+        if not os.path.isfile(self.journal_file_name):
+            return
+        valid_size = 0
+        with open(self.journal_file_name, 'rb') as f:
+            for line in f:
+                entries = parse_journal_line(line)
+                if entries is None:
+                    self.log.warning(f'Bookmarks journal "{self.journal_file_name}" is damaged at offset '
+                                     f'{valid_size}, recovered last complete commit')
+                    break
+                self.state.update(entries)
+                valid_size += len(line)
+        if valid_size < os.path.getsize(self.journal_file_name):
+            with open(self.journal_file_name, 'r+b') as f:
+                f.truncate(valid_size)  # drop torn tail, so new commits are not appended after it
+        self.journal_size = valid_size
+
+    def commit(self, entries: dict):
+        """
+        Appends changed bookmarks to journal, compacts journal if needed
+        Args:
+            entries: channel key -> bookmark XML, changed channels only
+        """
+        if not entries:
+            return
+        self.state.update(entries)
+        if self.journal_size >= self.compact_bytes:
+            self.compact()
+            return
+        if self.journal is None:
+            self.journal = open(self.journal_file_name, 'ab')
+        line = format_journal_line(entries)
+        self.journal.write(line)
+        self.journal.flush()
+        if self.fsync:
+            os.fsync(self.journal.fileno())
+        self.journal_size += len(line)
+
+    def compact(self):
+        """
+        Writes current state to snapshot and truncates journal. Journal is replayed over snapshot on load, crash
+        between the two steps is safe: journal entries are not newer than snapshot
+        """
+        utils.write_bookmarks_file(self.file_name, self.state, self.fsync)
+        self.close()
+        open(self.journal_file_name, 'wb').close()
+        self.journal_size = 0
+
+    def close(self):
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+
+    def remove(self):
+        """
+        Removes snapshot and journal
+        """
+        self.close()
+        for file_name in (self.file_name, self.journal_file_name):
+            if os.path.isfile(file_name):
+                os.remove(file_name)
+
+
+def format_journal_line(entries: dict) -> bytes:
+    data = json.dumps(entries, separators=(',', ':')).encode()
+    return b'%08x %s\n' % (zlib.crc32(data), data)
+
+
+def parse_journal_line(line: bytes):
+    """
+    Returns entries of journal line, None if line is incomplete or damaged
+    """
+    if not line.endswith(b'\n') or len(line) < 10 or line[8:9] != b' ':
+        return None
+    data = line[9:-1]
+    try:
+        if int(line[:8], 16) != zlib.crc32(data):
+            return None
+        return json.loads(data)
+    except ValueError:
+        return None
@@ -0,0 +1,70 @@
+import time
+
+
+class ChannelCatchUp:
+    """
+    Catch-up of one channel: old events (after bookmark or lookback) are read by query, one batch per main loop turn,
+    interleaved with new events of channels that are live already. Channel goes live when query returns no events.
+    Optional rate limit, events/sec, spreads catch-up over time so it does not saturate output and CPU.
+    """
+
+    def __init__(self, query, start: str, rate: float = 0, progress_s: float = 30):
+        """
+        Args:
+            query: query handle, positioned at first old event
+            start: description of start point for logging: bookmark or lookback
+            rate: max events/sec, 0 - unlimited
+            progress_s: progress log interval
+        """
+        self.query = query
+        self.start = start
+        self.rate = rate
+        self.progress_s = progress_s
+        self.start_ts = time.monotonic()
+        self.end_ts = None  # when channel went live
+        self.next_ts = self.start_ts  # next batch is allowed at, rate limit
+        self.next_progress_ts = self.start_ts + progress_s
+        self.events = 0
+        self.last_event_h = None  # last event read by query, channel is subscribed after it when catch-up is complete
+
+    @property
+    def is_live(self) -> bool:
+        return self.end_ts is not None
+
+    def delay(self, now: float) -> float:
+        """
+        Returns seconds till next batch is allowed by rate limit, 0 if it can be read now
+        """
+        return max(self.next_ts - now, 0)
+
+    def budget(self, batch_size: int) -> int:
+        """
+        Returns number of events to read in next batch: batch size, but not more than one second of events at limited
+        rate, so rate limit is smooth
+        """
+        if self.rate > 0:
+            return max(1, min(batch_size, int(self.rate)))
+        return batch_size
+
+    def update(self, events: list, now: float) -> bool:
+        """
+        Called after each batch read by query, empty batch means catch-up is complete
+        Returns:
+            bool: True if progress should be logged
+        """
+        if not events:
+            self.end_ts = now
+            return False
+        self.events += len(events)
+        self.last_event_h = events[-1]
+        if self.rate > 0:
+            self.next_ts = max(self.next_ts, now) + len(events) / self.rate
+        if now >= self.next_progress_ts:
+            self.next_progress_ts = now + self.progress_s
+            return True
+        return False
+
+    def stats(self, now: float = None) -> dict:
+        elapsed = (self.end_ts or now or time.monotonic()) - self.start_ts
+        return {'state': 'live' if self.is_live else 'catch-up', 'events': self.events,
+                'events_per_s': round(self.events / elapsed) if elapsed > 0 else 0, 'elapsed_s': round(elapsed, 1)}
@@ -36,6 +36,8 @@ transforms:
     - winevt_tailer.transforms.xml_render_message
     - winevt_tailer.transforms.xml_to_json
 bookmarks_dir: "''' + DEFAULT_DATA_DIR + '''"
+output:
+    queue_kb: 4096
 '''
 
 DEFAULT_CONFIG_FOR_CONSOLE = '''\
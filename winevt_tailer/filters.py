@@ -0,0 +1,239 @@
+import re
+
+# Channel filter push-down: ChannelConfig.filter is compiled into event log XPath query (the subset supported by
+# EvtQuery/EvtSubscribe), merged with ChannelConfig.query, so filtered out events are dropped by event log service and
+# never rendered. The subset allows one path per XPath query (*[...]), filter conditions are merged into its predicate.
+# Union of paths and structured XML query (QueryList) result in QueryList. No Windows API.
+
+g_event_id_re = re.compile(r'^\s*(\d+)\s*(?:-\s*(\d+)\s*)?$')
+
+
+def parse_id_ranges(items: list) -> list:
+    """
+    Returns sorted, merged list of (first, last) inclusive ranges from items like 4624, "4624", "4700-4799"
+    """
+    ranges = []
+    for item in items:
+        m = g_event_id_re.match(str(item))
+        if not m:
+            raise ValueError(f'Invalid EventID or range: {item}')
+        first = int(m.group(1))
+        last = int(m.group(2)) if m.group(2) is not None else first
+        if last < first:
+            raise ValueError(f'Invalid EventID range: {item}')
+        ranges.append((first, last))
+    return merge_ranges(ranges)
+
+
+def merge_ranges(ranges: list) -> list:
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:  # overlapping or adjacent
+            merged[-1] = (merged[-1][0], max(merged[-1][1], last))
+        else:
+            merged.append((first, last))
+    return merged
+
+
+def subtract_ranges(ranges: list, excluded: list) -> list:
+    """
+    Returns ranges without excluded values, both lists are merged ranges
+    """
+    result = []
+    for first, last in ranges:
+        for ex_first, ex_last in excluded:
+            if ex_last < first or ex_first > last:
+                continue
+            if ex_first > first:
+                result.append((first, ex_first - 1))
+            first = ex_last + 1
+            if first > last:
+                break
+        if first <= last:
+            result.append((first, last))
+    return result
+
+
+def include_expr(name: str, ranges: list) -> str:
+    """
+    Returns expression matching values in ranges, single value compares are used for ranges of up to 2 values
+    """
+    terms = []
+    for first, last in ranges:
+        if last - first >= 2:
+            terms.append(f'({name}>={first} and {name}<={last})')
+        else:
+            terms += [f'{name}={value}' for value in range(first, last + 1)]
+    return terms[0] if len(terms) == 1 else f'({" or ".join(terms)})'
+
+
+def exclude_expr(name: str, ranges: list) -> str:
+    terms = []
+    for first, last in ranges:
+        if last - first >= 2:
+            terms.append(f'({name}<{first} or {name}>{last})')
+        else:
+            terms += [f'{name}!={value}' for value in range(first, last + 1)]
+    return ' and '.join(terms)
+
+
+def string_literal(value: str) -> str:
+    if "'" not in value:
+        return f"'{value}'"
+    if '"' not in value:
+        return f'"{value}"'
+    raise ValueError(f'Value can not be quoted in XPath: {value}')
+
+
+def system_conditions(config) -> list:
+    """
+    Returns list of conditions on System element of event
+    Args:
+        config: opts.FilterConfig
+    """
+    conditions = []
+    for name, include, exclude in (('Level', config.levels, config.exclude_levels),
+                                   ('EventID', config.event_ids, config.exclude_event_ids)):
+        include = parse_id_ranges(include)
+        exclude = parse_id_ranges(exclude)
+        if include:
+            include = subtract_ranges(include, exclude)
+            if not include:
+                raise ValueError(f'Filter excludes all {name} values')
+            conditions.append(include_expr(name, include))
+        elif exclude:
+            conditions.append(exclude_expr(name, exclude))
+    providers = set(config.providers) - set(config.exclude_providers)
+    if config.providers:
+        if not providers:
+            raise ValueError('Filter excludes all providers')
+        names = ' or '.join(f'@Name={string_literal(name)}' for name in sorted(providers))
+        conditions.append(f'Provider[{names}]')
+    elif config.exclude_providers:
+        conditions.append('Provider[' + ' and '.join(f'@Name!={string_literal(name)}'
+                                                     for name in sorted(set(config.exclude_providers))) + ']')
+    if config.keywords is not None:
+        conditions.append(f'band(Keywords,{int(config.keywords, 0)})')
+    if config.exclude_keywords is not None:
+        conditions.append(f'band(Keywords,{int(config.exclude_keywords, 0)})=0')
+    time_created = []
+    if config.since is not None:
+        time_created.append(f"@SystemTime>='{config.since}'")
+    if config.until is not None:
+        time_created.append(f"@SystemTime<='{config.until}'")
+    if config.max_age_s is not None:
+        time_created.append(f'timediff(@SystemTime)<={config.max_age_s * 1000}')
+    if time_created:
+        conditions.append(f'TimeCreated[{" and ".join(time_created)}]')
+    return conditions
+
+
+def split_top_level_or(expr: str) -> list:
+    """
+    Returns parts of expression joined by "or" outside of brackets, parentheses and string literals
+    """
+    parts = []
+    start = 0
+    depth = 0
+    quote = None
+    for i, c in enumerate(expr):
+        if quote:
+            if c == quote:
+                quote = None
+        elif c in '\'"':
+            quote = c
+        elif c in '[(':
+            depth += 1
+        elif c in '])':
+            depth -= 1
+        elif depth == 0 and i >= start and expr.startswith(' or ', i):
+            parts.append(expr[start:i].strip())
+            start = i + len(' or ')
+    parts.append(expr[start:].strip())
+    return parts
+
+
+def step_predicate(expr: str, name: str):
+    """
+    Returns predicate of single location step "name[predicate]", None if expression is not such step
+    """
+    if not expr.startswith(name + '[') or not expr.endswith(']'):
+        return None
+    depth = 0
+    quote = None
+    for i, c in enumerate(expr[len(name):], len(name)):
+        if quote:
+            if c == quote:
+                quote = None
+        elif c in '\'"':
+            quote = c
+        elif c in '[(':
+            depth += 1
+        elif c in '])':
+            depth -= 1
+            if depth == 0:
+                return expr[len(name) + 1:-1] if i == len(expr) - 1 else None
+    return None
+
+
+def and_expr(expr: str, condition: str) -> str:
+    if len(split_top_level_or(expr)) > 1:
+        expr = f'({expr})'
+    return f'{expr} and {condition}'
+
+
+def merge_path(path: str, conditions: str) -> str:
+    """
+    Returns path with conditions on System element added to its predicate:
+    *[System[A]] -> *[System[A and conditions]], *[A] -> *[A and System[conditions]]
+    """
+    path = path.strip()
+    if path in ('', '*'):
+        return f'*[System[{conditions}]]'
+    predicate = step_predicate(path, '*')
+    if predicate is None:
+        raise ValueError(f'Filter can not be merged with query path, "*[...]" is expected: {path}')
+    system = step_predicate(predicate, 'System')
+    if system is not None:
+        return f'*[System[{and_expr(system, conditions)}]]'
+    return f'*[{and_expr(predicate, f"System[{conditions}]")}]'
+
+
+def is_query_list(query: str) -> bool:
+    """
+    Returns True if query is structured XML query (QueryList), not XPath
+    """
+    return query.lstrip().startswith('<')
+
+
+def build_query(query: str, config=None, channel: str = '*') -> str:
+    """
+    Returns channel query merged with filter. Query is returned as is if there is no filter or filter is empty.
+    Single path query (*[...]) results in single path query. Union of paths results in QueryList, one Select per
+    path. In QueryList query filter is merged into each Select, Suppress elements are kept as is.
+    Args:
+        query: ChannelConfig.query, XPath or QueryList
+        config: opts.FilterConfig or None
+        channel: channel name, Path of QueryList built from union of paths
+    Raises:
+        ValueError: query can not be merged with filter
+    """
+    conditions = system_conditions(config) if config is not None else []
+    if not conditions:
+        return query
+    conditions = ' and '.join(conditions)
+    if is_query_list(query):
+        import lxml.etree
+        query_list = lxml.etree.fromstring(query.strip())
+        for select in query_list.iter('Select'):
+            select.text = ' or '.join(merge_path(path, conditions) for path in split_top_level_or(select.text or ''))
+        return lxml.etree.tostring(query_list, encoding='unicode')
+    paths = split_top_level_or(query.strip())
+    if len(paths) == 1:
+        return merge_path(paths[0], conditions)
+    import lxml.etree
+    query_list = lxml.etree.Element('QueryList')
+    query_elem = lxml.etree.SubElement(query_list, 'Query', Id='0', Path=channel)
+    for path in paths:
+        lxml.etree.SubElement(query_elem, 'Select', Path=channel).text = merge_path(path, conditions)
+    return lxml.etree.tostring(query_list, encoding='unicode')
@@ -1,24 +1,24 @@
 import sys
 import os
-import traceback
-import logging.config
-import pywintypes
-import win32serviceutil
-import win32service
-import servicemanager
-import winevt_tailer.opts as opts
+import winevt_tailer.errors as errors
+
+# package modules can be imported elsewhere with stubbed pywin32 (e.g. tests), but the tailer itself is Windows only
+if os.name != 'nt':
+    raise errors.TailerError("This code is designed to run only on Windows!")
+
+import winevt_tailer.args as cmd_args
 import winevt_tailer.utils as utils
 import winevt_tailer.consts as consts
-from winevt_tailer.tailer import Tailer
+
+# Heavy modules (pydantic, yaml, lxml, pywin32 service modules, tailer) are imported by the modes that need them, so
+# --version, --help and --list start fast. Startup time per mode: scripts/bench_startup.py
 
 
 def main(argv: dict = None) -> int:
-    args = opts.parse_cmd_args(argv)
+    args = cmd_args.parse_cmd_args(argv)
     assert args.name
     tailer_name = args.name
     tailer_service_name = f'{consts.TAILER_TYPE}_{tailer_name}'
-    is_agent_child = utils.is_agent_child()  # started by agent
-    is_service = utils.is_service()
 
     # print windows event channels to stdout and exit
     if args.list:
@@ -27,6 +27,12 @@ def main(argv: dict = None) -> int:
             print(ch)
         return 0
 
+    ancestry = utils.get_process_ancestry()  # process tree is walked once
+    is_agent_child = utils.is_agent_child(ancestry)  # started by agent
+    is_service = utils.is_service(ancestry)
+
+    import winevt_tailer.opts as opts
+
     # collect config from various sources
     tailer_config_dict, logging_config_dict = opts.get_config(args, is_service, is_agent_child)
 
@@ -58,6 +64,28 @@ def main(argv: dict = None) -> int:
     if args.uninstall_service:
         return uninstall_tailer_service(tailer_service_name)
 
+    # print effective config and compiled pipelines as YAML comments, so output can be used as config file
+    if args.print_config:
+        import winevt_tailer.pipeline as pipeline
+        tailer_config = opts.parse_tailer_config(tailer_config_dict)
+        print(utils.compose_effective_config(tailer_name, tailer_config_dict, logging_config_dict), end='')
+        pipelines = pipeline.compile_pipelines(tailer_config)
+        for line in pipeline.describe_plan(tailer_config.channels, pipelines):
+            print(f'# {line}')
+        return 0
+
+    if args.toggle_profiler:
+        import pywintypes
+        try:
+            utils.signal_profiler(tailer_name)
+        except pywintypes.error as ex:
+            print(f'Tailer "{tailer_name}" is not running: {ex}', file=sys.stderr)
+            return 1
+        return 0
+
+    import logging.config
+    from winevt_tailer.tailer import Tailer
+
     # create default log folder
     os.makedirs(consts.DEFAULT_LOG_DIR, exist_ok=True)
     # configure logging
@@ -81,12 +109,19 @@ def main(argv: dict = None) -> int:
         log.info('Reset completed')
         return 0
 
+    # sampling profiler: started by --profile or toggled by --toggle_profiler from another process
+    utils.setup_profiler_signal_handler(tailer_name, lambda signum: tailer.toggle_profiler())
+    if args.profile is not None:
+        tailer.start_profiler(args.profile)
+
     if is_service and not is_agent_child:
         # service mode
         # log effective config
         yaml_str = utils.compose_effective_config(tailer_name, tailer_config_dict, logging_config_dict)
         log.info('\n' + yaml_str)
         # initialize as service
+        import servicemanager
+        from winevt_tailer.service import TailerService
         sys.stdout = sys.stderr = open('nul', 'w')
         TailerService._svc_name_ = tailer_service_name
         TailerService._svc_display_name_ = tailer_service_name
@@ -120,39 +155,9 @@ def unhandled_exception_handler(exc_type, exc_value, exc_traceback, log):
     log.error("Unhandled exception", exc_info=(exc_type, exc_value, exc_traceback))
 
 
-class TailerService(win32serviceutil.ServiceFramework):
-    # these fields must be defined in main() before object instantiation
-    _svc_name_ = None
-    _svc_display_name_ = None
-    _tailer_: Tailer = None
-
-    def __init__(self, args):
-        super().__init__(args)
-        self.log = logging.getLogger("service")
-        # handle "Start Parameters" passed to Service in SCM dialog
-        if "-r" in args:
-            self._tailer_.reset_state()
-            self.log.info('Reset completed')
-
-    def SvcStop(self):
-        # trigger stop
-        self.ReportServiceStatus(win32service.SERVICE_STOP_PENDING)
-        self._tailer_.stop()
-
-    def SvcDoRun(self):
-        # start the service, does not return until stopped
-        # base class will automatically tell SCM the service has stopped when this returns
-        try:
-            servicemanager.LogMsg(servicemanager.EVENTLOG_INFORMATION_TYPE, servicemanager.PYS_SERVICE_STARTED,
-                                  (self._svc_name_, ''))
-            self.log.info("started")
-            self._tailer_.run()
-            self.log.info("stopped")
-        except Exception as ex:
-            self.log.error(ex)
-
-
 def install_tailer_service(tailer_service_name) -> int:
+    import win32serviceutil
+    import win32service
     # requires admin rights
     if not utils.is_admin_user():
         try:
@@ -188,6 +193,9 @@ def install_tailer_service(tailer_service_name) -> int:
 
 
 def uninstall_tailer_service(tailer_service_name) -> int:
+    import pywintypes
+    import win32serviceutil
+    import win32service
     # requires admin rights
     if not utils.is_admin_user():
         try:
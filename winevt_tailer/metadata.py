@@ -0,0 +1,304 @@
+import os
+import re
+import json
+import time
+import threading
+import collections
+
+# FormatMessage insert (%1, %1!s!), escape (%n, %t, %%, ...) or lone '%'
+g_insert_re = re.compile(r'%(\d+)(?:!([^!]*)!)?|%([ntrb%.!0])|%')
+g_insert_escapes = {'n': '\r\n', 't': '\t', 'r': '\r', 'b': ' ', '%': '%', '.': '.', '!': '!'}
+g_insert_formats = {None, 's', 'S', 'ls', 'ws'}
+# parameter message reference in insertion string, e.g. "%%1833", resolved by EvtFormatMessage only
+g_param_ref_re = re.compile(r'%%\d+')
+
+
+class PublisherMetadataCache:
+    """
+    Bounded LRU cache of publisher metadata handles keyed by provider name.
+    Providers without metadata are cached as negative entries that expire after negative_ttl_s, so
+    EvtOpenPublisherMetadata is not called (and does not raise) for every event from such providers.
+    Handles are used by workers concurrently: acquired handle must be released, evicted handle is closed explicitly
+    when it is not in use.
+    """
+
+    def __init__(self, max_size: int = 256, negative_ttl_s: float = 300, evtlog=None, clock=time.monotonic):
+        """
+        Args:
+            max_size: max number of cached providers, positive and negative entries
+            negative_ttl_s: how long to remember providers that have no metadata
+            evtlog: win32evtlog compatible API, default: win32evtlog
+            clock: monotonic time source, seconds
+        """
+        if evtlog is None:
+            import win32evtlog as evtlog
+        self.evtlog = evtlog
+        self.max_size = max(1, max_size)
+        self.negative_ttl_s = negative_ttl_s
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()  # provider_name -> (handle, expire_ts), handle is None if negative
+        self.refs = {}  # id(handle) -> number of users, handles in use only
+        self.evicted = {}  # id(handle) -> handle, evicted handles in use, closed on last release
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self.evictions = 0
+
+    def acquire(self, provider_name: str):
+        """
+        Returns publisher metadata handle or None if provider has no metadata. Handle must be released by release()
+        """
+        with self.lock:
+            entry = self.entries.get(provider_name)
+            if entry is not None:
+                handle, expire_ts = entry
+                if handle is not None:
+                    self.entries.move_to_end(provider_name)
+                    self.hits += 1
+                    self.refs[id(handle)] = self.refs.get(id(handle), 0) + 1
+                    return handle
+                if expire_ts > self.clock():
+                    self.entries.move_to_end(provider_name)
+                    self.negative_hits += 1
+                    return None
+                del self.entries[provider_name]  # expired negative entry
+            self.misses += 1
+            try:
+                handle = self.evtlog.EvtOpenPublisherMetadata(provider_name)
+            except Exception:
+                # pywintypes.error: (2, 'EvtOpenPublisherMetadata', 'The system cannot find the file specified.')
+                handle = None
+            self.entries[provider_name] = (handle, self.clock() + self.negative_ttl_s)
+            if handle is not None:
+                self.refs[id(handle)] = 1
+            while len(self.entries) > self.max_size:
+                _, (evicted_h, _) = self.entries.popitem(last=False)
+                self.evictions += 1
+                if evicted_h is not None and id(evicted_h) in self.refs:
+                    self.evicted[id(evicted_h)] = evicted_h  # closed on last release
+                else:
+                    self._close_handle(evicted_h)
+            return handle
+
+    def release(self, handle):
+        """
+        Releases handle returned by acquire(), None is ignored
+        """
+        if handle is None:
+            return
+        with self.lock:
+            refs = self.refs[id(handle)] - 1
+            if refs:
+                self.refs[id(handle)] = refs
+                return
+            del self.refs[id(handle)]
+            evicted_h = self.evicted.pop(id(handle), None)
+        self._close_handle(evicted_h)
+
+    def close(self):
+        """
+        Closes all cached and evicted handles and clears the cache. Called on exit, when handles are not in use
+        """
+        with self.lock:
+            for handle, _ in self.entries.values():
+                self._close_handle(handle)
+            for handle in self.evicted.values():
+                self._close_handle(handle)
+            self.entries.clear()
+            self.evicted.clear()
+            self.refs.clear()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {'size': len(self.entries), 'hits': self.hits, 'misses': self.misses,
+                    'negative_hits': self.negative_hits, 'evictions': self.evictions}
+
+    @staticmethod
+    def _close_handle(handle):
+        if handle is not None:
+            handle.Close()
+
+
+class UnsafeTemplateError(Exception):
+    pass
+
+
+def substitute_inserts(template: str, values: list) -> str:
+    """
+    Fills in %1..%n inserts in message template (FormatMessage syntax) with event data values
+    Args:
+        template: raw message template
+        values: insertion strings, EventData/Data values in order
+    Returns:
+        str: formatted message
+    Raises:
+        UnsafeTemplateError: template or values cannot be substituted locally, EvtFormatMessage should be used
+    """
+
+    def fill(m):
+        if m.group(1) is not None:
+            idx = int(m.group(1))
+            if idx == 0 or idx > len(values) or m.group(2) not in g_insert_formats:
+                raise UnsafeTemplateError(m.group())
+            return values[idx - 1] or ''
+        escape = g_insert_escapes.get(m.group(3))
+        if escape is None:
+            raise UnsafeTemplateError(m.group())  # %0 or lone '%'
+        return escape
+
+    for value in values:
+        if value and g_param_ref_re.search(value):
+            raise UnsafeTemplateError(value)
+    return g_insert_re.sub(fill, template)
+
+
+class MessageTemplateCatalog:
+    """
+    Raw message templates keyed by (provider, EventID, version, qualifiers, locale). Template is fetched from
+    publisher metadata once, then messages are formatted locally from event data values. Templates that
+    cannot be substituted safely are formatted by EvtFormatMessage (see xml_render_message).
+    Catalog can be stored to and loaded from JSON file to start warm after restart.
+    """
+
+    NO_MESSAGE_ID = 0xFFFFFFFF
+
+    def __init__(self, metadata_cache: PublisherMetadataCache, locale: int = 0, max_size: int = 4096, evtlog=None):
+        """
+        Args:
+            metadata_cache: publisher metadata handles
+            locale: locale id that templates are fetched for, part of the key
+            max_size: max number of cached templates
+            evtlog: win32evtlog compatible API, default: win32evtlog
+        """
+        if evtlog is None:
+            import win32evtlog as evtlog
+        self.evtlog = evtlog
+        self.metadata_cache = metadata_cache
+        self.locale = locale
+        self.max_size = max(1, max_size)
+        self.lock = threading.Lock()
+        self.templates = collections.OrderedDict()  # key -> template, None if there is no usable template
+        # provider_name -> {(event_id, version): message_id}, empty for classic providers. LRU, bounded as publisher
+        # metadata handles
+        self.message_ids = collections.OrderedDict()
+        self.dirty = False
+        self.hits = 0
+        self.misses = 0
+        self.fallbacks = 0
+
+    def format(self, provider_name: str, event_id: int, version: int, qualifiers: int, values: list):
+        """
+        Returns:
+            str: formatted message or None if EvtFormatMessage should be used instead
+        """
+        key = f'{provider_name}#{event_id}#{version}#{qualifiers}#{self.locale}'
+        with self.lock:
+            cached = key in self.templates
+            if cached:
+                self.templates.move_to_end(key)
+                template = self.templates[key]
+                self.hits += 1
+        if not cached:
+            # fetched outside of lock, workers are not blocked by slow metadata calls; concurrent misses of
+            # the same key fetch the same template
+            template = self._fetch_template(provider_name, event_id, version, qualifiers)
+            with self.lock:
+                self.templates[key] = template
+                if template is not None:
+                    self.dirty = True
+                while len(self.templates) > self.max_size:
+                    self.templates.popitem(last=False)
+                self.misses += 1
+        if template is not None:
+            try:
+                return substitute_inserts(template, values)
+            except UnsafeTemplateError:
+                pass
+        with self.lock:
+            self.fallbacks += 1
+        return None
+
+    def load(self, file_name: str):
+        """
+        Loads templates stored by store(). Only templates of the current locale are used.
+        """
+        with open(file_name, 'r', encoding='utf-8') as f:
+            templates_dict = json.load(f)
+        suffix = f'#{self.locale}'
+        with self.lock:
+            for key, template in templates_dict.items():
+                if key.endswith(suffix) and isinstance(template, str):
+                    self.templates[key] = template
+            while len(self.templates) > self.max_size:
+                self.templates.popitem(last=False)
+
+    def store(self, file_name: str):
+        """
+        Stores known templates to file in JSON format, missing templates are not stored
+        """
+        with self.lock:
+            templates_dict = {key: template for key, template in self.templates.items() if template is not None}
+            self.dirty = False
+        tmp_file_name = file_name + '.tmp'
+        with open(tmp_file_name, 'w', encoding='utf-8') as f:
+            json.dump(templates_dict, f)
+        os.replace(tmp_file_name, file_name)  # atomic
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {'size': len(self.templates), 'hits': self.hits, 'misses': self.misses, 'fallbacks': self.fallbacks}
+
+    def _fetch_template(self, provider_name: str, event_id: int, version: int, qualifiers: int):
+        metadata = self.metadata_cache.acquire(provider_name)
+        if metadata is None:
+            return None
+        try:
+            return self._fetch_metadata_template(metadata, provider_name, event_id, version, qualifiers)
+        finally:
+            self.metadata_cache.release(metadata)
+
+    def _fetch_metadata_template(self, metadata, provider_name: str, event_id: int, version: int, qualifiers: int):
+        with self.lock:
+            message_ids = self.message_ids.get(provider_name)
+            if message_ids is not None:
+                self.message_ids.move_to_end(provider_name)
+        if message_ids is None:
+            # enumerated outside of lock, as templates are fetched, see format
+            message_ids = self._enum_message_ids(metadata)
+            with self.lock:
+                self.message_ids[provider_name] = message_ids
+                while len(self.message_ids) > self.metadata_cache.max_size:
+                    self.message_ids.popitem(last=False)
+        if message_ids:
+            message_id = message_ids.get((event_id, version), self.NO_MESSAGE_ID)
+        else:
+            # classic provider, message id is full event id from message table
+            message_id = ((qualifiers or 0) << 16) | event_id
+        if message_id == self.NO_MESSAGE_ID:
+            return None
+        try:
+            return self.evtlog.EvtFormatMessage(metadata, None, self.evtlog.EvtFormatMessageId, ResourceId=message_id)
+        except Exception:
+            return None
+
+    def _enum_message_ids(self, metadata) -> dict:
+        message_ids = {}
+        try:
+            events_h = self.evtlog.EvtOpenEventMetadataEnum(metadata)
+            while True:
+                event_h = self.evtlog.EvtNextEventMetadata(events_h)
+                if event_h is None:
+                    break
+                event_id = self._event_property(event_h, self.evtlog.EvtEventMetadataEventID)
+                version = self._event_property(event_h, self.evtlog.EvtEventMetadataEventVersion)
+                message_id = self._event_property(event_h, self.evtlog.EvtEventMetadataEventMessageID)
+                message_ids[(event_id, version)] = message_id
+        except Exception:
+            # classic providers have no event metadata
+            pass
+        return message_ids
+
+    def _event_property(self, event_h, property_id):
+        value = self.evtlog.EvtGetEventMetadataProperty(event_h, property_id)
+        return value[0] if isinstance(value, tuple) else value
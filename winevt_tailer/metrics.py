@@ -0,0 +1,138 @@
+import sys
+import time
+import threading
+import collections
+
+
+def callable_name(obj) -> str:
+    """
+    Returns import path of function, e.g. winevt_tailer.transforms.xml_to_json
+    """
+    return f'{getattr(obj, "__module__", None)}.{getattr(obj, "__qualname__", type(obj).__qualname__)}'
+
+
+class StageStats:
+    """
+    Per-stage event handling timers and counters, labelled by (channel name, stage name).
+    Stage name is 'render', 'parse', 'tail_out' or transform import path.
+    Timer is a list [calls, dropped, total_ns, max_ns], updated in place by add() to keep hot path cheap.
+    Counters are reset after each report, so report covers last interval.
+    """
+
+    def __init__(self, report_interval_s: float):
+        self.report_interval_ns = int(report_interval_s * 1e9)
+        self.timers = collections.OrderedDict()  # (channel_name, stage_name) -> timer
+        self.interval_start_ns = time.perf_counter_ns()
+        self.next_report_ns = self.interval_start_ns + self.report_interval_ns
+
+    def timer(self, channel_name: str, stage_name: str) -> list:
+        """
+        Returns timer for stage, creates it if needed. Same stage can be registered more than once, e.g.
+        when transform is in both channel and final transforms - timer is shared then.
+        """
+        return self.timers.setdefault((channel_name, stage_name), [0, 0, 0, 0])
+
+    @staticmethod
+    def add(timer: list, dt_ns: int):
+        timer[0] += 1
+        timer[2] += dt_ns
+        if dt_ns > timer[3]:
+            timer[3] = dt_ns
+
+    def report(self) -> [str]:
+        """
+        Returns report lines, one per stage with calls since last report, and resets counters
+        """
+        now_ns = time.perf_counter_ns()
+        interval_s = max(now_ns - self.interval_start_ns, 1) / 1e9
+        total_ns = max(sum(timer[2] for timer in self.timers.values()), 1)
+        lines = [f'stage stats for last {interval_s:.1f} s:',
+                 f'{"channel":<20} {"stage":<50} {"calls":>9} {"dropped":>9} {"calls/s":>9} {"avg_us":>9} '
+                 f'{"max_us":>9} {"time%":>6}']
+        for (channel_name, stage_name), timer in self.timers.items():
+            calls, dropped, stage_ns, max_ns = timer
+            if calls:
+                lines.append(f'{channel_name:<20} {stage_name:<50} {calls:>9} {dropped:>9} {calls / interval_s:>9.0f} '
+                             f'{stage_ns / calls / 1000:>9.1f} {max_ns / 1000:>9.1f} '
+                             f'{stage_ns * 100 / total_ns:>6.1f}')
+            timer[:] = [0, 0, 0, 0]
+        self.interval_start_ns = now_ns
+        self.next_report_ns = now_ns + self.report_interval_ns
+        return lines
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler: background thread samples call stacks of all other threads at fixed interval.
+    On stop samples are written to file as collapsed stacks, one line per unique stack:
+
+        thread;module:function;module:function... count
+
+    which is input format of flamegraph.pl and speedscope. Overhead depends on sampling interval only, profiled code
+    is not instrumented.
+    """
+
+    def __init__(self, file_name: str, interval_ms: float = 5):
+        """
+        Args:
+            file_name: collapsed stacks output file
+            interval_ms: sampling interval
+        """
+        self.file_name = file_name
+        self.interval_s = interval_ms / 1000
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    @property
+    def is_running(self) -> bool:
+        return self.thread is not None
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._sample_loop, name='sampling_profiler', daemon=True)
+        self.thread.start()
+
+    def stop(self) -> int:
+        """
+        Stops sampling and writes collapsed stacks to file
+        Returns:
+            int: number of samples taken
+        """
+        if self.thread is None:
+            return 0
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+        with open(self.file_name, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+        return self.samples
+
+    def top(self, n: int = 10) -> [(str, int)]:
+        """
+        Returns n functions with most samples on top of stack (self time)
+        """
+        leafs = collections.Counter()
+        for stack, count in self.stacks.items():
+            leafs[stack.rsplit(';', 1)[-1]] += count
+        return leafs.most_common(n)
+
+    def _sample_loop(self):
+        own_id = threading.get_ident()
+        while not self.stop_event.wait(self.interval_s):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{frame.f_globals.get("__name__", "?")}:{code.co_name}')
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
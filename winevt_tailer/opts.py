@@ -1,104 +1,322 @@
-import argparse
 import sys
 import yaml
 import os
 import re
 import pydantic
+from lxml import etree
 from pydantic import PyObject, validator
-from typing import List
+from typing import List, Dict, Tuple, Optional, Union
 import winevt_tailer.errors as errors
 import winevt_tailer.utils as utils
 import winevt_tailer.consts as consts
-from winevt_tailer import __version__
+import winevt_tailer.storm as storm
+import winevt_tailer.filters as filters
+import winevt_tailer.projection as projection
+import winevt_tailer.truncation as truncation
+from winevt_tailer.args import parse_cmd_args  # noqa: F401, used to be defined here
 
 
-def str_regex_type(arg_value, regex_str):
-    pat = re.compile(regex_str)
-    if not pat.match(arg_value):
-        raise errors.ArgError(f"Invalid 'name' value: '{arg_value}', allowed: '{regex_str}'")
-    return arg_value
+class FilterConfig(pydantic.BaseModel):
+    # compiled into channel query, see filters.build_query: filtered out events are dropped by event log, not rendered
+    levels: List[int] = []  # event Levels to include, empty - all
+    exclude_levels: List[int] = []
+    event_ids: List[Union[int, str]] = []  # EventIDs to include, ranges allowed: 4624, "4700-4799"; empty - all
+    exclude_event_ids: List[Union[int, str]] = []
+    providers: List[str] = []  # provider names to include, empty - all
+    exclude_providers: List[str] = []
+    keywords: Optional[str] = None  # include events with any of keyword bits set, e.g. "0x8020000000000000"
+    exclude_keywords: Optional[str] = None  # exclude events with any of keyword bits set
+    since: Optional[str] = None  # events created at or after UTC time, e.g. "2023-01-01T00:00:00.000Z"
+    until: Optional[str] = None  # events created at or before UTC time
+    max_age_s: Optional[int] = None  # events not older than, relative to time event is read
 
+    @validator("event_ids", "exclude_event_ids", "levels", "exclude_levels")
+    def check_ids(cls, value):
+        filters.parse_id_ranges(value)
+        return value
 
-def yaml_regex_type(arg_value):
-    try:
-        yaml.safe_load(arg_value)
-    except Exception as ex:
-        raise errors.ArgError(ex)
-    return arg_value
+    @validator("keywords", "exclude_keywords")
+    def check_keywords(cls, value):
+        if value is not None:
+            try:
+                int(value, 0)
+            except ValueError:
+                raise ValueError(f'Invalid keywords mask: {value}')
+        return value
 
+    @validator("since", "until")
+    def check_time(cls, value):
+        if value is not None and not re.match(r'^\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d(\.\d+)?Z$', value):
+            raise ValueError(f'Invalid UTC time: {value}, expected: YYYY-MM-DDThh:mm:ss[.fff]Z')
+        return value
 
-def transforms_path_type(arg_value):
-    # can be directory or file (zip)
-    if not os.path.exists(arg_value):
-        raise errors.ArgError(f"Transform path does exist: '{arg_value}'")
-    if not os.access(arg_value, os.R_OK):
-        raise errors.ArgError(f"Cannot access: '{arg_value}'")
-    return arg_value
 
+class SamplingConfig(pydantic.BaseModel):
+    # low-severity events reduction, see transforms.xml_sample_events
+    levels: List[int] = [4, 5]  # event Level: 0 - LogAlways, 3 - warning, 4 - information, 5 - verbose;
+    #                           # 1 - critical and 2 - error events always pass
+    mode: str = 'sample'  # sample - events are passed by EventRecordID hash at rate, aggregate - events are counted
+    #                     # per (provider, EventID, Level), aggregate record is output every TailerConfig.aggregate_s
+    rate: float = 0.1  # share of events passed in sample mode
 
-def parse_cmd_args(argv=None):
-    """
-    Args:
-        argv[str]: argv list, default: sys.argv[1:]
-    Returns:
-        dict: parsed arguments as argparse dict
-    """
-    parser = argparse.ArgumentParser(description='Tail Windows Event logs using single-line JSON format',
-                                     add_help=False)
-    group = parser.add_mutually_exclusive_group()
-    group.add_argument('-v', '--version', action='version',
-                       version=f'{consts.TAILER_TYPE} {__version__}', help="Show program version info and exit.")
-    group.add_argument('-h', '--help', action='help', default=argparse.SUPPRESS,
-                       help='Show this help message and exit.')
-    group.add_argument('-l', '--list', action='store_true', help='List event channel names accessible to current '
-                                                                 'user. Some channels may need Admin rights.')
-    group.add_argument('-e', '--print_config', action='store_true', help='Print effective config and exit.')
-    group.add_argument('-i', '--install_service', action='store_true', help='Install windows service.')
-    group.add_argument('-u', '--uninstall_service', action='store_true', help='Uninstall windows service.')
-    group.add_argument('-r', '--reset', action='store_true', help='Reset persistent state - delete event bookmarks.')
-    parser.add_argument('-f', '--follow', action='store_true', help='Follow and output new events as they arrive. '
-                                                                    'True in service mode.')
-    parser.add_argument('-p', '--persistent', action='store_true',
-                        help='Remember last tailed event for each channel and '
-                             'tail only new events after restart. Default: off', default=None)
-    parser.add_argument('-c', '--config', dest='config_file', help='Config file path, file format: YAML',
-                        type=argparse.FileType('r'), metavar='filepath')
-    parser.add_argument('-n', '--name', help='Tailer name. Also defines where to look for config: '
-                                             f'{consts.TAILER_TYPE}/<name> in YAML file; TAILER_CONFIG_<name> and '
-                                             'TAILER_LOGGING_<name> in env vars (as YAML string)',
-                        type=lambda val: str_regex_type(val, regex_str=r'^[^\s]+$'), default=consts.DEFAULT_TAILER_NAME)
-    parser.add_argument('-b', '--lookback', type=int, help='Defines how many old events to tail. -1 means all '
-                                                           f'available events. default is {consts.DEFAULT_LOOKBACK}. '
-                                                           'Applied in non-persistent mode or when event channel '
-                                                           'persistent state was not stored.')
-    parser.add_argument('--tailer_config', help='Named tailer config section as YAML string', type=yaml_regex_type)
-    parser.add_argument('--logging_config', help='Logging config section as YAML string', type=yaml_regex_type)
-    parser.add_argument('-t', '--transforms_path', help='Path to custom transforms', type=transforms_path_type)
-    parser.add_argument('-s', '--startup_hello', action='store_true',
-                        help='Output Startup Hello line. Part of Mezmo Agent Tailer API. Default: off', default=None)
-    #
-    if argv is None:
-        argv = sys.argv[1:]
-    args = parser.parse_args(argv)
-    return args
+    @validator("levels", each_item=True)
+    def check_levels(cls, value):
+        if value in (1, 2):
+            raise ValueError(f'Critical and error events always pass, invalid level: {value}')
+        if not 0 <= value <= 255:
+            raise ValueError(f'Invalid level: {value}')
+        return value
+
+    @validator("mode")
+    def check_mode(cls, value):
+        if value not in ('sample', 'aggregate'):
+            raise ValueError(f'Invalid sampling mode: {value}, allowed: sample, aggregate')
+        return value
+
+    @validator("rate")
+    def check_rate(cls, value):
+        if not 0 <= value <= 1:
+            raise ValueError(f'Invalid sampling rate: {value}, allowed: 0..1')
+        return value
 
 
 class ChannelConfig(pydantic.BaseModel):
     name: str  # channel name
     query: str = "*"  # all events, XPath 1.0 query (see
     transforms: List[PyObject] = []  # ordered, applied before TailerConfig.transforms
+    render: str = "xml"  # xml - event XML tree is passed to transforms, values - output record is built from
+    #                    # rendered system and user values, no XML. Used if all transforms support it, see pipeline.py
+    value_names: List[str] = []  # names of EventData/UserData values in "values" render mode, in order
+    batch_size: Optional[int] = None  # EvtNext batch size, default: TailerConfig.batch_size
+    batch_timeout_ms: Optional[int] = None  # EvtNext timeout, default: TailerConfig.batch_timeout_ms
+    adaptive_batch: Optional[bool] = None  # default: TailerConfig.adaptive_batch
+    catchup_rate: Optional[float] = None  # default: TailerConfig.catchup_rate
+    weight: int = 1  # share of new events read per turn when channels compete, see TailerConfig.channel_budget
+    sampling: List[SamplingConfig] = []  # sampling/aggregation per Level, see transforms.xml_sample_events
+    filter: Optional[FilterConfig] = None  # declarative filter merged into query, see filters.build_query
 
     @validator("query")
     def check_transforms(cls, value):
-        if not utils.is_valid_xpath(value):
-            raise ValueError(f'Channel query is not valid XPath expression: {value}')
+        if not utils.is_valid_query(value):
+            raise ValueError(f'Channel query is not valid XPath expression or QueryList: {value}')
+        return value
+
+    @validator("transforms", each_item=True)
+    def check_channel_transforms(cls, value):
+        # summaries of folded events pass through transforms that follow suppressor, see Tailer.fold_tails
+        if getattr(value, '__name__', None) in ('xml_fold_storms', 'values_fold_storms'):
+            raise ValueError(f'{value.__name__} is allowed in top level transforms only')
+        return value
+
+    @validator("filter")
+    def check_filter(cls, value, values):
+        query = filters.build_query(values.get('query', '*'), value, values.get('name', '*'))
+        if not utils.is_valid_query(query):
+            raise ValueError(f'Channel query merged with filter is not valid XPath expression or QueryList: {query}')
+        return value
+
+    @property
+    def effective_query(self) -> str:
+        """
+        Query passed to event log: query merged with filter
+        """
+        return filters.build_query(self.query, self.filter, self.name)
+
+    @validator("render")
+    def check_render(cls, value):
+        if value not in ('xml', 'values'):
+            raise ValueError(f'Invalid render mode: {value}, allowed: xml, values')
+        return value
+
+    @validator("value_names")
+    def check_value_names(cls, value):
+        if 'Data' in value:
+            raise ValueError('"Data" is reserved for unnamed values')
+        return value
+
+    @validator("batch_size")
+    def check_batch_size(cls, value):
+        if value is not None and value < 1:
+            raise ValueError(f'Invalid batch size: {value}')
+        return value
+
+    @validator("weight")
+    def check_weight(cls, value):
+        if value < 1:
+            raise ValueError(f'Invalid channel weight: {value}')
+        return value
+
+
+class ReplayConfig(pydantic.BaseModel):
+    corpus: str  # JSON lines file recorded using TailerConfig.record or directory of *.xml files
+    rate: float = 0  # events/sec, 0 - as fast as possible
+    pattern: List[Tuple[float, float]] = []  # burst pattern, cycled: [[duration_s, events_per_sec], ...],
+    #                                        # 0 events_per_sec - pause. Overrides rate
+    channel_mix: Dict[str, float] = {}  # channel name -> weight, default: proportional to corpus events
+    limit: int = 0  # number of events to replay, 0 - corpus size
+    seed: int = 0  # channel mix random seed
+
+    @validator("pattern")
+    def check_pattern(cls, value):
+        for duration, rate in value:
+            if duration <= 0 or rate < 0:
+                raise ValueError(f'Invalid burst pattern phase: [{duration}, {rate}]')
+        return value
+
+
+class OutputConfig(pydantic.BaseModel):
+    sink: str = "logging"  # logging - tail_out logger from logging config, one record per flush;
+    #                      # stdout - direct writes to stdout; file - rotated file, see sinks.FileSink;
+    #                      # http - NDJSON batches POSTed to url, see sinks.HttpSink
+    flush: str = "batch"  # flush policy: batch - after each EvtNext batch, bytes - when flush_bytes are buffered,
+    #                     # time - when the oldest buffered event is older than flush_ms
+    flush_bytes: int = 65536  # max buffered output, applied in all policies
+    flush_ms: int = 1000  # max output delay in "time" policy
+    file: Optional[str] = None  # "file" sink: output file, rotated segments are stored next to it
+    rotate_bytes: int = 10000000  # "file" sink: rotate file when it reaches size
+    rotate_s: int = 0  # "file" sink: rotate file when it is older, 0 - by size only
+    compress: str = "gzip"  # "file" sink: rotated segments compression: gzip, zstd (zstandard package), none
+    retain_bytes: int = 100000000  # "file" sink: max total size of rotated segments, the oldest are deleted
+    url: Optional[str] = None  # "http" sink: ingest URL, http or https
+    headers: Dict[str, str] = {}  # "http" sink: extra request headers, e.g. Authorization
+    gzip = True  # "http" sink: compress request body
+    connections: int = 1  # "http" sink: keep-alive connections, more than 1 sends batches concurrently, out of order
+    max_in_flight: int = 8  # "http" sink: batches waiting for connection, more batches are spooled
+    retries: int = 3  # "http" sink: retries of failed batch before it is spooled
+    retry_backoff_ms: int = 200  # "http" sink: delay before first retry, doubled each retry
+    timeout_s: float = 10  # "http" sink: connect and response timeout
+    spool_dir: Optional[str] = None  # "http" sink: spooled batches, default: <bookmarks_dir>/<tailer type>_<name>.spool
+    spool_max_mb: int = 1024  # "http" sink: max spool size, writer waits for endpoint when spool is full
+    queue_kb: int = 0  # output is written by writer thread through memory queue of this size, so slow consumer does
+    #                  # not stall Tailer, see sinks.QueuedSink; 0 - Tailer writes directly. Not used by "http" sink
+    spill_mb: int = 256  # queue spill file size, used when memory queue is full, Tailer waits when spill is full too
+    spill_file: Optional[str] = None  # default: <bookmarks_dir>/<tailer type>_<name>.spill
+
+    @validator("sink")
+    def check_sink(cls, value):
+        if value not in ('logging', 'stdout', 'file', 'http'):
+            raise ValueError(f'Invalid output sink: {value}, allowed: logging, stdout, file, http')
+        return value
+
+    @validator("file", always=True)
+    def check_file(cls, value, values):
+        if values.get('sink') == 'file' and not value:
+            raise ValueError('Output file is required by "file" sink')
+        return value
+
+    @validator("url", always=True)
+    def check_url(cls, value, values):
+        if values.get('sink') == 'http' and (not value or not value.startswith(('http://', 'https://'))):
+            raise ValueError(f'Invalid output url: {value}, http(s) URL is required by "http" sink')
+        return value
+
+    @validator("queue_kb", "spill_mb")
+    def check_queue(cls, value, field):
+        if value < 0:
+            raise ValueError(f'Invalid {field.name}: {value}')
+        return value
+
+    @validator("connections", "max_in_flight")
+    def check_connections(cls, value, field):
+        if value < 1:
+            raise ValueError(f'Invalid {field.name}: {value}')
+        return value
+
+    @validator("compress")
+    def check_compress(cls, value):
+        if value not in ('gzip', 'zstd', 'none'):
+            raise ValueError(f'Invalid compression: {value}, allowed: gzip, zstd, none')
+        return value
+
+    @validator("rotate_bytes")
+    def check_rotate_bytes(cls, value):
+        if value < 1:
+            raise ValueError(f'Invalid rotate_bytes: {value}')
+        return value
+
+    @validator("flush")
+    def check_flush(cls, value):
+        if value not in ('batch', 'bytes', 'time'):
+            raise ValueError(f'Invalid flush policy: {value}, allowed: batch, bytes, time')
+        return value
+
+
+class ProjectionConfig(pydantic.BaseModel):
+    # output of transforms.xml_project_json
+    fields: Dict[str, str] = {  # output key -> XPath, relative to Event element, "event" is event namespace prefix
+        'TimeCreated': 'string(event:System/event:TimeCreated/@SystemTime)',
+        'Computer': 'string(event:System/event:Computer)',
+        'Channel': 'string(event:System/event:Channel)',
+        'Provider': 'string(event:System/event:Provider/@Name)',
+        'EventID': 'string(event:System/event:EventID)',
+        'Level': 'string(event:System/event:Level)',
+        'Task': 'string(event:System/event:Task)',
+        'Keywords': 'string(event:System/event:Keywords)',
+        'EventRecordID': 'string(event:System/event:EventRecordID)',
+        'ProcessID': 'string(event:System/event:Execution/@ProcessID)',
+        'UserID': 'string(event:System/event:Security/@UserID)',
+        'Message': 'string(Message)',  # added by xml_render_message
+    }
+    flatten_eventdata = False  # add EventData/Data values as keys named by Name attribute, unnamed to "Data" list
+
+    @validator("fields")
+    def check_fields(cls, value):
+        for key, xpath in value.items():
+            try:
+                etree.XPath(xpath, namespaces=projection.g_event_ns)
+            except etree.XPathSyntaxError as ex:
+                raise ValueError(f'Invalid XPath of projection field {key}: {xpath}, {ex}')
+        return value
+
+
+class StormConfig(pydantic.BaseModel):
+    # event storm suppression, see transforms.xml_fold_storms
+    fields: List[str] = ['channel', 'provider', 'event_id', 'level']  # event fingerprint, allowed: channel, provider,
+    #                                                                 # event_id, level, task, opcode, keywords
+    data: List[str] = []  # EventData/Data names (Name attribute) added to fingerprint
+    window_s: float = 60  # fingerprint window
+    forward: int = 10  # events of fingerprint passed per window, the rest is folded into summary event
+    max_fingerprints: int = 10000  # fingerprint table size, the least recently seen fingerprint is evicted
+
+    @validator("fields", each_item=True)
+    def check_fields(cls, value):
+        if value not in storm.FIELDS:
+            raise ValueError(f'Invalid fingerprint field: {value}, allowed: {", ".join(storm.FIELDS)}')
+        return value
+
+    @validator("window_s", "max_fingerprints")
+    def check_positive(cls, value, field):
+        if value <= 0:
+            raise ValueError(f'Invalid {field.name}: {value}')
+        return value
+
+
+class TruncateConfig(pydantic.BaseModel):
+    # oversized events, see transforms.xml_truncate_fields
+    field_bytes: int = 8192  # max text of field (EventData/UserData value, Binary, Message), UTF-8, 0 - unlimited
+    event_bytes: int = 32768  # max text of all fields, the largest fields are truncated first, 0 - unlimited
+    marker: str = '...[truncated]'  # appended to truncated text, counts to limits
+    hash: Optional[str] = None  # hash of removed remainder added as TruncatedHash: md5, sha1, sha256
+
+    @validator("field_bytes", "event_bytes")
+    def check_bytes(cls, value, field):
+        if value < 0:
+            raise ValueError(f'Invalid {field.name}: {value}')
+        return value
+
+    @validator("hash")
+    def check_hash(cls, value):
+        if value is not None and value not in truncation.HASHES:
+            raise ValueError(f'Invalid hash: {value}, allowed: {", ".join(truncation.HASHES)}')
         return value
 
 
 class TailerConfig(pydantic.BaseModel):
     channels: List[ChannelConfig]
     bookmarks_dir: str = "."  # current working directory
-    bookmarks_commit_s: int = 10  # seconds
+    bookmarks_commit_s: float = 1  # seconds, changed bookmarks are appended to journal, 0 - after each turn
+    bookmarks_fsync = False  # flush bookmarks to disk on commit, survive OS crash
+    bookmarks_compact_kb: int = 1024  # bookmarks journal size to compact it into bookmarks file
     lookback: int = consts.DEFAULT_LOOKBACK  # number of old events to tail per channel,
     #                                        # 0 - no lookback, only new events
     persistent = False  # don't bookmark last tailed events ids
@@ -108,6 +326,69 @@ class TailerConfig(pydantic.BaseModel):
     #                                                                      # channel transforms
     startup_hello = False
     exit_after_lookback = True  # exit after outputting old events
+    publisher_cache_size: int = 256  # max number of cached publisher metadata handles, see xml_render_message
+    publisher_negative_ttl_s: int = 300  # seconds to remember providers without metadata
+    message_template_cache_size: int = 4096  # max number of cached message templates, see xml_render_message
+    replay: Optional[ReplayConfig] = None  # replay recorded events instead of tailing event log
+    record: Optional[str] = None  # file to record tailed events to, replay corpus
+    output: OutputConfig = OutputConfig()  # tail output
+    storm: StormConfig = StormConfig()  # used by transforms.xml_fold_storms
+    projection: ProjectionConfig = ProjectionConfig()  # used by transforms.xml_project_json
+    truncate: TruncateConfig = TruncateConfig()  # used by transforms.xml_truncate_fields
+    drop_regex: List[str] = []  # used by transforms.xml_drop_regex, events with rendered XML matching any are dropped
+    json_drop_cr: bool = False  # transforms.xml_to_json drops carriage returns instead of escaping them, output is
+    # byte-compatible with transforms.xml_to_json_xslt
+    aggregate_s: float = 60  # aggregate records interval, see SamplingConfig
+    batch_size: int = 50  # events per EvtNext call, initial size in adaptive mode
+    batch_timeout_ms: int = 100  # EvtNext timeout
+    adaptive_batch = False  # grow batch size while channel returns full batches, shrink when batches are sparse
+    batch_size_min: int = 10  # adaptive batch size limits
+    batch_size_max: int = 1000
+    wait_timeout_ms: int = 500  # max wait for new events before idle tasks: output flush, bookmarks commit, stop
+    stats_report_s: int = 0  # per-stage timers report interval, reported to tailer log, 0 - disabled
+    counters_report_s: int = 300  # counters report interval (output, queue, caches, suppression, sampling,
+    # truncation), reported to tailer log independently of per-stage timers, 0 - on exit only
+    profile_dir: str = consts.DEFAULT_LOG_DIR  # sampling profiler output, collapsed stacks (*.folded)
+    profile_interval_ms: float = 5  # sampling profiler interval
+    workers: int = 0  # render, parse and transform events in worker threads, output stays in read order, 0 - inline
+    queue_depth: int = 16  # max batches of events in flight between reader and writer when workers are used
+    catchup_rate: float = 0  # max events/sec per channel while reading old events (bookmark, lookback), 0 - unlimited
+    catchup_progress_s: int = 30  # catch-up progress log interval
+    channel_budget: int = 500  # max new events read from channel per turn (times ChannelConfig.weight), then next
+    #                          # channel with new events takes turn
+
+    @validator("batch_size", "batch_size_min", "batch_size_max")
+    def check_batch_size(cls, value):
+        if value < 1:
+            raise ValueError(f'Invalid batch size: {value}')
+        return value
+
+    @validator("workers", "queue_depth")
+    def check_workers(cls, value, field):
+        if value < 0 or (field.name == 'queue_depth' and value < 1):
+            raise ValueError(f'Invalid {field.name}: {value}')
+        return value
+
+    @validator("channel_budget")
+    def check_channel_budget(cls, value):
+        if value < 1:
+            raise ValueError(f'Invalid channel budget: {value}')
+        return value
+
+    @validator("drop_regex")
+    def check_drop_regex(cls, value):
+        for pattern in value:
+            try:
+                re.compile(pattern)
+            except re.error as ex:
+                raise ValueError(f'Invalid drop regex: {pattern}, {ex}')
+        return value
+
+    @validator("aggregate_s")
+    def check_aggregate_s(cls, value):
+        if value <= 0:
+            raise ValueError(f'Invalid aggregate interval: {value}')
+        return value
 
 
 def parse_tailer_config(config_dict):
@@ -0,0 +1,118 @@
+import winevt_tailer.errors as errors
+import winevt_tailer.metrics as metrics
+import winevt_tailer.render as render
+
+# What transform needs from event, declared by 'needs' attribute of transform:
+#   handle - event handle only, event object is passed through as is
+#   xml - rendered XML string, transform returns XML string or None
+#   tree - XML tree (lxml), default for transforms without 'needs' attribute
+# In "xml" render mode pipeline input is rendered XML string, it is parsed just before the first transform that needs
+# tree, so events dropped by cheap string predicates and handle based transforms are never parsed.
+NEEDS = ('handle', 'xml', 'tree')
+
+
+def compile_pipeline(xforms: list, parse_at: int = None):
+    """
+    Fuses chain of transforms into single callable with the same signature as transform:
+
+        pipeline(context: dict, event_h, event_obj) -> object|None
+
+    Calls are unrolled in generated code, there is no loop and no list iteration per event. Chain stops on first
+    transform that returns None (event is dropped).
+    Args:
+        xforms: ordered transforms, channel transforms followed by final transforms
+        parse_at: index of transform to parse XML string (render.parse_xml) before, None - no parsing
+    Returns:
+        function: fused pipeline, has 'transforms' attribute - tuple of fused transforms and 'parse_at' attribute
+    """
+    xforms = tuple(xforms)
+    lines = ['def pipeline(context, event_h, event_obj):']
+    for i in range(len(xforms)):
+        if i == parse_at:
+            lines.append('    event_obj = parse_xml(event_obj)')
+        lines.append(f'    event_obj = xform_{i}(context, event_h, event_obj)')
+        if i < len(xforms) - 1:
+            lines.append('    if event_obj is None:')
+            lines.append('        return None')
+    lines.append('    return event_obj')
+    namespace = {f'xform_{i}': xform for i, xform in enumerate(xforms)}
+    namespace['parse_xml'] = render.parse_xml
+    exec(compile('\n'.join(lines), f'<pipeline {len(xforms)}>', 'exec'), namespace)
+    pipeline = namespace['pipeline']
+    pipeline.transforms = xforms
+    pipeline.parse_at = parse_at
+    pipeline.render = 'xml'
+    return pipeline
+
+
+def parse_stage(context: dict, event_h, event_obj: str):
+    # parsing as transform, for per-stage timers
+    return render.parse_xml(event_obj)
+
+
+def compile_pipelines(config) -> list:
+    """
+    Returns compiled pipelines, one per channel in TailerConfig: channel transforms followed by final transforms.
+    Pipeline has 'render' attribute - render mode: "values" if channel is configured so and all transforms have
+    "values" mode equivalent (values_xform attribute), "xml" otherwise.
+    In "xml" mode XML string is parsed before the first transform that needs tree, see NEEDS.
+    """
+    pipelines = []
+    for channel in config.channels:
+        xforms = channel.transforms + config.transforms
+        if channel.render == 'values' and not tree_transforms(xforms):
+            xforms = [xform.values_xform for xform in xforms if xform.values_xform is not None]
+            pipeline = compile_pipeline(xforms)
+            pipeline.render = 'values'
+        else:
+            pipeline = compile_pipeline(xforms, parse_position(channel.name, xforms))
+        pipelines.append(pipeline)
+    return pipelines
+
+
+def transform_needs(xform) -> str:
+    needs = getattr(xform, 'needs', 'tree')
+    if needs not in NEEDS:
+        raise errors.ConfigError(f'Transform {metrics.callable_name(xform)} needs: {needs}, allowed: {NEEDS}')
+    return needs
+
+
+def parse_position(channel_name: str, xforms: list):
+    """
+    Returns index of the first transform that needs XML tree, None if no transform needs it
+    """
+    needs = [transform_needs(xform) for xform in xforms]
+    if 'tree' not in needs:
+        return None
+    parse_at = needs.index('tree')
+    for xform, xform_needs in zip(xforms[parse_at:], needs[parse_at:]):
+        if xform_needs == 'xml':
+            raise errors.ConfigError(f'Channel {channel_name}: transform {metrics.callable_name(xform)} needs XML '
+                                     f'string, it must precede transforms that need XML tree')
+    return parse_at
+
+
+def tree_transforms(xforms: list) -> list:
+    """
+    Returns transforms that need XML tree, ones that have no "values" render mode equivalent
+    """
+    return [xform for xform in xforms if not hasattr(xform, 'values_xform')]
+
+
+def describe_plan(channels: list, pipelines: list) -> [str]:
+    """
+    Returns human readable compiled pipelines, one stage per line
+    Args:
+        channels: list of ChannelConfig
+        pipelines: compiled pipelines, one per channel
+    """
+    lines = ['compiled pipelines:']
+    for channel, pipeline in zip(channels, pipelines):
+        lines.append(f'  channel: {channel.name}, query: {channel.effective_query}, render: {pipeline.render}')
+        stages = [metrics.callable_name(xform) for xform in pipeline.transforms]
+        if pipeline.parse_at is not None:
+            stages.insert(pipeline.parse_at, 'parse')
+        stages = ['render_values' if pipeline.render == 'values' else 'render'] + stages + ['tail_out']
+        for i, stage in enumerate(stages):
+            lines.append(f'    {i + 1}. {stage}')
+    return lines
@@ -0,0 +1,61 @@
+import json
+from lxml import etree
+
+# Field projection output, see transforms.xml_project_json: only configured fields are evaluated and output as flat
+# compact JSON object, event tree is not serialized.
+
+g_event_ns = {'event': 'http://schemas.microsoft.com/win/2004/08/events/event'}
+g_eventdata_tag = '{%s}EventData' % g_event_ns['event']
+
+
+class Projection:
+    """
+    Output key -> XPath expression, evaluated against event root element, compiled once. Result is converted to
+    JSON value: string result as is, element - its text, attribute - its value, several nodes - list, boolean -
+    true/false, number - number. Empty results are omitted.
+    """
+
+    def __init__(self, config):
+        """
+        Args:
+            config: opts.ProjectionConfig
+        """
+        self.fields = [(key, etree.XPath(xpath, namespaces=g_event_ns, smart_strings=False))
+                       for key, xpath in config.fields.items()]
+        self.flatten_eventdata = config.flatten_eventdata
+
+    def project(self, event_obj) -> str:
+        """
+        Returns event projection as single line JSON
+        """
+        record = {}
+        for key, xpath in self.fields:
+            value = json_value(xpath(event_obj))
+            if value is not None:
+                record[key] = value
+        if self.flatten_eventdata:
+            event_data = event_obj.find(g_eventdata_tag)
+            if event_data is not None:
+                for data in event_data:
+                    name = data.get('Name')
+                    if name is None:
+                        record.setdefault('Data', []).append(data.text or '')
+                    elif data.text is not None:
+                        record.setdefault(name, data.text)
+        return json.dumps(record, ensure_ascii=False, separators=(',', ':'))
+
+
+def json_value(result):
+    if isinstance(result, str):
+        return result or None
+    if isinstance(result, bool):
+        return result
+    if isinstance(result, float):
+        if result != result:
+            return None  # NaN, e.g. number() of missing node
+        return int(result) if result.is_integer() else result
+    values = [node.text if isinstance(node, etree._Element) else str(node) for node in result]
+    values = [value for value in values if value]
+    if not values:
+        return None
+    return values[0] if len(values) == 1 else values
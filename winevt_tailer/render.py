@@ -0,0 +1,182 @@
+import datetime
+import threading
+from lxml import etree
+
+# "values" render mode: event is rendered by EvtRender(EvtRenderEventValues) with system and user render contexts
+# into list of values, output record is built from values directly - no XML string, no XML tree.
+
+# EVT_SYSTEM_PROPERTY_ID order
+SYSTEM_PROPERTIES = ('ProviderName', 'ProviderGuid', 'EventID', 'Qualifiers', 'Level', 'Task', 'Opcode', 'Keywords',
+                     'TimeCreated', 'EventRecordID', 'ActivityID', 'RelatedActivityID', 'ProcessID', 'ThreadID',
+                     'Channel', 'Computer', 'UserID', 'Version')
+
+# EVT_VARIANT_TYPE values that need conversion to match rendered XML text
+g_var_type_binary = 14
+g_var_type_filetime = 17
+g_var_type_systime = 18
+g_var_type_sid = 19
+g_var_type_hexint32 = 20
+g_var_type_hexint64 = 21
+g_var_type_array = 128
+
+g_event_ns = {'event': 'http://schemas.microsoft.com/win/2004/08/events/event'}
+
+g_parsers = threading.local()  # XMLParser per thread: lxml serializes concurrent use of one parser
+
+
+def parse_xml(xml_str: str):
+    """
+    Parses rendered event XML into tree. Parser is created once per thread and reused, it is configured for rendered
+    events: no DTD, entities, comments, processing instructions, no xml:id index.
+    """
+    parser = getattr(g_parsers, 'parser', None)
+    if parser is None:
+        parser = g_parsers.parser = etree.XMLParser(resolve_entities=False, no_network=True, collect_ids=False,
+                                                    remove_comments=True, remove_pis=True)
+    return etree.fromstring(xml_str, parser)
+
+
+class ValuesRenderer:
+    """
+    Renders event handle to (system_values, user_values): lists of strings or None, see SYSTEM_PROPERTIES.
+    User values are EventData/UserData values in order, same as message insertion strings.
+    Render contexts are created once and reused.
+    """
+
+    def __init__(self, evtlog=None):
+        """
+        Args:
+            evtlog: win32evtlog compatible API, default: win32evtlog
+        """
+        if evtlog is None:
+            import win32evtlog as evtlog
+        self.evtlog = evtlog
+        self.system_context = evtlog.EvtCreateRenderContext(evtlog.EvtRenderContextSystem)
+        self.user_context = evtlog.EvtCreateRenderContext(evtlog.EvtRenderContextUser)
+
+    def render(self, event_h) -> (list, list):
+        system = self.evtlog.EvtRender(event_h, self.evtlog.EvtRenderEventValues, Context=self.system_context)
+        user = self.evtlog.EvtRender(event_h, self.evtlog.EvtRenderEventValues, Context=self.user_context)
+        return [variant_str(value, var_type) for value, var_type in system], \
+            [variant_str(value, var_type) for value, var_type in user]
+
+
+def variant_str(value, var_type: int):
+    """
+    Returns EVT_VARIANT value as string formatted the same way as in rendered event XML, None for null value
+    """
+    if value is None:
+        return None
+    if var_type & g_var_type_array:
+        return ','.join(variant_str(item, var_type & ~g_var_type_array) or '' for item in value)
+    if var_type in (g_var_type_hexint32, g_var_type_hexint64):
+        return f'0x{value:x}'
+    if var_type in (g_var_type_filetime, g_var_type_systime) and isinstance(value, datetime.datetime):
+        return value.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+    if var_type == g_var_type_binary:
+        return bytes(value).hex().upper()
+    if var_type == g_var_type_sid:
+        import win32security
+        return win32security.ConvertSidToStringSid(value)
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return str(value)
+
+
+def build_record(system: list, user: list, value_names: list) -> dict:
+    """
+    Builds output record from rendered values, empty values are omitted. Schema is not the same as xml_to_json output
+    of the same event:
+      - System has xml_to_json layout, but attributes that are not rendered as values (e.g. Provider EventSourceName)
+        are missing and TimeCreated SystemTime has 6 fractional digits instead of 7
+      - EventData values are keys named by value_names in order, remaining values go to EventData/Data list of
+        strings, instead of {"Data": [{"Name": ..., "text": ...}]} of xml_to_json
+    """
+    props = dict(zip(SYSTEM_PROPERTIES, system))
+    sys_rec = {}
+    provider = {key: value for key, value in (('Name', props['ProviderName']), ('Guid', props['ProviderGuid']))
+                if value is not None}
+    if provider:
+        sys_rec['Provider'] = provider
+    if props['Qualifiers'] is not None:
+        sys_rec['EventID'] = {'Qualifiers': props['Qualifiers'], 'text': props['EventID']}
+    else:
+        sys_rec['EventID'] = props['EventID']
+    for key in ('Version', 'Level', 'Task', 'Opcode', 'Keywords'):
+        if props[key] is not None:
+            sys_rec[key] = props[key]
+    if props['TimeCreated'] is not None:
+        sys_rec['TimeCreated'] = {'SystemTime': props['TimeCreated']}
+    sys_rec['EventRecordID'] = props['EventRecordID']
+    correlation = {key: props[key] for key in ('ActivityID', 'RelatedActivityID') if props[key] is not None}
+    if correlation:
+        sys_rec['Correlation'] = correlation
+    execution = {key: props[key] for key in ('ProcessID', 'ThreadID') if props[key] is not None}
+    if execution:
+        sys_rec['Execution'] = execution
+    sys_rec['Channel'] = props['Channel']
+    sys_rec['Computer'] = props['Computer']
+    if props['UserID'] is not None:
+        sys_rec['Security'] = {'UserID': props['UserID']}
+    event = {'System': sys_rec}
+    if user:
+        event_data = dict(zip(value_names, user))
+        if len(user) > len(value_names):
+            event_data['Data'] = user[len(value_names):]
+        event['EventData'] = event_data
+    return {'Event': event}
+
+
+def record_values(record: dict) -> list:
+    """
+    Returns user values of record in original order, message insertion strings
+    """
+    event_data = record['Event'].get('EventData')
+    if not event_data:
+        return []
+    return [value for key, value in event_data.items() if key != 'Data'] + event_data.get('Data', [])
+
+
+def xml_to_values(xml_str: str) -> (list, list):
+    """
+    Extracts (system_values, user_values) from rendered event XML, same as ValuesRenderer.render() returns.
+    Used for events that exist as XML only, e.g. replayed events.
+    """
+    event_obj = parse_xml(xml_str)
+    system = event_obj.find('event:System', g_event_ns)
+
+    def find(path, attr=None):
+        node = system.find(path, g_event_ns) if system is not None else None
+        if node is None:
+            return None
+        return node.get(attr) if attr else node.text
+
+    values = {
+        'ProviderName': find('event:Provider', 'Name'),
+        'ProviderGuid': find('event:Provider', 'Guid'),
+        'EventID': find('event:EventID'),
+        'Qualifiers': find('event:EventID', 'Qualifiers'),
+        'Level': find('event:Level'),
+        'Task': find('event:Task'),
+        'Opcode': find('event:Opcode'),
+        'Keywords': find('event:Keywords'),
+        'TimeCreated': find('event:TimeCreated', 'SystemTime'),
+        'EventRecordID': find('event:EventRecordID'),
+        'ActivityID': find('event:Correlation', 'ActivityID'),
+        'RelatedActivityID': find('event:Correlation', 'RelatedActivityID'),
+        'ProcessID': find('event:Execution', 'ProcessID'),
+        'ThreadID': find('event:Execution', 'ThreadID'),
+        'Channel': find('event:Channel'),
+        'Computer': find('event:Computer'),
+        'UserID': find('event:Security', 'UserID'),
+        'Version': find('event:Version'),
+    }
+    user = []
+    event_data = event_obj.find('event:EventData', g_event_ns)
+    if event_data is not None:
+        user = [data.text for data in event_data.iterfind('event:Data', g_event_ns)]
+    else:
+        user_data = event_obj.find('event:UserData', g_event_ns)
+        if user_data is not None and len(user_data):
+            user = [node.text for node in user_data[0].iter() if len(node) == 0]
+    return [values[name] for name in SYSTEM_PROPERTIES], user
@@ -0,0 +1,117 @@
+import json
+import time
+import threading
+
+# Low-severity events reduction, see transforms.xml_sample_events. Per channel and event Level events are either
+# sampled - passed by EventRecordID hash at configured rate, or aggregated - counted per (provider, EventID, Level) and
+# output as one aggregate record per interval. Critical and error events always pass.
+
+ALWAYS_PASS_LEVELS = ('1', '2')  # critical, error
+
+g_hash_mul = 0x9E3779B97F4A7C15  # 2^64 / golden ratio, Fibonacci hashing
+g_hash_mask = 0xFFFFFFFFFFFFFFFF
+
+
+class SamplingRule:
+    __slots__ = ('aggregate', 'threshold')
+
+    def __init__(self, aggregate: bool, rate: float):
+        self.aggregate = aggregate
+        self.threshold = int(rate * (g_hash_mask + 1))  # record id hash below threshold is passed
+
+
+class EventSampler:
+    """
+    Sampling rules per channel and Level from ChannelConfig.sampling, aggregate counters of current interval.
+    Used by workers concurrently.
+    Sampling is deterministic: event is passed if Fibonacci hash of its EventRecordID is below rate share of hash
+    range, so the same events are passed on restart and by other tailers, consecutive record ids are spread evenly.
+    """
+
+    def __init__(self, channels: list, interval_s: float):
+        """
+        Args:
+            channels: list of opts.ChannelConfig
+            interval_s: aggregate records interval
+        """
+        self.rules = {}  # channel name (lower case) -> {Level: SamplingRule}
+        for channel in channels:
+            for config in channel.sampling:
+                rule = SamplingRule(config.mode == 'aggregate', config.rate)
+                levels = self.rules.setdefault(channel.name.lower(), {})
+                for level in config.levels:
+                    levels[str(level)] = rule
+        self.interval_s = interval_s
+        self.interval_start = time.monotonic()
+        self.counts = {}  # (channel, provider, event_id, level) -> [count, first time, last time], current interval
+        self.lock = threading.Lock()
+        # counters
+        self.sampled_in = 0
+        self.sampled_out = 0
+        self.aggregated = 0
+        self.records = 0
+
+    def rule(self, channel: str, level: str):
+        """
+        Returns SamplingRule of event, None if event is passed in full
+        """
+        levels = self.rules.get(channel.lower())
+        if levels is None or level in ALWAYS_PASS_LEVELS:
+            return None
+        return levels.get(level)
+
+    def sample(self, rule: SamplingRule, record_id: int) -> bool:
+        """
+        Returns True if event is passed
+        """
+        passed = (record_id * g_hash_mul) & g_hash_mask < rule.threshold
+        with self.lock:
+            if passed:
+                self.sampled_in += 1
+            else:
+                self.sampled_out += 1
+        return passed
+
+    def aggregate(self, channel: str, provider: str, event_id: str, level: str, time_created: str):
+        """
+        Counts event in current interval
+        """
+        key = (channel, provider, event_id, level)
+        with self.lock:
+            self.aggregated += 1
+            counts = self.counts.get(key)
+            if counts is None:
+                self.counts[key] = [1, time_created, time_created]
+            else:
+                counts[0] += 1
+                counts[2] = time_created
+
+    def sweep(self, now: float, flush: bool = False) -> list:
+        """
+        Returns aggregate records (single line JSON) when interval ends, on flush - of current interval
+        """
+        if now - self.interval_start < self.interval_s and not flush:
+            return []
+        with self.lock:
+            counts, self.counts = self.counts, {}
+            interval_s = round(now - self.interval_start, 3)
+            self.interval_start = now
+            self.records += len(counts)
+        return [format_aggregate(key, value, interval_s) for key, value in counts.items()]
+
+    def stats(self) -> dict:
+        return {'sampled_in': self.sampled_in, 'sampled_out': self.sampled_out, 'aggregated': self.aggregated,
+                'records': self.records}
+
+
+def format_aggregate(key: tuple, counts: list, interval_s: float) -> str:
+    """
+    Aggregate record follows xml_to_json layout of events it counts, Aggregate key is added
+    """
+    channel, provider, event_id, level = key
+    count, first_time, last_time = counts
+    record = {'Event': {'System': {'Provider': {'Name': provider}, 'EventID': event_id, 'Level': level,
+                                   'Channel': channel},
+                        'Aggregate': {'Count': str(count), 'FirstTime': first_time or '',
+                                      'LastTime': last_time or '', 'IntervalS': str(interval_s)}}}
+    return json.dumps(record, ensure_ascii=False, separators=(',', ':'))
@@ -0,0 +1,57 @@
+import collections
+
+
+class FairScheduler:
+    """
+    Round-robin queue of channels with new events. Channel is queued when signalled and gets a turn in queue order,
+    it reads at most its budget of events per turn (TailerConfig.channel_budget * ChannelConfig.weight), then it goes
+    to the back of the queue if it has more events. So a noisy channel can not starve others: channel waits for its
+    turn at most for one turn of every other queued channel.
+    Queueing delay - time from channel being queued till its turn - is tracked per channel.
+    """
+
+    def __init__(self, budgets: list):
+        """
+        Args:
+            budgets: max events per turn, per channel
+        """
+        self.budgets = budgets
+        self.queue = collections.deque()
+        self.queued_ts = [None] * len(budgets)  # monotonic, None - not queued
+        self.delays = [[0, 0.0, 0.0] for _ in budgets]  # per channel: [turns, total_s, max_s], since last stats
+
+    def __len__(self):
+        return len(self.queue)
+
+    def push(self, ch_idx: int, now: float):
+        """
+        Queues channel with new events, no-op if it is queued already
+        """
+        if self.queued_ts[ch_idx] is None:
+            self.queued_ts[ch_idx] = now
+            self.queue.append(ch_idx)
+
+    def pop(self, now: float):
+        """
+        Returns channel for next turn, None if no channel is queued
+        """
+        if not self.queue:
+            return None
+        ch_idx = self.queue.popleft()
+        delay = now - self.queued_ts[ch_idx]
+        self.queued_ts[ch_idx] = None
+        stats = self.delays[ch_idx]
+        stats[0] += 1
+        stats[1] += delay
+        if delay > stats[2]:
+            stats[2] = delay
+        return ch_idx
+
+    def stats(self, ch_idx: int) -> dict:
+        """
+        Returns queueing delay stats of channel since last call and resets them
+        """
+        turns, total_s, max_s = self.delays[ch_idx]
+        self.delays[ch_idx] = [0, 0.0, 0.0]
+        return {'turns': turns, 'avg_delay_ms': round(total_s * 1000 / turns, 1) if turns else 0,
+                'max_delay_ms': round(max_s * 1000, 1)}
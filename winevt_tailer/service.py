@@ -0,0 +1,39 @@
+import logging
+import win32serviceutil
+import win32service
+import servicemanager
+from winevt_tailer.tailer import Tailer
+
+# Windows service host of tailer, imported by main in service mode only
+
+
+class TailerService(win32serviceutil.ServiceFramework):
+    # these fields must be defined in main() before object instantiation
+    _svc_name_ = None
+    _svc_display_name_ = None
+    _tailer_: Tailer = None
+
+    def __init__(self, args):
+        super().__init__(args)
+        self.log = logging.getLogger("service")
+        # handle "Start Parameters" passed to Service in SCM dialog
+        if "-r" in args:
+            self._tailer_.reset_state()
+            self.log.info('Reset completed')
+
+    def SvcStop(self):
+        # trigger stop
+        self.ReportServiceStatus(win32service.SERVICE_STOP_PENDING)
+        self._tailer_.stop()
+
+    def SvcDoRun(self):
+        # start the service, does not return until stopped
+        # base class will automatically tell SCM the service has stopped when this returns
+        try:
+            servicemanager.LogMsg(servicemanager.EVENTLOG_INFORMATION_TYPE, servicemanager.PYS_SERVICE_STARTED,
+                                  (self._svc_name_, ''))
+            self.log.info("started")
+            self._tailer_.run()
+            self.log.info("stopped")
+        except Exception as ex:
+            self.log.error(ex)
@@ -0,0 +1,746 @@
+import os
+import re
+import sys
+import time
+import gzip
+import queue
+import bisect
+import shutil
+import socket
+import logging
+import threading
+import contextlib
+import collections
+import http.client
+import urllib.parse
+import winevt_tailer.errors as errors
+from winevt_tailer.spill import SpillRing, g_header as g_spill_header
+
+
+class OutputSink:
+    """
+    Tail output. Events (lines) are buffered and written to destination by single write on flush.
+    Flush policies, see OutputConfig:
+      - batch: flush after each batch of events fetched by EvtNext
+      - bytes: flush when buffer reaches flush_bytes
+      - time: flush at the end of batch if the oldest buffered line is older than flush_ms
+    In all policies buffer is flushed when it reaches flush_bytes, when Tailer is idle (no new events) and before
+    bookmarks are committed, so bookmarks never get ahead of output.
+    Sink with acks set delivers output asynchronously: Tailer marks emitted events instead of advancing bookmarks
+    (see mark) and advances bookmarks to marks returned by take_acked, once output up to them is acknowledged.
+    """
+    acks = False
+
+    def __init__(self, config):
+        """
+        Args:
+            config: opts.OutputConfig
+        """
+        self.flush_policy = config.flush
+        self.flush_bytes = config.flush_bytes  # approximate, counted in characters
+        self.flush_s = config.flush_ms / 1000
+        self.buffer = []
+        self.buffered = 0
+        self.first_ts = 0  # monotonic, when the oldest line in buffer was written
+        self.lines = 0
+        self.flushes = 0
+
+    def write(self, line):
+        if not isinstance(line, str):
+            line = str(line)
+        if not self.buffer:
+            self.first_ts = time.monotonic()
+        self.buffer.append(line)
+        self.buffered += len(line)
+        if self.buffered >= self.flush_bytes:
+            self.flush()
+
+    def end_batch(self):
+        """
+        Called after each batch of events is handled
+        """
+        if not self.buffer:
+            return
+        if self.flush_policy == 'batch' or \
+                (self.flush_policy == 'time' and time.monotonic() - self.first_ts >= self.flush_s):
+            self.flush()
+
+    def write_now(self, line: str):
+        """
+        Writes line bypassing flush policy, e.g. STARTUP_HELLO that agent waits for
+        """
+        self.flush()
+        self.write(line)
+        self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        lines = self.buffer
+        self.buffer = []
+        self.buffered = 0
+        self.lines += len(lines)
+        self.flushes += 1
+        self.write_lines(lines)
+
+    def close(self):
+        self.flush()
+
+    def stats(self) -> dict:
+        return {'lines': self.lines, 'flushes': self.flushes}
+
+    def interrupt(self):
+        """
+        Called when Tailer is stopping, sink stops waiting for destination
+        """
+        pass
+
+    def mark(self, ch_idx: int, event_h):
+        """
+        Marks channel event, all lines written so far include it. Used if acks is set
+        """
+        raise NotImplementedError()
+
+    def take_acked(self) -> list:
+        """
+        Returns marks (ch_idx, event_h) acknowledged since last call, in mark order. Used if acks is set
+        """
+        raise NotImplementedError()
+
+    def write_lines(self, lines: list):
+        raise NotImplementedError()
+
+
+class LoggingSink(OutputSink):
+    """
+    Writes lines to tail_out logger configured in logging config, one log record per flush: lines are joined by
+    new line, so message-only formatter is expected (default config). Works with any handler, e.g. rotating file
+    handler used in service mode.
+    """
+
+    def __init__(self, config, logger: logging.Logger):
+        super().__init__(config)
+        self.logger = logger
+
+    def write_lines(self, lines: list):
+        self.logger.info('\n'.join(lines))
+
+
+class StreamSink(OutputSink):
+    """
+    Writes lines directly to stream, bypasses logging
+    """
+
+    def __init__(self, config, stream):
+        super().__init__(config)
+        self.stream = stream
+
+    def write_lines(self, lines: list):
+        lines.append('')
+        self.stream.write('\n'.join(lines))
+        self.stream.flush()
+
+
+class FileSink(OutputSink):
+    """
+    Writes lines to file, one write per flush, for sustained volume in service mode. File is rotated by size or
+    age: it is renamed to <file>.<YYYYmmdd-HHMMSS-mmm> and new file is opened, that is all done by writer. Rotated
+    segments are compressed and the oldest segments are deleted over retain_bytes by background thread, so rotation
+    never stalls event fetching. Segments left uncompressed by previous run are compressed on start.
+    """
+    extensions = {'gzip': '.gz', 'zstd': '.zst', 'none': ''}
+
+    def __init__(self, config):
+        super().__init__(config)
+        self.log = logging.getLogger('tailer')
+        self.file_name = os.path.abspath(config.file)
+        self.rotate_bytes = config.rotate_bytes
+        self.rotate_s = config.rotate_s
+        self.compress = config.compress
+        self.retain_bytes = config.retain_bytes
+        if self.compress == 'zstd':
+            try:
+                import zstandard  # noqa: F401
+            except ImportError:
+                raise errors.ConfigError('zstd compression needs zstandard package')
+        self.segment_re = re.compile(re.escape(os.path.basename(self.file_name)) + r'\.\d{8}-\d{6}-\d{3}(\.gz|\.zst)?$')
+        os.makedirs(os.path.dirname(self.file_name), exist_ok=True)
+        self.file = None
+        self.size = 0
+        self.opened_ts = 0  # monotonic
+        self.rotations = 0
+        self.segment_ms = 0  # time of the last segment, epoch ms
+        self.open()
+        # rotated segments to compress, None - stop
+        self.segments = queue.Queue()
+        for file_name in self.list_segments():
+            if not file_name.endswith(('.gz', '.zst')) and self.compress != 'none':
+                self.segments.put(file_name)
+        self.thread = threading.Thread(target=self._compress_loop, name='sink_compress', daemon=True)
+        self.thread.start()
+
+    def open(self):
+        self.file = open(self.file_name, 'ab')
+        self.size = self.file.tell()
+        self.opened_ts = time.monotonic()
+
+    def write_lines(self, lines: list):
+        lines.append('')
+        data = '\n'.join(lines).encode('utf-8')
+        self.file.write(data)
+        self.file.flush()
+        self.size += len(data)
+        if self.size >= self.rotate_bytes or (self.rotate_s and time.monotonic() - self.opened_ts >= self.rotate_s):
+            self.rotate()
+
+    def rotate(self):
+        """
+        Renames file to new segment and opens new file, segment is compressed by background thread
+        """
+        self.file.close()
+        segment_ms = max(int(time.time() * 1000), self.segment_ms + 1)  # segment names sort in rotation order
+        while True:
+            segment = f'{self.file_name}.{time.strftime("%Y%m%d-%H%M%S", time.localtime(segment_ms // 1000))}-' \
+                      f'{segment_ms % 1000:03d}'
+            if not any(os.path.exists(segment + ext) for ext in self.extensions.values()):
+                break
+            segment_ms += 1
+        self.segment_ms = segment_ms
+        try:
+            os.rename(self.file_name, segment)
+            self.rotations += 1
+            self.segments.put(segment)
+        except OSError as ex:
+            self.log.warning(f'Failed to rotate "{self.file_name}": {ex}')  # e.g. file is locked, keep appending
+        self.open()
+
+    def close(self):
+        super().close()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            self.segments.put(None)
+            self.thread.join()
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats['rotations'] = self.rotations
+        return stats
+
+    def list_segments(self) -> list:
+        """
+        Returns rotated segments, the oldest first
+        """
+        dir_name = os.path.dirname(self.file_name)
+        return [os.path.join(dir_name, name) for name in sorted(os.listdir(dir_name)) if self.segment_re.match(name)]
+
+    def _compress_loop(self):
+        while True:
+            segment = self.segments.get()
+            try:
+                if segment is not None and self.compress != 'none':
+                    self._compress(segment)
+                if segment is None or self.segments.empty():
+                    self._retain()
+            except Exception as ex:
+                self.log.warning(f'Failed to compress "{segment}": {ex}')
+            if segment is None:
+                return
+
+    def _compress(self, segment: str):
+        compressed = segment + self.extensions[self.compress]
+        with open(segment, 'rb') as src:
+            if self.compress == 'zstd':
+                import zstandard
+                with open(compressed + '.tmp', 'wb') as dst:
+                    zstandard.ZstdCompressor().copy_stream(src, dst)
+            else:
+                with gzip.open(compressed + '.tmp', 'wb') as dst:
+                    shutil.copyfileobj(src, dst, 1024 * 1024)
+        os.replace(compressed + '.tmp', compressed)
+        os.remove(segment)
+
+    def _retain(self):
+        """
+        Deletes the oldest segments while total size of segments is over retain_bytes. Segments waiting for compression
+        are not counted
+        """
+        ext = self.extensions[self.compress]
+        segments = [(file_name, os.path.getsize(file_name)) for file_name in self.list_segments()
+                    if file_name.endswith(ext)]
+        total = sum(size for _, size in segments)
+        for file_name, size in segments:
+            if total <= self.retain_bytes:
+                break
+            os.remove(file_name)
+            total -= size
+
+
+class AckedSink(OutputSink):
+    """
+    Base of sinks that deliver output asynchronously. Each flush is a batch numbered in order, marks wait for
+    acknowledgement of batch that includes them, batches may be acknowledged out of order.
+    """
+    acks = True
+
+    def __init__(self, config):
+        super().__init__(config)
+        self.lock = threading.Lock()  # acknowledgements, counters
+        self.seq = 0  # last batch
+        self.acked_seq = 0  # batches up to it are acknowledged
+        self.acked_ahead = set()  # acknowledged batches after acked_seq
+        self.marks = collections.deque()  # (seq, ch_idx, event_h), waiting for acknowledgement
+
+    def mark(self, ch_idx: int, event_h):
+        self.marks.append((self.seq + 1 if self.buffer else self.seq, ch_idx, event_h))
+
+    def take_acked(self) -> list:
+        acked = []
+        with self.lock:
+            acked_seq = self.acked_seq
+        while self.marks and self.marks[0][0] <= acked_seq:
+            _, ch_idx, event_h = self.marks.popleft()
+            acked.append((ch_idx, event_h))
+        return acked
+
+    def _ack(self, seq: int):
+        with self.lock:
+            self.acked_ahead.add(seq)
+            while self.acked_seq + 1 in self.acked_ahead:
+                self.acked_seq += 1
+                self.acked_ahead.remove(self.acked_seq)
+
+
+class HttpSink(AckedSink):
+    """
+    POSTs each flush of buffered lines to ingest URL as NDJSON batch, gzip compressed optionally. Batches are sent by
+    sender threads, one keep-alive connection each, at most max_in_flight batches wait for sender. Failed batch is
+    retried with exponential backoff, then it is stored to spool directory, so is batch that does not fit in flight
+    queue. Batch newer than spooled ones is spooled too and spooled batch is sent only when no older batch is in
+    flight, so batches are sent in order with one connection; concurrent senders (connections > 1) can reorder them.
+    Spooled batches are sent in background when endpoint recovers, after restart too. When spool is full senders keep
+    retrying and writer waits for space in flight queue or spool: events stay in event log, bookmarks do not advance.
+    Interrupt (forced stop) aborts requests in progress and drops batches that are not sent, they are not
+    acknowledged.
+    Batch is acknowledged when endpoint responds with 2xx or batch is stored to spool; batch rejected by endpoint
+    (4xx except 408, 429) is logged and dropped. Bookmarks advance only to events of acknowledged batches, batches
+    that are not sent or spooled on exit are tailed again after restart.
+    """
+
+    def __init__(self, config):
+        super().__init__(config)
+        self.log = logging.getLogger('tailer')
+        url = urllib.parse.urlsplit(config.url)
+        self.connection_class = http.client.HTTPSConnection if url.scheme == 'https' else http.client.HTTPConnection
+        self.host = url.netloc
+        self.path = (url.path or '/') + ('?' + url.query if url.query else '')
+        self.headers = {'Content-Type': 'application/x-ndjson', **config.headers}
+        self.gzip = config.gzip
+        if self.gzip:
+            self.headers['Content-Encoding'] = 'gzip'
+        self.retries = config.retries
+        self.backoff_s = config.retry_backoff_ms / 1000
+        self.timeout_s = config.timeout_s
+        self.spool_dir = config.spool_dir
+        self.spool_max_bytes = config.spool_max_mb * 1024 * 1024
+        os.makedirs(self.spool_dir, exist_ok=True)
+        spool = self.list_spool()
+        self.spool_bytes = sum(os.path.getsize(file_name) for file_name in spool)
+        self.spool_names = [os.path.basename(file_name) for file_name in spool]  # sorted, the oldest first
+        self.queue = queue.Queue(config.max_in_flight)  # (seq, body), None - stop
+        self.flight = set()  # seq of batches queued or being sent
+        self.active = set()  # connections with request in progress, aborted on interrupt
+        self.run_ns = time.time_ns()  # spooled batch name prefix, spool is sorted by run and seq
+        self.closing = False
+        self.interrupted = False
+        self.stop_event = threading.Event()  # set on close and interrupt
+        # counters
+        self.sent = 0
+        self.retried = 0
+        self.spooled = 0
+        self.spool_sent = 0
+        self.rejected = 0
+        self.threads = [threading.Thread(target=self._send_loop, name=f'sink_http_{i}', daemon=True)
+                        for i in range(config.connections)]
+        self.threads.append(threading.Thread(target=self._spool_loop, name='sink_spool', daemon=True))
+        for thread in self.threads:
+            thread.start()
+
+    def write_now(self, line: str):
+        """
+        Lines bypassing flush policy are for local consumer, e.g. STARTUP_HELLO, they are not sent to ingest
+        """
+        pass
+
+    def write_lines(self, lines: list):
+        lines.append('')
+        self.seq += 1
+        batch = (self.seq, '\n'.join(lines).encode('utf-8'))
+        waiting = False
+        while not self.interrupted:  # batch is dropped on interrupt, it is not acknowledged
+            with self.lock:
+                spooling = bool(self.spool_names)
+            if not spooling and self._queue(batch):
+                return
+            if self._spool(*batch):  # flight queue is full or spool has older batches
+                return
+            if not waiting:
+                waiting = True
+                self.log.warning(f'Output spool is full ({self.spool_max_bytes} bytes), waiting for endpoint')
+            time.sleep(0.05)
+
+    def interrupt(self):
+        self.interrupted = True
+        self.stop_event.set()
+        with self.lock:
+            connections = list(self.active)
+        for connection in connections:
+            try:
+                connection.sock.shutdown(socket.SHUT_RDWR)  # blocked request fails now, not after timeout_s
+            except (OSError, AttributeError):
+                pass  # not connected yet or already closed
+
+    def close(self):
+        super().close()
+        if self.closing:
+            return
+        self.closing = True
+        senders = self.threads[:-1]
+        if self.interrupted:
+            # queued batches are dropped, so senders get stop marker now
+            with contextlib.suppress(queue.Empty):
+                while True:
+                    self.queue.get_nowait()
+        for _ in senders:
+            self.queue.put(None)
+        for thread in senders:
+            thread.join()
+        self.stop_event.set()
+        self.threads[-1].join()
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats.update({'batches_sent': self.sent, 'retries': self.retried, 'spooled': self.spooled,
+                      'spool_sent': self.spool_sent, 'rejected': self.rejected})
+        return stats
+
+    def _queue(self, batch) -> bool:
+        """
+        Returns:
+            bool: False if flight queue is full
+        """
+        with self.lock:
+            self.flight.add(batch[0])
+        try:
+            self.queue.put_nowait(batch)
+            return True
+        except queue.Full:
+            with self.lock:
+                self.flight.discard(batch[0])
+            return False
+
+    def list_spool(self) -> list:
+        """
+        Returns spooled batches, the oldest first
+        """
+        return [os.path.join(self.spool_dir, name) for name in sorted(os.listdir(self.spool_dir))
+                if name.endswith('.ndjson')]
+
+    def _spool(self, seq: int, body: bytes) -> bool:
+        """
+        Stores batch to spool, acknowledges it
+        Returns:
+            bool: False if spool is full
+        """
+        name = self._spool_name(seq)
+        with self.lock:
+            if self.spool_bytes + len(body) > self.spool_max_bytes:
+                return False
+            self.spool_bytes += len(body)
+            self.spooled += 1
+        file_name = os.path.join(self.spool_dir, name)
+        with open(file_name + '.tmp', 'wb') as f:
+            f.write(body)
+        os.replace(file_name + '.tmp', file_name)
+        with self.lock:
+            bisect.insort(self.spool_names, name)
+        self._ack(seq)
+        return True
+
+    def _spool_name(self, seq: int) -> str:
+        return f'{self.run_ns:020d}-{seq:010d}.ndjson'
+
+    def _spool_after_older(self, seq: int, body: bytes) -> bool:
+        """
+        Spools batch if spool has older batches, waits for space in spool
+        Returns:
+            bool: False if batch is to be sent, spool has no older batches
+        """
+        name = self._spool_name(seq)
+        waiting = False
+        while not self.interrupted:
+            with self.lock:
+                if not self.spool_names or self.spool_names[0] > name:
+                    return False
+            if self._spool(seq, body) or self.closing:
+                return True  # not acknowledged on exit if spool is full
+            if not waiting:
+                waiting = True
+                self.log.warning(f'Output batch {seq} waits for space in spool, older batches are spooled')
+            time.sleep(0.05)
+        return True
+
+    def _post(self, connection, body: bytes):
+        """
+        Returns:
+            (connection, status): connection to reuse or None, HTTP status or None on connection error
+        """
+        if connection is None:
+            connection = self.connection_class(self.host, timeout=self.timeout_s)
+        active = connection
+        with self.lock:
+            self.active.add(active)
+        try:
+            connection.request('POST', self.path, body, self.headers)
+            response = connection.getresponse()
+            response.read()
+            if response.will_close:
+                connection.close()
+                connection = None
+            return connection, response.status
+        except (OSError, http.client.HTTPException) as ex:
+            self.log.debug(f'POST {self.host}{self.path} failed: {ex}')
+            connection.close()
+            return None, None
+        finally:
+            with self.lock:
+                self.active.discard(active)
+
+    @staticmethod
+    def _is_retryable(status) -> bool:
+        return status is None or status in (408, 429) or status >= 500
+
+    def _send_loop(self):
+        connection = None
+        while not self.interrupted:
+            batch = self.queue.get()
+            if batch is None:
+                break
+            seq, body = batch
+            if not self._spool_after_older(seq, body):
+                connection = self._send(connection, seq, body)
+            with self.lock:
+                self.flight.discard(seq)
+        if connection is not None:
+            connection.close()
+
+    def _send(self, connection, seq: int, body: bytes):
+        """
+        Sends batch with retries, spools it when retries are exhausted. Batch is dropped on interrupt
+        Returns:
+            connection to reuse or None
+        """
+        data = gzip.compress(body, 6) if self.gzip else body
+        attempt = 0
+        spool_full = False
+        while not self.interrupted:
+            connection, status = self._post(connection, data)
+            if not self._is_retryable(status):
+                if status >= 300:
+                    self.log.error(f'Output batch {seq} is rejected, HTTP {status}')
+                    with self.lock:
+                        self.rejected += 1
+                else:
+                    with self.lock:
+                        self.sent += 1
+                self._ack(seq)
+                break
+            if attempt >= self.retries:
+                if self._spool(seq, body) or self.closing:
+                    break  # spooled, not acknowledged on exit if spool is full
+                if not spool_full:
+                    spool_full = True  # batch holds sender, flight queue fills up and writer waits
+                    self.log.warning(f'Output batch {seq} is not sent after {self.retries} retries and spool is '
+                                     f'full, retrying till endpoint recovers')
+            attempt += 1
+            with self.lock:
+                self.retried += 1
+            self.stop_event.wait(self.backoff_s * 2 ** min(attempt - 1, self.retries))  # interrupt ends wait
+        return connection
+
+    def _spool_loop(self):
+        connection = None
+        while not self.stop_event.wait(self.backoff_s * 2 ** self.retries):
+            for file_name in self.list_spool():
+                name = os.path.basename(file_name)
+                with self.lock:
+                    if self.stop_event.is_set() or (self.flight and self._spool_name(min(self.flight)) < name):
+                        break  # batches in flight are older than spooled ones, they are sent first
+                with open(file_name, 'rb') as f:
+                    body = f.read()
+                connection, status = self._post(connection, gzip.compress(body, 6) if self.gzip else body)
+                if self._is_retryable(status):
+                    break  # endpoint is down, retry later
+                if status >= 300:
+                    self.log.error(f'Spooled batch "{file_name}" is rejected, HTTP {status}')
+                os.remove(file_name)
+                with self.lock:
+                    self.spool_names.remove(name)
+                    self.spool_bytes -= len(body)
+                    self.spool_sent += 1
+        if connection is not None:
+            connection.close()
+
+
+class QueuedSink(AckedSink):
+    """
+    Decouples Tailer from slow consumer, e.g. agent that stops reading stdout pipe. Each flush is queued in memory and
+    written to destination sink by writer thread. When memory queue is full batches are spilled to memory-mapped ring
+    file (see SpillRing), while spill has batches new batches go there too, so output order is kept. Tailer waits only
+    when spill is full as well. Batch larger than spill is split into records at line boundaries; line that does not
+    fit spill alone is logged as error and waits till queue is empty. Batch is acknowledged when all its records are
+    written to destination, so bookmarks do not get ahead of consumer: batches left in queue on exit are tailed again
+    after restart.
+    """
+
+    def __init__(self, config, sink: OutputSink):
+        """
+        Args:
+            config: opts.OutputConfig
+            sink: destination sink, its write_lines is called by writer thread
+        """
+        super().__init__(config)
+        self.log = logging.getLogger('tailer')
+        self.sink = sink
+        self.max_bytes = config.queue_kb * 1024  # approximate, counted in characters
+        self.memory = collections.deque()  # records, lines joined by new line
+        self.memory_bytes = 0
+        self.spill = SpillRing(config.spill_file, config.spill_mb * 1024 * 1024)
+        self.max_record = self.spill.capacity - g_spill_header.size  # bytes
+        self.batch_ends = collections.deque()  # per queued record in order, True if it is the last record of batch
+        self.condition = threading.Condition()
+        self.interrupted = False
+        self.closing = False
+        # counters
+        self.spilled_bytes = 0
+        self.blocked_ns = 0  # Tailer waited for space in queue
+        self.thread = threading.Thread(target=self._write_loop, name='sink_writer', daemon=True)
+        self.thread.start()
+
+    def write_lines(self, lines: list):
+        records = self._split(lines)
+        self.seq += 1
+        blocked_ts = None
+        with self.condition:
+            for i, data in enumerate(records):
+                while not self.interrupted:  # batch is dropped on interrupt, it is not acknowledged
+                    if not self.spill and (not self.memory or self.memory_bytes + len(data) <= self.max_bytes):
+                        self.memory.append(data)
+                        self.memory_bytes += len(data)
+                        break
+                    encoded = data.encode('utf-8')
+                    if len(encoded) <= self.max_record and self.spill.write(encoded):
+                        self.spilled_bytes += len(encoded)
+                        break
+                    if blocked_ts is None:
+                        blocked_ts = time.perf_counter_ns()
+                    self.condition.wait(0.1)
+                if self.interrupted:
+                    break
+                self.batch_ends.append(i == len(records) - 1)
+                self.condition.notify_all()
+            if blocked_ts is not None:
+                self.blocked_ns += time.perf_counter_ns() - blocked_ts
+
+    def interrupt(self):
+        with self.condition:
+            self.interrupted = True
+            self.condition.notify_all()
+
+    def close(self):
+        """
+        Waits till queue is written to destination, unless interrupted
+        """
+        super().close()
+        with self.condition:
+            self.closing = True
+            self.condition.notify_all()
+        while self.thread.is_alive() and not self.interrupted:  # writer may be stuck in slow consumer
+            self.thread.join(0.1)
+        if not self.interrupted:
+            self.sink.close()
+        with self.condition:
+            self.spill.close()
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        with self.condition:
+            stats.update({'queued': len(self.memory) + len(self.spill),
+                          'queued_bytes': self.memory_bytes + self.spill.used, 'spilled_bytes': self.spilled_bytes,
+                          'blocked_s': round(self.blocked_ns / 1e9, 3)})
+        return stats
+
+    def _write_loop(self):
+        seq = 0
+        while True:
+            with self.condition:
+                while not self.memory and not self.spill and not self.closing and not self.interrupted:
+                    self.condition.wait()
+                if self.interrupted or (self.closing and not self.memory and not self.spill):
+                    return
+                if self.memory:
+                    data = self.memory.popleft()
+                    self.memory_bytes -= len(data)
+                else:
+                    data = self.spill.read().decode('utf-8')
+                batch_end = self.batch_ends.popleft()
+                self.condition.notify_all()
+            self.sink.write_lines(data.split('\n'))
+            if batch_end:
+                seq += 1
+                self._ack(seq)
+
+    def _split(self, lines: list) -> list:
+        """
+        Returns records of batch, lines joined by new line. Batch is split only if it does not fit spill
+        """
+        data = '\n'.join(lines)
+        if len(data) * 4 <= self.max_record or len(data.encode('utf-8')) <= self.max_record:  # up to 4 bytes per char
+            return [data]
+        records = []
+        record = []
+        record_bytes = 0
+        for line in lines:
+            line_bytes = len(line.encode('utf-8'))
+            if line_bytes > self.max_record:
+                self.log.error(f'Output line of {line_bytes} bytes does not fit spill of {self.spill.capacity} bytes, '
+                               f'it waits till output queue is empty. Increase output.spill_mb')
+            if record and record_bytes + 1 + line_bytes > self.max_record:
+                records.append('\n'.join(record))
+                record = []
+                record_bytes = 0
+            record_bytes += line_bytes + (1 if record else 0)
+            record.append(line)
+        records.append('\n'.join(record))
+        return records
+
+
+def create_sink(config, tail_out: logging.Logger) -> OutputSink:
+    """
+    Args:
+        config: opts.OutputConfig
+        tail_out: tail_out logger, used by "logging" sink
+    """
+    if config.sink == 'logging':
+        sink = LoggingSink(config, tail_out)
+    elif config.sink == 'stdout':
+        sink = StreamSink(config, sys.stdout)
+    elif config.sink == 'file':
+        sink = FileSink(config)
+    elif config.sink == 'http':
+        return HttpSink(config)  # queued already
+    else:
+        raise errors.ConfigError(f'Unknown output sink: {config.sink}')
+    if config.queue_kb > 0:
+        return QueuedSink(config, sink)
+    return sink
@@ -0,0 +1,408 @@
+import os
+import re
+import json
+import time
+import random
+import logging
+import threading
+import collections
+import winevt_tailer.utils as utils
+import winevt_tailer.errors as errors
+import winevt_tailer.render as render
+from winevt_tailer.waiters import ChannelWaiter
+
+
+class EventSource:
+    """
+    Event source used by Tailer: queries old events, subscribes to new events, waits for channels to be signalled,
+    renders events and maintains bookmarks. Channels are referenced by index in TailerConfig.channels.
+    Query and subscription handles are opaque to Tailer, they are passed back to next().
+    """
+    evtlog = None  # win32evtlog compatible API used for publisher metadata, see metadata.py
+    locale = 0  # locale id of message templates
+    exhausted = False  # True when source has no more events and never will have, e.g. replay completed
+
+    def query(self, ch_idx: int):
+        """ Returns query handle for old events in forward direction """
+        raise NotImplementedError()
+
+    def seek_bookmark(self, query, bookmark):
+        """ Seeks query to bookmarked event. Raises exception if bookmarked event is not found """
+        raise NotImplementedError()
+
+    def seek_last(self, query, offset: int):
+        """ Seeks query relative to last event, offset <= 0 """
+        raise NotImplementedError()
+
+    def subscribe(self, ch_idx: int, bookmark=None):
+        """ Returns subscription handle for new events: after bookmark or future events if bookmark is None """
+        raise NotImplementedError()
+
+    def next(self, handle, count: int, timeout_ms: int) -> list:
+        """ Returns list of up to count events from query or subscription handle, empty list if no events """
+        raise NotImplementedError()
+
+    def wait(self, timeout_ms: int):
+        """ Waits for channel subscription to be signalled. Returns channel index or None on timeout """
+        raise NotImplementedError()
+
+    def render_xml(self, event_h) -> str:
+        """ Returns event as XML string """
+        raise NotImplementedError()
+
+    def render_values(self, ch_idx: int, event_h) -> dict:
+        """ Returns event as output record built from rendered values, see ChannelConfig.render """
+        raise NotImplementedError()
+
+    def create_bookmark(self, xml_str: str = None):
+        raise NotImplementedError()
+
+    def update_bookmark(self, bookmark, event_h):
+        raise NotImplementedError()
+
+    def render_bookmark(self, bookmark) -> str:
+        raise NotImplementedError()
+
+    def close(self):
+        """ Releases resources, e.g. stops threads """
+        pass
+
+
+class Win32EventSource(EventSource):
+    """
+    Windows Event Log source, win32evtlog API. Any number of channels, see ChannelWaiter
+    """
+
+    def __init__(self, channels: list):
+        import win32evtlog
+        self.evtlog = win32evtlog
+        self.channels = channels
+        self.waiter = ChannelWaiter(len(channels))
+        self.signals = self.waiter.signals
+        self.locale = utils.get_thread_locale()
+        self.values_renderer = None  # created on first use, render contexts are not needed in XML render mode
+        self.values_renderer_lock = threading.Lock()  # first use can be in several workers at once
+
+    def query(self, ch_idx: int):
+        channel = self.channels[ch_idx]
+        return self.evtlog.EvtQuery(channel.name, self.evtlog.EvtQueryForwardDirection, channel.effective_query)
+
+    def seek_bookmark(self, query, bookmark):
+        self.evtlog.EvtSeek(query, 0, self.evtlog.EvtSeekRelativeToBookmark | self.evtlog.EvtSeekStrict, bookmark)
+
+    def seek_last(self, query, offset: int):
+        self.evtlog.EvtSeek(query, offset, self.evtlog.EvtSeekRelativeToLast)
+
+    def subscribe(self, ch_idx: int, bookmark=None):
+        channel = self.channels[ch_idx]
+        if bookmark is not None:
+            return self.evtlog.EvtSubscribe(
+                channel.name,
+                self.evtlog.EvtSubscribeStartAfterBookmark,
+                Bookmark=bookmark,
+                SignalEvent=self.signals[ch_idx],
+                Query=channel.effective_query
+            )
+        return self.evtlog.EvtSubscribe(
+            channel.name,
+            self.evtlog.EvtSubscribeToFutureEvents,
+            SignalEvent=self.signals[ch_idx],
+            Query=channel.effective_query
+        )
+
+    def next(self, handle, count: int, timeout_ms: int) -> list:
+        return self.evtlog.EvtNext(handle, Count=count, Timeout=timeout_ms)
+
+    def wait(self, timeout_ms: int):
+        return self.waiter.wait(timeout_ms)
+
+    def render_xml(self, event_h) -> str:
+        return self.evtlog.EvtRender(event_h, self.evtlog.EvtRenderEventXml)
+
+    def render_values(self, ch_idx: int, event_h) -> dict:
+        system, user = self.get_values_renderer().render(event_h)
+        return render.build_record(system, user, self.channels[ch_idx].value_names)
+
+    def get_values_renderer(self) -> render.ValuesRenderer:
+        if self.values_renderer is None:
+            with self.values_renderer_lock:
+                if self.values_renderer is None:
+                    self.values_renderer = render.ValuesRenderer(self.evtlog)
+        return self.values_renderer
+
+    def create_bookmark(self, xml_str: str = None):
+        return self.evtlog.EvtCreateBookmark(xml_str)
+
+    def update_bookmark(self, bookmark, event_h):
+        self.evtlog.EvtUpdateBookmark(bookmark, event_h)
+
+    def render_bookmark(self, bookmark) -> str:
+        return self.evtlog.EvtRender(bookmark, self.evtlog.EvtRenderBookmark)
+
+    def close(self):
+        self.waiter.close()
+
+
+class RecordingEventSource(EventSource):
+    """
+    Passes events through from another source and records them as rendered XML to corpus file for
+    ReplayEventSource. Corpus file format: JSON line per event - {"channel": "<name>", "xml": "<Event ...>"}
+    """
+
+    def __init__(self, source: EventSource, channels: list, file_name: str):
+        self.source = source
+        self.channels = channels
+        self.evtlog = source.evtlog
+        self.locale = source.locale
+        self.handles = {}  # id(query or subscription handle) -> ch_idx
+        self.file = open(file_name, 'a', encoding='utf-8')
+
+    def query(self, ch_idx: int):
+        handle = self.source.query(ch_idx)
+        self.handles[id(handle)] = ch_idx
+        return handle
+
+    def seek_bookmark(self, query, bookmark):
+        self.source.seek_bookmark(query, bookmark)
+
+    def seek_last(self, query, offset: int):
+        self.source.seek_last(query, offset)
+
+    def subscribe(self, ch_idx: int, bookmark=None):
+        handle = self.source.subscribe(ch_idx, bookmark)
+        self.handles[id(handle)] = ch_idx
+        return handle
+
+    def next(self, handle, count: int, timeout_ms: int) -> list:
+        events = self.source.next(handle, count, timeout_ms)
+        if events:
+            channel_name = self.channels[self.handles[id(handle)]].name
+            for event_h in events:
+                xml_str = self.source.render_xml(event_h)
+                self.file.write(json.dumps({'channel': channel_name, 'xml': xml_str}) + '\n')
+            self.file.flush()
+        return events
+
+    def wait(self, timeout_ms: int):
+        return self.source.wait(timeout_ms)
+
+    def render_xml(self, event_h) -> str:
+        return self.source.render_xml(event_h)
+
+    def render_values(self, ch_idx: int, event_h) -> dict:
+        return self.source.render_values(ch_idx, event_h)
+
+    def create_bookmark(self, xml_str: str = None):
+        return self.source.create_bookmark(xml_str)
+
+    def update_bookmark(self, bookmark, event_h):
+        self.source.update_bookmark(bookmark, event_h)
+
+    def render_bookmark(self, bookmark) -> str:
+        return self.source.render_bookmark(bookmark)
+
+    def close(self):
+        self.source.close()
+        self.file.close()
+
+
+class ReplayEvent:
+    __slots__ = ('ch_idx', 'xml', 'record_id', 'due_ts')
+
+    def __init__(self, ch_idx: int, xml: str, record_id: int, due_ts: float):
+        self.ch_idx = ch_idx
+        self.xml = xml
+        self.record_id = record_id  # replay sequence number, 1 based
+        self.due_ts = due_ts  # scheduled time, time.perf_counter(), for latency measurement
+
+
+class ReplayBookmark:
+    def __init__(self, record_id: int = 0):
+        self.record_id = record_id
+
+
+class ReplayEvtlog:
+    """ Publisher metadata API for replayed events: no metadata for any provider """
+
+    EvtFormatMessageEvent = 1
+    EvtFormatMessageId = 8
+
+    @staticmethod
+    def EvtOpenPublisherMetadata(provider_name):
+        raise FileNotFoundError(2, 'EvtOpenPublisherMetadata', provider_name)
+
+
+g_channel_re = re.compile(r'<Channel>([^<]*)</Channel>')
+g_record_id_re = re.compile(r"RecordId='(\d+)'")
+
+
+class ReplayEventSource(EventSource):
+    """
+    Replays recorded corpus of rendered event XML as new events, at configured rate, burst pattern and channel mix.
+    Does not need Windows, used to measure Tailer throughput and latency and to reproduce event storms.
+    Events are delivered to subscriptions only, queries return no events. Channel is chosen for each event by
+    weighted random choice (seeded, deterministic), then next corpus event of that channel is used, round-robin.
+    """
+
+    def __init__(self, config, channels: list):
+        """
+        Args:
+            config: opts.ReplayConfig
+            channels: list of opts.ChannelConfig
+        """
+        self.log = logging.getLogger('replay')
+        self.evtlog = ReplayEvtlog()
+        self.channels = channels
+        corpus = load_corpus(config.corpus)
+        if not corpus:
+            raise errors.ConfigError(f'Replay corpus is empty: {config.corpus}')
+        # corpus events per tailer channel, channels without recorded events replay the whole corpus
+        all_xml = [xml_str for _, xml_str in corpus]
+        self.corpus = [[xml_str for name, xml_str in corpus if name == channel.name] or all_xml
+                       for channel in channels]
+        if config.channel_mix:
+            self.weights = [config.channel_mix.get(channel.name, 0) for channel in channels]
+        else:
+            self.weights = [len(channel_corpus) for channel_corpus in self.corpus]
+        if sum(self.weights) <= 0:
+            raise errors.ConfigError(f'Replay channel_mix does not match any channel: {config.channel_mix}')
+        self.random = random.Random(config.seed)
+        self.positions = [0] * len(channels)  # round-robin position in channel corpus
+        self.limit = config.limit or len(corpus)
+        self.released = 0  # number of events scheduled so far
+        self.pending = [collections.deque() for _ in channels]  # released, not fetched yet
+        self.pending_count = 0
+        self.max_pending = 10000
+        # schedule: list of (duration_s, rate), cycled. rate 0 in pattern means pause
+        self.pattern = [tuple(phase) for phase in config.pattern] or [(0, config.rate)]
+        self.phase_idx = 0
+        self.start_ts = None
+        self.next_due = None
+        self.phase_end = None
+
+    @property
+    def exhausted(self) -> bool:
+        return self.released >= self.limit and self.pending_count == 0
+
+    def query(self, ch_idx: int):
+        return None
+
+    def seek_bookmark(self, query, bookmark):
+        pass
+
+    def seek_last(self, query, offset: int):
+        pass
+
+    def subscribe(self, ch_idx: int, bookmark=None):
+        if self.start_ts is None:
+            self._start()
+        return ch_idx
+
+    def next(self, handle, count: int, timeout_ms: int) -> list:
+        if handle is None:
+            return []  # query, no old events
+        pending = self.pending[handle]
+        if len(pending) < count:
+            self._release(time.perf_counter(), handle, count)
+        events = []
+        while pending and len(events) < count:
+            events.append(pending.popleft())
+        self.pending_count -= len(events)
+        return events
+
+    def wait(self, timeout_ms: int):
+        now = time.perf_counter()
+        self._release(now)
+        if self.pending_count == 0 and self.released < self.limit:
+            # sleep till next event is due or timeout
+            delay = self.next_due - now
+            if delay > timeout_ms / 1000:
+                time.sleep(timeout_ms / 1000)
+                return None
+            if delay > 0:
+                time.sleep(delay)
+            self._release(time.perf_counter(), max_count=1)
+        if self.pending_count == 0:
+            if self.released >= self.limit:
+                time.sleep(timeout_ms / 1000)
+            return None
+        # channel of the oldest pending event
+        return min((pending[0].due_ts, ch_idx) for ch_idx, pending in enumerate(self.pending) if pending)[1]
+
+    def render_xml(self, event_h) -> str:
+        return event_h.xml
+
+    def render_values(self, ch_idx: int, event_h) -> dict:
+        system, user = render.xml_to_values(event_h.xml)
+        return render.build_record(system, user, self.channels[ch_idx].value_names)
+
+    def create_bookmark(self, xml_str: str = None):
+        m = g_record_id_re.search(xml_str) if xml_str else None
+        return ReplayBookmark(int(m.group(1)) if m else 0)
+
+    def update_bookmark(self, bookmark, event_h):
+        bookmark.record_id = event_h.record_id
+
+    def render_bookmark(self, bookmark) -> str:
+        return f"<BookmarkList><Bookmark Channel='replay' RecordId='{bookmark.record_id}' IsCurrent='true'/>" \
+               f"</BookmarkList>"
+
+    def _start(self):
+        self.start_ts = self.next_due = time.perf_counter()
+        self.phase_end = self.start_ts + self.pattern[0][0]
+
+    def _release(self, now: float, wanted_ch_idx: int = None, wanted_count: int = 0, max_count: int = None):
+        # move events that are due by now to pending queues
+        released = 0
+        while self.released < self.limit and self.next_due <= now and self.pending_count < self.max_pending:
+            if wanted_ch_idx is not None and len(self.pending[wanted_ch_idx]) >= wanted_count:
+                break
+            if max_count is not None and released >= max_count:
+                break
+            duration, rate = self.pattern[self.phase_idx]
+            if len(self.pattern) > 1 and self.next_due >= self.phase_end:
+                # next phase of burst pattern
+                self.phase_idx = (self.phase_idx + 1) % len(self.pattern)
+                self.next_due = max(self.next_due, self.phase_end)
+                self.phase_end += self.pattern[self.phase_idx][0]
+                continue
+            if rate <= 0 and len(self.pattern) > 1:
+                self.next_due = self.phase_end  # pause
+                continue
+            ch_idx = self.random.choices(range(len(self.channels)), self.weights)[0]
+            channel_corpus = self.corpus[ch_idx]
+            xml_str = channel_corpus[self.positions[ch_idx] % len(channel_corpus)]
+            self.positions[ch_idx] += 1
+            self.released += 1
+            released += 1
+            self.pending[ch_idx].append(ReplayEvent(ch_idx, xml_str, self.released, self.next_due))
+            self.pending_count += 1
+            if rate > 0:
+                self.next_due += 1 / rate
+
+
+def load_corpus(path: str) -> list:
+    """
+    Loads recorded events: JSON lines file written by RecordingEventSource or directory of *.xml files,
+    one event per file.
+    Returns:
+        list: list of (channel_name, xml_str)
+    """
+    corpus = []
+    try:
+        if os.path.isdir(path):
+            for file_name in sorted(os.listdir(path)):
+                if file_name.endswith('.xml'):
+                    with open(os.path.join(path, file_name), 'r', encoding='utf-8') as f:
+                        xml_str = f.read().strip()
+                    m = g_channel_re.search(xml_str)
+                    corpus.append((m.group(1) if m else '', xml_str))
+        else:
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        corpus.append((record['channel'], record['xml']))
+    except (OSError, ValueError, KeyError) as ex:
+        raise errors.ConfigError(f'Failed to load replay corpus "{path}": {ex}')
+    return corpus
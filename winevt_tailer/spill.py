@@ -0,0 +1,99 @@
+import os
+import mmap
+import struct
+
+g_header = struct.Struct('<I')  # record length
+g_wrap = 0xFFFFFFFF  # record length marker: next record is at file start
+
+
+class SpillRing:
+    """
+    FIFO of byte records in memory-mapped file used as ring buffer, spill of output queue, see sinks.QueuedSink.
+    Record is length (4 bytes) followed by data. Record that does not fit at the end of file is written at start,
+    wrap marker is left at its place. File is created on first write and removed on close, it is not recovered after
+    restart: spilled output is not acknowledged, so its events are tailed again.
+    """
+
+    def __init__(self, file_name: str, capacity: int):
+        """
+        Args:
+            file_name: spill file
+            capacity: file size, bytes
+        """
+        self.file_name = file_name
+        self.capacity = capacity
+        self.file = None
+        self.map = None
+        self.head = 0  # next record to read
+        self.tail = 0  # next record to write
+        self.used = 0  # bytes between head and tail, including space skipped by wrap
+        self.count = 0  # records
+
+    def __len__(self):
+        return self.count
+
+    def write(self, data: bytes) -> bool:
+        """
+        Appends record
+        Returns:
+            bool: False if there is no space for record
+        """
+        size = g_header.size + len(data)
+        if self.used == 0:
+            self.head = self.tail = 0
+        if self.tail > self.head or self.used == 0:  # free space at end and before head
+            if size <= self.capacity - self.tail:
+                pos = self.tail
+            elif size <= self.head:
+                pos = 0  # wrap
+            else:
+                return False
+        elif size <= self.head - self.tail:
+            pos = self.tail
+        else:
+            return False
+        if self.map is None:
+            self.open()
+        if pos != self.tail:
+            if self.capacity - self.tail >= g_header.size:
+                g_header.pack_into(self.map, self.tail, g_wrap)
+            self.used += self.capacity - self.tail
+        g_header.pack_into(self.map, pos, len(data))
+        self.map[pos + g_header.size:pos + size] = data
+        self.tail = pos + size
+        self.used += size
+        self.count += 1
+        return True
+
+    def read(self):
+        """
+        Returns the oldest record and removes it, None if there are no records
+        """
+        if not self.count:
+            return None
+        if self.capacity - self.head < g_header.size or g_header.unpack_from(self.map, self.head)[0] == g_wrap:
+            self.used -= self.capacity - self.head
+            self.head = 0
+        length, = g_header.unpack_from(self.map, self.head)
+        start = self.head + g_header.size
+        data = self.map[start:start + length]
+        self.head = start + length
+        self.used -= g_header.size + length
+        self.count -= 1
+        return data
+
+    def open(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.file_name)), exist_ok=True)
+        self.file = open(self.file_name, 'w+b')
+        self.file.truncate(self.capacity)
+        self.map = mmap.mmap(self.file.fileno(), self.capacity)
+
+    def close(self):
+        """
+        Closes and removes file
+        """
+        if self.map is not None:
+            self.map.close()
+            self.file.close()
+            self.map = self.file = None
+            os.remove(self.file_name)
@@ -0,0 +1,150 @@
+import time
+import threading
+import collections
+from lxml import etree
+
+# Event storm suppression, see transforms.xml_fold_storms. Events are fingerprinted by configured fields, the first
+# StormConfig.forward events of fingerprint per window are passed, the rest are folded: counted and dropped. When window
+# ends folded events are output as one summary event - the last folded event with Folded element (key in "values"
+# render mode): Count, FirstTime, LastTime.
+
+g_event_ns = {'event': 'http://schemas.microsoft.com/win/2004/08/events/event'}
+
+# fingerprint fields: XPath in event XML, path in "values" render mode record (render.build_record)
+FIELDS = {
+    'channel': ('event:System/event:Channel', ('Channel',)),
+    'provider': ('event:System/event:Provider/@Name', ('Provider', 'Name')),
+    'event_id': ('event:System/event:EventID', ('EventID',)),
+    'level': ('event:System/event:Level', ('Level',)),
+    'task': ('event:System/event:Task', ('Task',)),
+    'opcode': ('event:System/event:Opcode', ('Opcode',)),
+    'keywords': ('event:System/event:Keywords', ('Keywords',)),
+}
+
+g_time_created_xpath = etree.XPath('string(/event:Event/event:System/event:TimeCreated/@SystemTime)',
+                                   namespaces=g_event_ns)
+
+
+class FoldedEvents:
+    __slots__ = ('window_start', 'count', 'folded', 'first_time', 'last_time', 'last_event_h', 'last_obj')
+
+    def __init__(self, window_start: float):
+        self.window_start = window_start
+        self.count = 0  # events in window
+        self.folded = 0  # events folded in window
+        self.first_time = None  # TimeCreated of the first and the last folded events
+        self.last_time = None
+        self.last_event_h = None
+        self.last_obj = None  # the last folded event object, dropped by pipeline, summary is built from it
+
+
+class StormSuppressor:
+    """
+    Fingerprint table, bounded by StormConfig.max_fingerprints: the least recently seen fingerprint is evicted, its
+    folded events summary is output. Used by workers concurrently.
+    """
+
+    def __init__(self, config):
+        """
+        Args:
+            config: opts.StormConfig
+        """
+        self.window_s = config.window_s
+        self.forward = config.forward
+        self.max_fingerprints = config.max_fingerprints
+        xpaths = [f'string(/event:Event/{FIELDS[field][0]})' for field in config.fields] + \
+                 [f'string(/event:Event/event:EventData/event:Data[@Name="{name}"])' for name in config.data]
+        self.xml_fields = [etree.XPath(xpath, namespaces=g_event_ns) for xpath in xpaths]
+        self.record_fields = [FIELDS[field][1] for field in config.fields]
+        self.data_names = config.data
+        self.table = collections.OrderedDict()  # fingerprint -> FoldedEvents, least recently seen first
+        self.summaries = []  # (event_h, summary object) ready to output
+        self.sweep_s = min(self.window_s, 1)  # ended windows are summarized with this delay at most
+        self.next_sweep = time.monotonic() + self.sweep_s
+        self.lock = threading.Lock()
+        # counters
+        self.passed = 0
+        self.folded = 0
+        self.summarized = 0
+        self.evicted = 0
+
+    def xml_fingerprint(self, event_obj) -> tuple:
+        return tuple(xpath(event_obj) for xpath in self.xml_fields)
+
+    def record_fingerprint(self, record: dict) -> tuple:
+        event = record['Event']
+        values = []
+        for path in self.record_fields:
+            value = event['System']
+            for key in path:
+                value = value.get(key) if isinstance(value, dict) else None
+            if isinstance(value, dict):
+                value = value.get('text')  # EventID with Qualifiers
+            values.append(value)
+        if self.data_names:
+            event_data = event.get('EventData') or {}
+            values += [event_data.get(name) for name in self.data_names]
+        return tuple(values)
+
+    def fold(self, fingerprint: tuple, event_h, event_obj, time_created) -> bool:
+        """
+        Returns True if event is passed, False if it is folded
+        """
+        now = time.monotonic()
+        with self.lock:
+            entry = self.table.get(fingerprint)
+            if entry is None or now - entry.window_start >= self.window_s:
+                if entry is not None:
+                    self._summarize(entry)
+                entry = self.table[fingerprint] = FoldedEvents(now)
+                if len(self.table) > self.max_fingerprints:
+                    _, evicted = self.table.popitem(last=False)
+                    self.evicted += 1
+                    self._summarize(evicted)
+            else:
+                self.table.move_to_end(fingerprint)
+            entry.count += 1
+            if entry.count <= self.forward:
+                self.passed += 1
+                return True
+            entry.folded += 1
+            self.folded += 1
+            if entry.first_time is None:
+                entry.first_time = time_created
+            entry.last_time = time_created
+            entry.last_event_h = event_h
+            entry.last_obj = event_obj
+            return False
+
+    def sweep(self, now: float, flush: bool = False) -> list:
+        """
+        Returns summaries of folded events of ended windows (all windows if flush is set) as [(event_h, object)],
+        removes ended windows from table
+        """
+        if now < self.next_sweep and not flush and not self.summaries:
+            return []
+        with self.lock:
+            if now >= self.next_sweep or flush:
+                self.next_sweep = now + self.sweep_s
+                for fingerprint, entry in list(self.table.items()):
+                    if flush or now - entry.window_start >= self.window_s:
+                        del self.table[fingerprint]
+                        self._summarize(entry)
+            summaries, self.summaries = self.summaries, []
+        return summaries
+
+    def stats(self) -> dict:
+        return {'fingerprints': len(self.table), 'passed': self.passed, 'folded': self.folded,
+                'summaries': self.summarized, 'evicted': self.evicted}
+
+    def _summarize(self, entry: FoldedEvents):
+        if not entry.folded:
+            return
+        folded = {'Count': str(entry.folded), 'FirstTime': entry.first_time or '', 'LastTime': entry.last_time or ''}
+        summary = entry.last_obj
+        if isinstance(summary, dict):
+            summary['Event']['Folded'] = folded
+        else:
+            etree.SubElement(summary, 'Folded', folded)
+        self.summarized += 1
+        self.summaries.append((entry.last_event_h, summary))
@@ -1,18 +1,29 @@
 import os
+import re
 import sys
 import logging
 import time
+import threading
 import contextlib
-from lazy_string import LazyString
-import lxml
-from lxml import etree
-import win32evtlog
-import win32event
-import win32con
 import winevt_tailer.opts as opts
 import winevt_tailer.utils as utils
 import winevt_tailer.consts as consts
 import winevt_tailer.errors as errors
+import winevt_tailer.metrics as metrics
+import winevt_tailer.pipeline as pipeline
+import winevt_tailer.sinks as sinks
+import winevt_tailer.transforms as transforms
+import winevt_tailer.workers as workers
+from winevt_tailer.batching import BatchSizer
+from winevt_tailer.bookmarks import BookmarkStore
+from winevt_tailer.catchup import ChannelCatchUp
+from winevt_tailer.scheduler import FairScheduler
+from winevt_tailer.storm import StormSuppressor
+from winevt_tailer.sampling import EventSampler
+from winevt_tailer.projection import Projection
+from winevt_tailer.truncation import Truncator
+from winevt_tailer.metadata import PublisherMetadataCache, MessageTemplateCatalog
+from winevt_tailer.sources import EventSource, Win32EventSource, ReplayEventSource, RecordingEventSource
 
 
 class Tailer:
@@ -28,188 +39,603 @@ class Tailer:
 
      Transform value type is string that represents Python function import path.
      Function signature: def transform(context:dict, event:object): object
+
+    Events come from event source: Windows Event Log by default or recorded events replay (see TailerConfig.replay).
+
+    Event handling stages (render, parse, transforms, tail_out) are timed per channel when TailerConfig.stats_report_s
+    is set, process_event and emit are replaced by instrumented versions then, so there is no cost when stats are
+    disabled.
+
+    Main loop is the reader: it fetches batches of events and submits them to batch processor (see workers), which
+    processes events (process_event: render, parse, transforms) inline or in worker pool when TailerConfig.workers is
+    set, and emits them in read order (emit: tail output). Bookmarks advance after events are emitted (batch_done).
     """
 
-    def __init__(self, name, config: opts.TailerConfig):
+    def __init__(self, name, config: opts.TailerConfig, source: EventSource = None):
         self.name = name
         self.is_stop = False
         self.config = config
         self.log = logging.getLogger("tailer")
         self.tail_out = logging.getLogger('tail_out')
         self.tail_out.propagate = False
-        # max number of channels per tailer is limited
-        if len(config.channels) > win32event.MAXIMUM_WAIT_OBJECTS:
-            raise errors.ConfigError(
-                f'Too many channels - {len(config.channels)}. Maximum supported - {win32event.MAXIMUM_WAIT_OBJECTS}')
-        self.context = {}
+        if config.output.spool_dir is None:
+            config.output.spool_dir = f'{config.bookmarks_dir}/{consts.TAILER_TYPE}_{name}.spool'
+        if config.output.spill_file is None:
+            config.output.spill_file = f'{config.bookmarks_dir}/{consts.TAILER_TYPE}_{name}.spill'
+        self.sink = sinks.create_sink(config.output, self.tail_out)  # tail output, batched
+        self.output_lock = threading.Lock()  # tail output and bookmarks, shared by reader and writer
+        # EvtNext batch size and timeout per channel
+        self.batch_sizers = [
+            BatchSizer(ch.batch_size or config.batch_size,
+                       ch.batch_timeout_ms if ch.batch_timeout_ms is not None else config.batch_timeout_ms,
+                       ch.adaptive_batch if ch.adaptive_batch is not None else config.adaptive_batch,
+                       config.batch_size_min, config.batch_size_max) for ch in config.channels]
+        if source is None:
+            if config.replay is not None:
+                source = ReplayEventSource(config.replay, config.channels)
+            else:
+                source = Win32EventSource(config.channels)
+        if config.record:
+            source = RecordingEventSource(source, config.channels, config.record)
+        self.source = source
+        metadata_cache = PublisherMetadataCache(config.publisher_cache_size, config.publisher_negative_ttl_s,
+                                                evtlog=source.evtlog)
+        self.context = {
+            'publisher_metadata': metadata_cache,
+            'message_templates': MessageTemplateCatalog(metadata_cache, source.locale,
+                                                        config.message_template_cache_size, evtlog=source.evtlog),
+            'storm': StormSuppressor(config.storm),
+            'sampler': EventSampler(config.channels, config.aggregate_s),
+            'projection': Projection(config.projection),
+            'truncator': Truncator(config.truncate),
+            'drop_regex': re.compile('|'.join(f'(?:{p})' for p in config.drop_regex)) if config.drop_regex else None,
+            'json_drop_cr': config.json_drop_cr,
+        }
         self.channel_transforms = [channel.transforms for channel in config.channels]
         self.final_transforms = config.transforms
-        self.signals = [win32event.CreateEvent(None, 0, 0, None) for _ in config.channels]
+        # channel and final transforms fused into one callable per channel
+        self.pipelines = pipeline.compile_pipelines(config)
+        self.render_values = [p.render == 'values' for p in self.pipelines]  # per channel, see ChannelConfig.render
+        for channel, p in zip(config.channels, self.pipelines):
+            if channel.render != p.render:
+                xforms = [metrics.callable_name(xform) for xform in pipeline.tree_transforms(p.transforms)]
+                self.log.warning(f'Channel "{channel.name}" is rendered as XML, transforms need XML tree: {xforms}')
+        # summaries of folded events pass through transforms that follow storm suppression, per render mode. It is
+        # allowed in top level transforms only, so transforms that follow it are the same for all channels
+        self.fold_tails = {}
+        for p in self.pipelines:
+            for i, xform in enumerate(p.transforms):
+                if xform in (transforms.xml_fold_storms, transforms.values_fold_storms):
+                    self.fold_tails.setdefault(p.render, pipeline.compile_pipeline(p.transforms[i + 1:]))
+                    break
+        self.storm = self.context['storm'] if self.fold_tails else None
+        # aggregate records are output by main loop when any channel is sampled
+        self.sampler = None
+        for channel, p in zip(config.channels, self.pipelines):
+            if transforms.xml_sample_events in p.transforms or transforms.values_sample_events in p.transforms:
+                self.sampler = self.context['sampler']
+            elif channel.sampling:
+                self.log.warning(f'Channel "{channel.name}" has sampling config, but no xml_sample_events transform')
+        # truncations are reported with counters
+        self.truncator = None
+        if any(transforms.xml_truncate_fields in p.transforms or transforms.values_truncate_fields in p.transforms
+               for p in self.pipelines):
+            self.truncator = self.context['truncator']
         if self.config.lookback < 0:
             self.config.lookback = sys.maxsize
         self.bookmarks_filename = f'{self.config.bookmarks_dir}/{consts.TAILER_TYPE}_{self.name}.bookmarks'
         if self.config.persistent:
             os.makedirs(config.bookmarks_dir, exist_ok=True)
-        if config.persistent and os.path.isfile(self.bookmarks_filename):
-            self.bookmarks = utils.load_bookmarks(self.bookmarks_filename, config.channels)
+        # bookmarks snapshot + journal of changed bookmarks
+        self.bookmark_store = BookmarkStore(self.bookmarks_filename, config.bookmarks_fsync,
+                                            config.bookmarks_compact_kb * 1024)
+        if config.persistent and self.bookmark_store.exists():
+            self.bookmarks = self.bookmark_store.load(config.channels, source)
         else:
-            self.bookmarks = [win32evtlog.EvtCreateBookmark(None) for _ in config.channels]
+            self.bookmarks = [source.create_bookmark() for _ in config.channels]
+        self.bookmarks_dirty = set()  # channels with bookmarks updated since last commit
         self.bookmarks_commit_ts = 0  # monotonic
-        self.bookmarks_update_ts = 0  # monotonic
+        # message templates catalog is persisted next to bookmarks to start warm after restart
+        self.templates_filename = f'{self.config.bookmarks_dir}/{consts.TAILER_TYPE}_{self.name}.templates'
+        if config.persistent and os.path.isfile(self.templates_filename):
+            try:
+                self.context['message_templates'].load(self.templates_filename)
+            except Exception as ex:
+                self.log.warning(f'Failed to load message templates "{self.templates_filename}": {ex}')
+        # per-stage stats
+        self.stats = None
+        if config.stats_report_s > 0:
+            self.stats = metrics.StageStats(config.stats_report_s)
+            self.stage_timers = []  # per channel: (render timer, [(stage, timer)], tail_out timer)
+            for channel, p in zip(config.channels, self.pipelines):
+                # timers are reported in creation order
+                render_timer = self.stats.timer(channel.name, 'render_values' if p.render == 'values' else 'render')
+                stages = [(xform, metrics.callable_name(xform)) for xform in p.transforms]
+                if p.parse_at is not None:
+                    stages.insert(p.parse_at, (pipeline.parse_stage, 'parse'))
+                stage_timers = [(stage, self.stats.timer(channel.name, name)) for stage, name in stages]
+                self.stage_timers.append((render_timer, stage_timers, self.stats.timer(channel.name, 'tail_out')))
+            self.process_event = self.process_event_timed
+            self.emit = self.emit_timed
+        self.event_processor = self.process_event  # process_event without profiler events counting
+        # counters are reported by main loop, also when no events are emitted (e.g. stalled consumer)
+        self.counters_report_ts = time.monotonic() + config.counters_report_s
+        # sampling profiler
+        self.profiler = None
+        self.profiler_lock = threading.Lock()
+        self.profile_events_left = 0
+        # reader -> workers -> writer, inline if no workers
+        self.processor = workers.create_processor(self, config.workers, config.queue_depth)
+        self.catchups = {}  # ch_idx -> ChannelCatchUp, channels reading old events
+        self.catchup_stats = {}  # ch_idx -> ChannelCatchUp, all channels that had catch-up
+        self.subscriptions = []  # per channel subscription handle, replaced when channel catch-up is complete
+        # channels with new events take turns, see FairScheduler
+        self.scheduler = FairScheduler([config.channel_budget * ch.weight for ch in config.channels])
 
     def reset_state(self):
         """
         Reset persistent state - remove bookmarks
         """
+        self.bookmark_store.remove()
+        self.log.info(f'Removed files: "{self.bookmarks_filename}", "{self.bookmark_store.journal_file_name}"')
         with contextlib.suppress(FileNotFoundError):
-            os.remove(self.bookmarks_filename)
-        self.log.info(f'Removed file: "{self.bookmarks_filename}"')
+            os.remove(self.templates_filename)
+        self.log.info(f'Removed file: "{self.templates_filename}"')
 
-    def stop(self) -> bool:
+    def stop(self, force: bool = False) -> bool:
+        """
+        Graceful stop: main loop exits, queued output is drained on exit. Forced or repeated stop also interrupts output
+        waiting for slow consumer, queued output is dropped then and tailed again after restart.
+        Returns:
+            bool: True on first stop
+        """
+        if force or self.is_stop:
+            self.sink.interrupt()
         if self.is_stop:
             return False
         self.is_stop = True
         return True
 
     def run(self) -> int:
+        """
+        Runs main loop, commits bookmarks, flushes output, reports stage stats and stops profiler on exit
+        """
+        try:
+            try:
+                return self.run_loop()
+            finally:
+                try:
+                    self.processor.close()
+                finally:
+                    self.source.close()
+        finally:
+            if self.storm is not None:
+                self.emit_folded(flush=True)
+            if self.sampler is not None:
+                self.emit_aggregates(flush=True)
+            self.sink.close()
+            if self.sink.acks:
+                self.apply_acks()
+            if self.config.persistent and self.bookmarks_dirty:
+                self.commit_bookmarks()
+            self.bookmark_store.close()
+            if self.stats:
+                self.report_stats()
+            self.report_counters()
+            self.context['publisher_metadata'].close()
+            self.stop_profiler()
+
+    def run_loop(self) -> int:
         """
         This is main loop. Any error or exception is fatal. Exits on self.is_stop set in main by
         exit signal handler.
+        All channels are subscribed to new events at start. Old events (after bookmark or lookback) are read by
+        channel queries in catch-up, one batch per channel per turn, interleaved with new events of live channels.
+        When catch-up is complete channel is subscribed again after the last event read by query, see catch_up.
         """
         self.log.info("start")
         # output startup hello
         if self.config.startup_hello:
-            self.tail_out.info(consts.STARTUP_HELLO % self.name)
-        # query old events
-        qrys = []
-        for ch_idx in range(0, len(self.config.channels)):
-            channel = self.config.channels[ch_idx]
-            qry = win32evtlog.EvtQuery(channel.name, win32evtlog.EvtQueryForwardDirection, channel.query)
-            qrys.append(qry)
-        del qry
-        # tail old events if any and subscribe
-        subs = []  # subscriptions
-        for ch_idx in range(0, len(self.config.channels)):
-            last_event_h = None
-            fetch_old_events = False
-            # try to seek to bookmark with fallback to lookback if enabled
+            self.sink.write_now(consts.STARTUP_HELLO % self.name)
+        # subscribe to new events before querying old ones, so no event falls in between
+        self.subscriptions = [self.source.subscribe(ch_idx) for ch_idx in range(0, len(self.config.channels))]
+        # query old events, try to seek to bookmark with fallback to lookback if enabled
+        for ch_idx, channel in enumerate(self.config.channels):
+            qry = self.source.query(ch_idx)
             try:
-                win32evtlog.EvtSeek(qrys[ch_idx], 0, win32evtlog.EvtSeekRelativeToBookmark | win32evtlog.EvtSeekStrict,
-                                    self.bookmarks[ch_idx])
-                fetch_old_events = True
+                self.source.seek_bookmark(qry, self.bookmarks[ch_idx])
+                start = 'bookmark'
             except Exception:
-                if self.config.lookback > 0:
-                    win32evtlog.EvtSeek(qrys[ch_idx], -(self.config.lookback - 1), win32evtlog.EvtSeekRelativeToLast)
-                    fetch_old_events = True
-                pass
-            # fetch & handle old events
-            if fetch_old_events:
-                while True:
-                    if self.is_stop:
-                        self.log.info("stop")
-                        return 0
-                    events = win32evtlog.EvtNext(qrys[ch_idx], Count=50, Timeout=100)
-                    if len(events) == 0:
-                        break
-                    for event_h in events:
-                        if self.handle_event(ch_idx, event_h):  # False means event was ignored
-                            last_event_h = event_h
-                    del events
-                if last_event_h:  # last event if any
-                    win32evtlog.EvtUpdateBookmark(self.bookmarks[ch_idx], last_event_h)
-                    self.bookmarks_update_ts = time.monotonic()
-                # subscribe after bookmark
-                channel = self.config.channels[ch_idx]
-                sub = win32evtlog.EvtSubscribe(
-                    channel.name,
-                    win32evtlog.EvtSubscribeStartAfterBookmark,
-                    Bookmark=self.bookmarks[ch_idx],
-                    SignalEvent=self.signals[ch_idx],
-                    Query=channel.query
-                )
-                subs.append(sub)
-            else:
-                # subscribe to new events
-                channel = self.config.channels[ch_idx]
-                sub = win32evtlog.EvtSubscribe(
-                    channel.name,
-                    win32evtlog.EvtSubscribeToFutureEvents,
-                    SignalEvent=self.signals[ch_idx],
-                    Query=channel.query
-                )
-                subs.append(sub)
-        del qrys
-        # commit bookmarks if persistent mode is enabled
-        if self.config.persistent:
-            utils.store_bookmarks(self.bookmarks_filename, self.bookmarks, self.config.channels)
-            self.bookmarks_commit_ts = time.monotonic()
+                if self.config.lookback <= 0:
+                    continue
+                self.source.seek_last(qry, -(self.config.lookback - 1))
+                start = 'lookback'
+            rate = channel.catchup_rate if channel.catchup_rate is not None else self.config.catchup_rate
+            self.catchups[ch_idx] = ChannelCatchUp(qry, start, rate, self.config.catchup_progress_s)
+            self.log.info(f'channel "{channel.name}": catch-up from {start}'
+                          f'{f", max {rate:g} events/s" if rate > 0 else ""}')
+        self.catchup_stats.update(self.catchups)
         # exit after old events printed?
-        if self.config.exit_after_lookback or self.is_stop:
+        if self.config.exit_after_lookback:
+            while self.catchups and not self.is_stop:
+                time.sleep(self.catch_up(go_live=False) / 1000)
+                self.check_counters_report()
+            self.processor.drain()
+            # commit bookmarks if persistent mode is enabled
+            if self.config.persistent:
+                self.commit_bookmarks()
             self.log.info("stop")
             return 0
-        # fetch & handle new events before waiting
+        # new events of live channels are read before waiting
+        now = time.monotonic()
         for ch_idx in range(0, len(self.config.channels)):
-            last_event_h = None
-            while True:
-                if self.is_stop:
-                    self.log.info("stop")
-                    return 0
-                events = win32evtlog.EvtNext(subs[ch_idx], Count=50, Timeout=100)
-                if len(events) == 0:
-                    break
-                for event_h in events:
-                    if self.handle_event(ch_idx, event_h):  # False means event was ignored
-                        last_event_h = event_h
-                del events
-            if last_event_h:  # last event if any
-                win32evtlog.EvtUpdateBookmark(self.bookmarks[ch_idx], last_event_h)
-                self.bookmarks_update_ts = time.monotonic()
-        del sub
+            if ch_idx not in self.catchups:
+                self.scheduler.push(ch_idx, now)
         # main event loop
         self.log.info("event loop running")
         while True:
-            # commit bookmarks
-            if self.config.persistent and self.bookmarks_update_ts > self.bookmarks_commit_ts and \
-                    self.bookmarks_commit_ts + self.config.bookmarks_commit_s < time.monotonic():
-                utils.store_bookmarks(self.bookmarks_filename, self.bookmarks, self.config.channels)
-                self.bookmarks_commit_ts = time.monotonic()
-            # wait for channels to be signaled
-            while True:
-                if self.is_stop:
-                    self.log.info("stop")
-                    return 0
-                signaled = win32event.WaitForMultipleObjectsEx(self.signals, False, 500, True)
-                if win32con.WAIT_OBJECT_0 <= signaled < win32con.WAIT_OBJECT_0 + win32event.MAXIMUM_WAIT_OBJECTS:
-                    ch_idx = signaled - win32con.WAIT_OBJECT_0
+            if self.is_stop:
+                self.log.info("stop")
+                return 0
+            if self.source.exhausted:
+                self.log.info("event source exhausted, stop")
+                return 0
+            # advance bookmarks to acknowledged output, commit bookmarks
+            if self.sink.acks:
+                self.apply_acks()
+            if self.config.persistent and self.bookmarks_dirty and \
+                    self.bookmarks_commit_ts + self.config.bookmarks_commit_s <= time.monotonic():
+                self.commit_bookmarks()
+            # output summaries of folded events
+            if self.storm is not None:
+                self.emit_folded()
+            # output aggregate records of ended interval
+            if self.sampler is not None:
+                self.emit_aggregates()
+            self.check_counters_report()
+            # next batch of old events, wait for channels to be signaled
+            timeout_ms = self.catch_up() if self.catchups else self.config.wait_timeout_ms
+            if self.scheduler:
+                timeout_ms = 0  # channels have new events already, just poll
+            ch_idx = self.source.wait(timeout_ms)
+            if ch_idx is None and not self.scheduler:
+                if timeout_ms > 0:
+                    with self.output_lock:
+                        self.sink.flush()  # idle, output buffered events if any
+                continue
+            # queue all signalled channels, new events of channel in catch-up are read when catch-up is complete
+            now = time.monotonic()
+            for _ in range(0, len(self.config.channels)):
+                if ch_idx is None:
                     break
-            # fetch & handle new events from signalled channel
-            last_event_h = None
-            while True:
-                events = win32evtlog.EvtNext(subs[ch_idx], Count=50, Timeout=100)
-                if len(events) == 0 or self.is_stop:
-                    break
-                for event_h in events:
-                    if self.handle_event(ch_idx, event_h):  # False means event was ignored
-                        last_event_h = event_h
+                if ch_idx not in self.catchups:
+                    self.scheduler.push(ch_idx, now)
+                ch_idx = self.source.wait(0)
+            # fetch & handle new events of channel in turn, up to its budget
+            ch_idx = self.scheduler.pop(now)
+            if ch_idx is not None and \
+                    not self.read_live(ch_idx, self.subscriptions[ch_idx], self.scheduler.budgets[ch_idx]):
+                self.scheduler.push(ch_idx, time.monotonic())  # more events, next turn
+
+    def catch_up(self, go_live: bool = True) -> int:
+        """
+        Reads next batch of old events of each channel in catch-up, subject to rate limit. Channel goes live when
+        its query is drained.
+        Args:
+            go_live: queue channel to read new events when it goes live, False - old events only
+        Returns:
+            int: max wait for new events, ms. 0 if catch-up can continue immediately
+        """
+        now = time.monotonic()
+        wait_s = self.config.wait_timeout_ms / 1000
+        for ch_idx, catchup in list(self.catchups.items()):
+            delay = catchup.delay(now)
+            if delay > 0:
+                wait_s = min(wait_s, delay)
+                continue
+            if self.is_stop:
+                break
+            channel = self.config.channels[ch_idx]
+            events = self.fetch_events(ch_idx, catchup.query, catchup.budget(self.batch_sizers[ch_idx].size))
+            if catchup.update(events, now):
+                stats = catchup.stats(now)
+                self.log.info(f'channel "{channel.name}": catch-up {stats["events"]} events, '
+                              f'{stats["events_per_s"]} events/s')
+            if events:
+                self.processor.submit(ch_idx, events)
                 del events
-            if last_event_h:  # update bookmark from last event if any
-                win32evtlog.EvtUpdateBookmark(self.bookmarks[ch_idx], last_event_h)
-                self.bookmarks_update_ts = time.monotonic()
+                wait_s = 0
+                continue
+            # caught up
+            del self.catchups[ch_idx]
+            wait_s = 0
+            stats = catchup.stats()
+            self.log.info(f'channel "{channel.name}": caught up, {stats["events"]} events in {stats["elapsed_s"]} s, '
+                          f'live')
+            # query reads events written during catch-up too, subscription backlog would repeat them: subscription
+            # is replaced by one after the last event read by query, its backlog is never read
+            if catchup.last_event_h is not None:
+                bookmark = self.source.create_bookmark()
+                self.source.update_bookmark(bookmark, catchup.last_event_h)
+                self.subscriptions[ch_idx] = self.source.subscribe(ch_idx, bookmark)
+            catchup.query = catchup.last_event_h = None
+            if go_live:
+                self.scheduler.push(ch_idx, now)
+        return int(wait_s * 1000)
 
-    def handle_event(self, ch_idx: int, event_h) -> bool:
-        xml_str = win32evtlog.EvtRender(event_h, win32evtlog.EvtRenderEventXml)
-        event_obj = lxml.etree.fromstring(xml_str)
-        self.log.debug(LazyString(lambda: etree.tostring(event_obj, pretty_print=True).decode()))
-        # apply channel transforms
-        for xform in self.channel_transforms[ch_idx]:
-            event_obj = xform(self.context, event_h, event_obj)
-            if event_obj is None:
-                return False  # skipped
-        # apply common transforms
-        for xform in self.final_transforms:
+    def read_live(self, ch_idx: int, sub, budget: int = 0) -> bool:
+        """
+        Reads and handles new events of channel till subscription is drained or budget is used
+        Args:
+            budget: max number of events to read, 0 - unlimited
+        Returns:
+            bool: True if subscription is drained
+        """
+        left = budget or sys.maxsize
+        while left > 0:
+            events = self.fetch_events(ch_idx, sub, left)
+            if len(events) == 0 or self.is_stop:
+                return True
+            left -= len(events)
+            self.processor.submit(ch_idx, events)
+            del events
+        return False
+
+    def fetch_events(self, ch_idx: int, handle, count: int = None) -> list:
+        """
+        Returns next batch of events from channel query or subscription, see BatchSizer
+        Args:
+            count: max number of events, less than batch size when rate limited. Default: batch size
+        """
+        sizer = self.batch_sizers[ch_idx]
+        if count is None or count >= sizer.size:
+            events = self.source.next(handle, sizer.size, sizer.timeout_ms)
+            sizer.update(len(events))
+        else:
+            events = self.source.next(handle, count, sizer.timeout_ms)  # limited batch does not resize
+        return events
+
+    def batch_done(self, ch_idx: int, last_event_h):
+        """
+        Called by batch processor after batch of events is emitted, with last emitted event
+        """
+        if self.sink.acks:
+            self.sink.mark(ch_idx, last_event_h)  # bookmark advances when output is acknowledged
+            return
+        self.source.update_bookmark(self.bookmarks[ch_idx], last_event_h)
+        self.bookmarks_dirty.add(ch_idx)
+
+    def apply_acks(self):
+        """
+        Advances bookmarks to events of acknowledged output, see OutputSink.acks
+        """
+        acked = self.sink.take_acked()
+        if not acked:
+            return
+        with self.output_lock:
+            for ch_idx, event_h in acked:
+                self.source.update_bookmark(self.bookmarks[ch_idx], event_h)
+                self.bookmarks_dirty.add(ch_idx)
+
+    def end_batch(self):
+        self.sink.end_batch()
+
+    def commit_bookmarks(self):
+        """
+        Store changed bookmarks and new message templates if any. Buffered output is flushed first, so bookmarks never
+        get ahead of output
+        """
+        if self.sink.acks:
+            self.apply_acks()
+        with self.output_lock:
+            self.sink.flush()
+            dirty, self.bookmarks_dirty = self.bookmarks_dirty, set()
+            entries = {utils.bookmark_key(self.config.channels[ch_idx]):
+                       utils.render_bookmark(self.source, self.bookmarks[ch_idx]) for ch_idx in dirty}
+        self.bookmark_store.commit(entries)  # changed bookmarks only
+        self.bookmarks_commit_ts = time.monotonic()
+        templates = self.context['message_templates']
+        if templates.dirty:
+            try:
+                templates.store(self.templates_filename)
+            except Exception as ex:
+                self.log.warning(f'Failed to store message templates "{self.templates_filename}": {ex}')
+
+    def emit_folded(self, flush: bool = False):
+        """
+        Outputs summaries of folded events of ended storm windows, all windows if flush is set
+        """
+        summaries = self.storm.sweep(time.monotonic(), flush)
+        if not summaries:
+            return
+        with self.output_lock:
+            for event_h, summary in summaries:
+                tail = self.fold_tails['values' if isinstance(summary, dict) else 'xml']
+                event_obj = tail(self.context, event_h, summary)
+                if event_obj is not None:
+                    self.sink.write(event_obj)
+            self.sink.end_batch()
+
+    def emit_aggregates(self, flush: bool = False):
+        """
+        Outputs aggregate records of sampled channels when interval ends, current interval if flush is set
+        """
+        records = self.sampler.sweep(time.monotonic(), flush)
+        if not records:
+            return
+        with self.output_lock:
+            for record in records:
+                self.sink.write(record)
+            self.sink.end_batch()
+
+    def report_stats(self):
+        for line in self.stats.report():
+            self.log.info(line)
+        self.log.info(f'{"channel":<20} {"batch_size":>10} {"peak_size":>10} {"batches":>9} {"avg_batch":>9} '
+                      f'{"full":>9}')
+        for channel, sizer in zip(self.config.channels, self.batch_sizers):
+            stats = sizer.stats()
+            self.log.info(f'{channel.name:<20} {stats["size"]:>10} {stats["peak_size"]:>10} {stats["batches"]:>9} '
+                          f'{stats["avg_batch"]:>9} {stats["full_batches"]:>9}')
+        self.log.info(f'{"channel":<20} {"turns":>10} {"avg_delay_ms":>12} {"max_delay_ms":>12}')
+        for ch_idx, channel in enumerate(self.config.channels):
+            stats = self.scheduler.stats(ch_idx)
+            if stats['turns']:
+                self.log.info(f'{channel.name:<20} {stats["turns"]:>10} {stats["avg_delay_ms"]:>12} '
+                              f'{stats["max_delay_ms"]:>12}')
+        if self.catchup_stats:
+            self.log.info(f'{"channel":<20} {"catch-up":>10} {"events":>10} {"events/s":>9} {"elapsed_s":>9}')
+            for ch_idx, catchup in self.catchup_stats.items():
+                stats = catchup.stats()
+                self.log.info(f'{self.config.channels[ch_idx].name:<20} {stats["state"]:>10} {stats["events"]:>10} '
+                              f'{stats["events_per_s"]:>9} {stats["elapsed_s"]:>9}')
+
+    def check_counters_report(self):
+        if self.config.counters_report_s > 0 and time.monotonic() >= self.counters_report_ts:
+            self.report_counters()
+
+    def report_counters(self):
+        """
+        Reports output, queue, publisher metadata cache, message templates, storm suppression, sampling and truncation
+        counters, independently of per-stage stats
+        """
+        self.counters_report_ts = time.monotonic() + self.config.counters_report_s
+        self.log.info('output: ' + ', '.join(f'{value} {key}' for key, value in self.sink.stats().items()))
+        stats = self.context['publisher_metadata'].stats()
+        if stats['hits'] or stats['misses']:  # used by xml_render_message
+            self.log.info('publisher metadata: ' + ', '.join(f'{value} {key}' for key, value in stats.items()))
+        stats = self.context['message_templates'].stats()
+        if stats['hits'] or stats['misses']:
+            self.log.info('message templates: ' + ', '.join(f'{value} {key}' for key, value in stats.items()))
+        if self.storm is not None:
+            stats = self.storm.stats()
+            self.log.info(f'storm suppression: {stats["fingerprints"]} fingerprints, {stats["passed"]} passed, '
+                          f'{stats["folded"]} folded, {stats["summaries"]} summaries, {stats["evicted"]} evicted')
+        if self.sampler is not None:
+            stats = self.sampler.stats()
+            self.log.info(f'sampling: {stats["sampled_in"]} sampled in, {stats["sampled_out"]} sampled out, '
+                          f'{stats["aggregated"]} aggregated into {stats["records"]} records')
+        if self.truncator is not None:
+            truncated = self.truncator.stats()
+            if truncated:
+                self.log.info(f'{"truncated provider":<40} {"events":>10} {"fields":>10} {"bytes":>12}')
+                for provider, stats in sorted(truncated.items()):
+                    self.log.info(f'{provider:<40} {stats["events"]:>10} {stats["fields"]:>10} {stats["bytes"]:>12}')
+
+    def start_profiler(self, max_events: int = 0) -> bool:
+        """
+        Starts sampling profiler, output goes to TailerConfig.profile_dir
+        Args:
+            max_events: stop profiler after this number of events processed, 0 - run until stopped
+        Returns:
+            bool: False if profiler is already running
+        """
+        with self.profiler_lock:
+            if self.profiler is not None:
+                return False
+            file_name = f'{self.config.profile_dir}/{consts.TAILER_TYPE}_{self.name}_' \
+                        f'{time.strftime("%Y%m%d_%H%M%S")}.folded'
+            self.profiler = metrics.SamplingProfiler(file_name, self.config.profile_interval_ms)
+            self.profiler.start()
+            if max_events > 0:
+                self.profile_events_left = max_events
+                self.process_event = self.process_event_profiled
+            self.log.info(f'profiler started, max events: {max_events or "unlimited"}')
+            return True
+
+    def stop_profiler(self) -> bool:
+        """
+        Stops sampling profiler and logs top functions
+        Returns:
+            bool: False if profiler is not running
+        """
+        with self.profiler_lock:
+            if self.profiler is None:
+                return False
+            self.process_event = self.event_processor
+            profiler, self.profiler = self.profiler, None
+            try:
+                samples = profiler.stop()
+            except OSError as ex:
+                self.log.error(f'Failed to store profile "{profiler.file_name}": {ex}')
+                return True
+            self.log.info(f'profiler stopped, {samples} samples stored to "{profiler.file_name}", top functions:')
+            for func, count in profiler.top():
+                self.log.info(f'{count * 100 / max(samples, 1):6.1f}% {func}')
+            return True
+
+    def toggle_profiler(self):
+        self.stop_profiler() or self.start_profiler()
+
+    def process_event_profiled(self, ch_idx: int, event_h):
+        event_obj = self.event_processor(ch_idx, event_h)
+        with self.profiler_lock:  # workers
+            self.profile_events_left -= 1
+            is_last = self.profile_events_left == 0
+        if is_last:
+            self.stop_profiler()
+        return event_obj
+
+    def process_event_timed(self, ch_idx: int, event_h):
+        # same as process_event, with per-stage timers. Timers are not locked, with workers counts are approximate
+        render_timer, stage_timers, _ = self.stage_timers[ch_idx]
+        add = metrics.StageStats.add
+        clock = time.perf_counter_ns
+        t0 = clock()
+        if self.render_values[ch_idx]:
+            event_obj = self.source.render_values(ch_idx, event_h)
+        else:
+            event_obj = self.source.render_xml(event_h)
+        add(render_timer, clock() - t0)
+        if self.log.isEnabledFor(logging.DEBUG):
+            self.log.debug(event_obj)
+        for xform, timer in stage_timers:
+            t0 = clock()
             event_obj = xform(self.context, event_h, event_obj)
+            add(timer, clock() - t0)
             if event_obj is None:
-                return False  # skipped
-        # print to tail_out logger configured in logging config
-        self.tail_out.info(event_obj)
+                timer[1] += 1  # dropped
+                break
+        return event_obj
+
+    def emit_timed(self, ch_idx: int, event_h, event_obj):
+        # same as emit, with tail_out timer. Stats are reported from here: single writer
+        t0 = time.perf_counter_ns()
+        self.sink.write(event_obj)
+        t1 = time.perf_counter_ns()
+        metrics.StageStats.add(self.stage_timers[ch_idx][2], t1 - t0)
+        if t1 > self.stats.next_report_ns:
+            self.report_stats()
+
+    def process_event(self, ch_idx: int, event_h):
+        """
+        Renders event and applies transforms. Called by workers concurrently when TailerConfig.workers is set.
+        Returns:
+            object: output object, None if event is dropped by transform
+        """
+        if self.render_values[ch_idx]:
+            # output record from rendered values, no XML
+            event_obj = self.source.render_values(ch_idx, event_h)
+        else:
+            # XML string, parsed by pipeline before the first transform that needs tree, see pipeline.NEEDS
+            event_obj = self.source.render_xml(event_h)
+            if self.log.isEnabledFor(logging.DEBUG):
+                self.log.debug(event_obj)
+        # apply channel and common transforms
+        return self.pipelines[ch_idx](self.context, event_h, event_obj)
+
+    def emit(self, ch_idx: int, event_h, event_obj):
+        # output, see TailerConfig.output
+        self.sink.write(event_obj)
+
+    def handle_event(self, ch_idx: int, event_h) -> bool:
+        """
+        Processes and emits single event
+        Returns:
+            bool: False if event was dropped
+        """
+        event_obj = self.process_event(ch_idx, event_h)
+        if event_obj is None:
+            return False  # skipped
+        self.emit(ch_idx, event_h, event_obj)
         return True
@@ -1,16 +1,70 @@
+import re
+import html
+import json
 import lxml
 from lxml import etree
-import win32evtlog
 import winevt_tailer.consts as const
+import winevt_tailer.render as render
+from winevt_tailer.metadata import PublisherMetadataCache, MessageTemplateCatalog
+from winevt_tailer.storm import g_time_created_xpath
 
-g_xml_to_json_xform = lxml.etree.XSLT(lxml.etree.fromstring(const.XSLT_XML_TO_JSON))
+g_xml_to_json_xform = None  # XSLT_XML_TO_JSON, compiled on first use by xml_to_json_xslt, not at startup
 
 g_event_ns = {'event': 'http://schemas.microsoft.com/win/2004/08/events/event'}
 
+# XPath expressions used by transforms, compiled once
+g_binary_xpath = etree.XPath("//event:Binary", namespaces=g_event_ns)
+g_provider_name_xpath = etree.XPath("//event:Provider/@Name", namespaces=g_event_ns)
+g_message_xpath = etree.XPath("/event:Event/Message", namespaces=g_event_ns)
+g_eventdata_xpath = etree.XPath("//event:EventData", namespaces=g_event_ns)
+g_system_tag = '{%s}System' % g_event_ns['event']
+
+# System elements in rendered XML string, System precedes EventData/UserData so the first match is in System
+g_xml_channel_re = re.compile(r'<Channel>([^<]*)</Channel>')
+g_xml_level_re = re.compile(r'<Level>([^<]*)</Level>')
+g_xml_record_id_re = re.compile(r'<EventRecordID>([^<]*)</EventRecordID>')
+g_xml_event_id_re = re.compile(r'<EventID(?:\s[^>]*)?>([^<]*)</EventID>')
+g_xml_provider_name_re = re.compile(r'<Provider\s[^>]*?Name=(?:\'([^\']*)\'|"([^"]*)")')
+g_xml_time_created_re = re.compile(r'<TimeCreated\s[^>]*?SystemTime=(?:\'([^\']*)\'|"([^"]*)")')
+
+# JSON string escaping: all control chars are escaped. XSLT_XML_TO_JSON drops '\r' instead, same is done by
+# xml_to_json when TailerConfig.json_drop_cr is set (context['json_drop_cr']), output is byte-compatible with
+# xml_to_json_xslt then
+g_json_escape_re = re.compile(r'[\x00-\x1f"\\]')
+g_json_escape_map = {chr(i): '\\u%04x' % i for i in range(0x20)}
+g_json_escape_map.update({'\\': '\\\\', '"': '\\"', '\r': '\\r', '\n': '\\n', '\t': '\\t', '\b': '\\b',
+                          '\f': '\\f'})
+g_json_escape_map_drop_cr = dict(g_json_escape_map, **{'\r': ''})
+
+g_xml_ns = 'http://www.w3.org/XML/1998/namespace'
+
 
 def xml_to_json(context: dict, event_h, event_obj: object) -> object:
     """
-        Converts etree event object to single line JSON string
+        Converts etree event object to single line JSON string.
+        Native single pass serializer, output is byte-identical to xml_to_json_xslt except for control chars
+        which are escaped properly: XSLT drops carriage returns, they are dropped here too if context['json_drop_cr']
+        is set (TailerConfig.json_drop_cr).
+    Args:
+        context(dict): context persist over runtime, can be re-used to store key-values pairs
+        event_h(PyHANDLE): event handle returned from win32evtlog API
+        event_obj(object): event object, lxml tree object
+    Returns:
+        object:  event as single line JSON string
+    """
+    if len(event_obj) == 0 and event_obj.text is None:
+        return ''  # nothing to output, same as XSLT
+    out = ['{']
+    esc = _json_escape_drop_cr if context.get('json_drop_cr') else _json_escape
+    _json_element(event_obj, _xml_name(event_obj), '', '', False, out, esc)
+    out.append('}')
+    return ''.join(out)
+
+
+def xml_to_json_xslt(context: dict, event_h, event_obj: object) -> object:
+    """
+        Converts etree event object to single line JSON string using XSLT_XML_TO_JSON stylesheet.
+        Compatibility option, xml_to_json is faster.
     Args:
         context(dict): context persist over runtime, can be re-used to store key-values pairs
         event_h(PyHANDLE): event handle returned from win32evtlog API
@@ -18,11 +72,105 @@ def xml_to_json(context: dict, event_h, event_obj: object) -> object:
     Returns:
         object:  event as single line JSON string
     """
+    global g_xml_to_json_xform
+    if g_xml_to_json_xform is None:  # compiled twice at worst when workers race, result is the same
+        g_xml_to_json_xform = lxml.etree.XSLT(lxml.etree.fromstring(const.XSLT_XML_TO_JSON))
     tree_obj = g_xml_to_json_xform(event_obj)
     event_json = str(tree_obj)
     return event_json
 
 
+def _json_escape(s: str) -> str:
+    if g_json_escape_re.search(s) is None:
+        return s
+    return g_json_escape_re.sub(lambda m: g_json_escape_map[m.group()], s)
+
+
+def _json_escape_drop_cr(s: str) -> str:
+    if g_json_escape_re.search(s) is None:
+        return s
+    return g_json_escape_re.sub(lambda m: g_json_escape_map_drop_cr[m.group()], s)
+
+
+def _xml_name(node) -> str:
+    # element qualified name as returned by XPath name(): prefix:local
+    tag = node.tag
+    if tag[0] != '{':
+        return tag
+    local = tag[tag.index('}') + 1:]
+    return f'{node.prefix}:{local}' if node.prefix else local
+
+
+def _xml_attr_name(node, key: str) -> str:
+    # attribute qualified name as returned by XPath name(): prefix:local
+    if key[0] != '{':
+        return key
+    ns, _, local = key[1:].partition('}')
+    if ns == g_xml_ns:
+        prefix = 'xml'
+    else:
+        prefix = next((k for k, v in node.nsmap.items() if v == ns and k), None)
+    return f'{prefix}:{local}' if prefix else local
+
+
+def _xml_text(node) -> str:
+    # concatenated text nodes of element that has no child elements, None if there are no text nodes
+    if len(node) == 0:
+        return node.text
+    parts = [child.tail for child in node if child.tail is not None]
+    if node.text is not None:
+        parts.insert(0, node.text)
+    return ''.join(parts) if parts else None
+
+
+def _json_element(node, name: str, prev_name: str, next_name: str, has_following: bool, out: list, esc):
+    # mirrors XSLT_XML_TO_JSON "detect" template: sibling elements with the same name are grouped into array
+    if prev_name == name:
+        _json_object(node, name, out, esc)
+        if next_name != name:
+            out.append('],' if has_following else ']')
+        else:
+            out.append(',')
+    elif next_name == name:
+        out.append(f'"{name}" : [')
+        _json_object(node, name, out, esc)
+        out.append(', ')
+    elif len(node.attrib) or next(node.iterchildren(etree.Element), None) is not None:
+        out.append(f'"{name}" : ')
+        _json_object(node, name, out, esc)
+        if has_following:
+            out.append(',')
+    else:
+        text = _xml_text(node)
+        out.append(f'"{name}" : "{esc(text) if text else ""}",' if has_following else
+                   f'"{name}" : "{esc(text) if text else ""}"')
+
+
+def _json_object(node, name: str, out: list, esc):
+    # mirrors XSLT_XML_TO_JSON "obj-content" template
+    out.append('{')
+    attrib = node.attrib
+    if len(attrib):
+        out.append(','.join(f'"{esc(_xml_attr_name(node, k))}" : "{esc(v)}"' for k, v in attrib.items()))
+    children = list(node.iterchildren(etree.Element))
+    if children:
+        if len(attrib):
+            out.append(',')
+        names = [_xml_name(child) for child in children]
+        last = len(children) - 1
+        for i, child in enumerate(children):
+            _json_element(child, names[i], names[i - 1] if i > 0 else '', names[i + 1] if i < last else '', i < last,
+                          out, esc)
+    else:
+        text = _xml_text(node)
+        if text is not None:
+            if len(attrib):
+                out.append(f',"text" : "{esc(text)}"')
+            else:
+                out.append(f'"{name}" : "{esc(text)}"')
+    out.append('}')
+
+
 def xml_remove_binary(context: dict, event_h, event_obj: object) -> object:
     """
         Removes Event/EventData/Binary tag from event_obj
@@ -33,7 +181,7 @@ def xml_remove_binary(context: dict, event_h, event_obj: object) -> object:
     Returns:
         object:  modified event_obj or None - to skip/drop event
     """
-    for tag in event_obj.xpath("//event:Binary", namespaces=g_event_ns):
+    for tag in g_binary_xpath(event_obj):
         tag.getparent().remove(tag)
     return event_obj
 
@@ -41,6 +189,8 @@ def xml_remove_binary(context: dict, event_h, event_obj: object) -> object:
 def xml_render_message(context: dict, event_h, event_obj: object) -> object:
     """
         Adds new "Message" xml tag with rendered log event message text.
+        Publisher metadata handles are cached in context['publisher_metadata'], message templates - in
+        context['message_templates']. EvtFormatMessage is used for templates that cannot be filled in locally.
     Args:
         context(dict): context persist over runtime, can be re-used to store key-values pairs
         event_h(PyHANDLE): event handle returned from win32evtlog API
@@ -48,23 +198,61 @@ def xml_render_message(context: dict, event_h, event_obj: object) -> object:
     Returns:
         object:  modified event_obj or None - to skip/drop event
     """
+    provider_name = g_provider_name_xpath(event_obj)
+    if not provider_name:
+        return event_obj
+    metadata_cache, templates = _message_caches(context)
+    message = _format_message(templates, provider_name[0], event_obj)
+    if message is None:
+        message = _evt_format_message(metadata_cache, provider_name[0], event_h)
+    if message is not None:
+        sub = lxml.etree.SubElement(event_obj, 'Message')
+        sub.text = message
+    return event_obj
+
+
+def _message_caches(context: dict) -> (PublisherMetadataCache, MessageTemplateCatalog):
+    metadata_cache = context.get('publisher_metadata')
+    if metadata_cache is None:
+        metadata_cache = context['publisher_metadata'] = PublisherMetadataCache()
+    templates = context.get('message_templates')
+    if templates is None:
+        templates = context['message_templates'] = MessageTemplateCatalog(metadata_cache,
+                                                                          evtlog=metadata_cache.evtlog)
+    return metadata_cache, templates
+
+
+def _evt_format_message(metadata_cache: PublisherMetadataCache, provider_name: str, event_h):
+    # message rendered by Windows, None if provider has no metadata or message
+    metadata = metadata_cache.acquire(provider_name)
+    if metadata is None:
+        return None
+    evtlog = metadata_cache.evtlog
     try:
-        provider_name = event_obj.xpath("//event:Provider/@Name", namespaces=g_event_ns)
-        metadata = win32evtlog.EvtOpenPublisherMetadata(provider_name[0])
+        return evtlog.EvtFormatMessage(metadata, event_h, evtlog.EvtFormatMessageEvent)
     except Exception:
-        # pywintypes.error: (2, 'EvtOpenPublisherMetadata', 'The system cannot find the file specified.')
-        pass
-    else:
-        try:
-            message: str = win32evtlog.EvtFormatMessage(metadata, event_h, win32evtlog.EvtFormatMessageEvent)
-        except Exception:
-            # pywintypes.error: (15027, 'EvtFormatMessage: allocated 0, need buffer of size 0', 'The message resource
-            # is present but the message was not found in the message table.')
-            pass
-        else:
-            sub = lxml.etree.SubElement(event_obj, 'Message')
-            sub.text = message
-    return event_obj
+        # pywintypes.error: (15027, 'EvtFormatMessage: allocated 0, need buffer of size 0', 'The message
+        # resource is present but the message was not found in the message table.')
+        return None
+    finally:
+        metadata_cache.release(metadata)
+
+
+def _format_message(templates: MessageTemplateCatalog, provider_name: str, event_obj: object):
+    # message from cached template and EventData/Data values, None if not possible
+    system = event_obj.find('event:System', g_event_ns)
+    event_id = system.find('event:EventID', g_event_ns) if system is not None else None
+    if event_id is None:
+        return None
+    try:
+        qualifiers = int(event_id.get('Qualifiers', 0))
+        version = int(system.findtext('event:Version', 0, g_event_ns))
+        event_id = int(event_id.text)
+    except ValueError:
+        return None
+    event_data = event_obj.find('event:EventData', g_event_ns)
+    values = [data.text for data in event_data.iterfind('event:Data', g_event_ns)] if event_data is not None else []
+    return templates.format(provider_name, event_id, version, qualifiers, values)
 
 
 def xml_remove_eventdata(context: dict, event_h, event_obj: object) -> object:
@@ -77,8 +265,266 @@ def xml_remove_eventdata(context: dict, event_h, event_obj: object) -> object:
     Returns:
         object:  modified event_obj or None - to skip/drop event
     """
-    message = event_obj.xpath("/event:Event/Message", namespaces=g_event_ns)
+    message = g_message_xpath(event_obj)
     if message:
-        for tag in event_obj.xpath("//event:EventData", namespaces=g_event_ns):
+        for tag in g_eventdata_xpath(event_obj):
             tag.getparent().remove(tag)
     return event_obj
+
+
+def xml_fold_storms(context: dict, event_h, event_obj: object) -> object:
+    """
+        Event storm suppression: passes the first StormConfig.forward events of the same fingerprint per window,
+        folds the rest into one summary event output when window ends, see storm.py. Suppressor is in
+        context['storm'], put it before xml_render_message so folded events are not rendered.
+    Args:
+        context(dict): context persist over runtime, can be re-used to store key-values pairs
+        event_h(PyHANDLE): event handle returned from win32evtlog API
+        event_obj(object): event object, lxml tree object
+    Returns:
+        object:  event_obj or None - event is folded
+    """
+    storm = context['storm']
+    if storm.fold(storm.xml_fingerprint(event_obj), event_h, event_obj, g_time_created_xpath(event_obj)):
+        return event_obj
+    return None
+
+
+def xml_sample_events(context: dict, event_h, event_obj: object) -> object:
+    """
+        Low-severity events reduction per channel and Level, see ChannelConfig.sampling and sampling.py: events are
+        sampled by EventRecordID hash or counted into aggregate records, critical and error events always pass.
+        Sampler is in context['sampler']. Needs XML string, not tree: System values are matched in string, so dropped
+        events are never parsed. Put it first, before transforms that need tree.
+    Args:
+        context(dict): context persist over runtime, can be re-used to store key-values pairs
+        event_h(PyHANDLE): event handle returned from win32evtlog API
+        event_obj(str): rendered event XML string
+    Returns:
+        object:  event_obj or None - event is dropped or aggregated
+    """
+    sampler = context['sampler']
+    channel = _xml_system_value(g_xml_channel_re, event_obj)
+    level = _xml_system_value(g_xml_level_re, event_obj)
+    rule = sampler.rule(channel, level)
+    if rule is None:
+        return event_obj
+    if rule.aggregate:
+        sampler.aggregate(channel, _xml_system_value(g_xml_provider_name_re, event_obj),
+                          _xml_system_value(g_xml_event_id_re, event_obj), level,
+                          _xml_system_value(g_xml_time_created_re, event_obj))
+        return None
+    if sampler.sample(rule, int(_xml_system_value(g_xml_record_id_re, event_obj))):
+        return event_obj
+    return None
+
+
+def _xml_system_value(regex, xml_str: str) -> str:
+    # text or attribute value of System element in XML string, '' if it is missing
+    m = regex.search(xml_str)
+    if m is None:
+        return ''
+    value = m.group(m.lastindex) if m.lastindex else ''
+    return html.unescape(value) if '&' in value else value
+
+
+def xml_truncate_fields(context: dict, event_h, event_obj: object) -> object:
+    """
+        Truncates oversized fields, see TailerConfig.truncate and truncation.py: text of EventData/UserData values,
+        Binary and Message is cut to per-field and per-event limits, marker is appended, OriginalLength and
+        TruncatedHash attributes are added. Put it after xml_render_message, before xml_to_json. Truncator is in
+        context['truncator'].
+    Args:
+        context(dict): context persist over runtime, can be re-used to store key-values pairs
+        event_h(PyHANDLE): event handle returned from win32evtlog API
+        event_obj(object): event object, lxml tree object
+    Returns:
+        object:  event_obj, modified if fields are truncated
+    """
+    truncator = context['truncator']
+    nodes = [node for child in event_obj if child.tag != g_system_tag
+             for node in child.iter(etree.Element) if node.text and len(node) == 0]
+    limits = truncator.limits([node.text for node in nodes])
+    if not limits:
+        return event_obj
+    removed = 0
+    for i, size, limit in limits:
+        node = nodes[i]
+        node.text, digest, node_removed = truncator.truncate(node.text, limit)
+        node.set('OriginalLength', str(size))
+        if digest:
+            node.set('TruncatedHash', digest)
+        removed += node_removed
+    provider_name = g_provider_name_xpath(event_obj)
+    truncator.count(provider_name[0] if provider_name else '', len(limits), removed)
+    return event_obj
+
+
+def xml_drop_regex(context: dict, event_h, event_obj: str) -> object:
+    """
+        Drops events which rendered XML matches any of TailerConfig.drop_regex patterns. Needs XML string, not tree:
+        put it before transforms that need tree, so dropped events are never parsed. Regex is in context['drop_regex'].
+    Args:
+        context(dict): context persist over runtime, can be re-used to store key-values pairs
+        event_h(PyHANDLE): event handle returned from win32evtlog API
+        event_obj(str): rendered event XML string
+    Returns:
+        object:  event_obj or None - event is dropped
+    """
+    regex = context['drop_regex']
+    if regex is not None and regex.search(event_obj):
+        return None
+    return event_obj
+
+
+def xml_project_json(context: dict, event_h, event_obj: object) -> object:
+    """
+        Converts event to single line JSON of configured fields only, see TailerConfig.projection and projection.py.
+        Replaces xml_to_json when a dozen of fields is enough: only their XPath expressions are evaluated, event tree is
+        not serialized. Projection is in context['projection'].
+    Args:
+        context(dict): context persist over runtime, can be re-used to store key-values pairs
+        event_h(PyHANDLE): event handle returned from win32evtlog API
+        event_obj(object): event object, lxml tree object
+    Returns:
+        object:  event projection as single line JSON string
+    """
+    return context['projection'].project(event_obj)
+
+
+# "values" render mode transforms, see ChannelConfig.render. Event is output record (dict) built by
+# render.build_record(), not XML tree. XML transform declares its equivalent in "values_xform" attribute,
+# None means transform has nothing to do in "values" mode. Channel with transforms without "values_xform" is
+# rendered as XML.
+
+def values_render_message(context: dict, event_h, record: dict) -> object:
+    """
+        Same as xml_render_message, adds "Message" key to record
+    Args:
+        context(dict): context persist over runtime, can be re-used to store key-values pairs
+        event_h(PyHANDLE): event handle returned from win32evtlog API
+        record(dict): output record
+    Returns:
+        object:  modified record or None - to skip/drop event
+    """
+    event = record['Event']
+    system = event['System']
+    provider_name = system.get('Provider', {}).get('Name')
+    if not provider_name:
+        return record
+    metadata_cache, templates = _message_caches(context)
+    event_id = system['EventID']
+    try:
+        if isinstance(event_id, dict):
+            qualifiers = int(event_id['Qualifiers'])
+            event_id = int(event_id['text'])
+        else:
+            qualifiers = 0
+            event_id = int(event_id)
+        version = int(system.get('Version', 0))
+        message = templates.format(provider_name, event_id, version, qualifiers, render.record_values(record))
+    except (ValueError, TypeError):
+        message = None
+    if message is None:
+        message = _evt_format_message(metadata_cache, provider_name, event_h)
+    if message is not None:
+        event['Message'] = message
+    return record
+
+
+def values_remove_eventdata(context: dict, event_h, record: dict) -> object:
+    """
+        Same as xml_remove_eventdata, removes EventData from record only when Message exists
+    """
+    event = record['Event']
+    if 'Message' in event:
+        event.pop('EventData', None)
+    return record
+
+
+def values_to_json(context: dict, event_h, record: dict) -> object:
+    """
+        Converts record to single line JSON string with compact separators. Output is not byte-compatible with
+        xml_to_json, record schema differs as well, see render.build_record
+    """
+    return json.dumps(record, ensure_ascii=False, separators=(',', ':'))
+
+
+def values_fold_storms(context: dict, event_h, record: dict) -> object:
+    """
+        Same as xml_fold_storms, summary record has "Folded" key
+    """
+    storm = context['storm']
+    time_created = record['Event']['System'].get('TimeCreated', {}).get('SystemTime')
+    if storm.fold(storm.record_fingerprint(record), event_h, record, time_created):
+        return record
+    return None
+
+
+def values_truncate_fields(context: dict, event_h, record: dict) -> object:
+    """
+        Same as xml_truncate_fields, truncated value is replaced by object with OriginalLength, TruncatedHash and text
+        keys, same as xml_to_json outputs element with attributes
+    """
+    truncator = context['truncator']
+    event = record['Event']
+    fields = []  # (container, key) of string values
+    for key in ('EventData', 'UserData'):
+        for name, value in (event.get(key) or {}).items():
+            if isinstance(value, str):
+                fields.append((event[key], name))
+            elif isinstance(value, list):
+                fields += [(value, i) for i, item in enumerate(value) if isinstance(item, str)]
+    if isinstance(event.get('Message'), str):
+        fields.append((event, 'Message'))
+    limits = truncator.limits([container[key] for container, key in fields])
+    if not limits:
+        return record
+    removed = 0
+    for i, size, limit in limits:
+        container, key = fields[i]
+        text, digest, field_removed = truncator.truncate(container[key], limit)
+        value = {'OriginalLength': str(size)}
+        if digest:
+            value['TruncatedHash'] = digest
+        value['text'] = text
+        container[key] = value
+        removed += field_removed
+    truncator.count(event['System'].get('Provider', {}).get('Name', ''), len(limits), removed)
+    return record
+
+
+def values_sample_events(context: dict, event_h, record: dict) -> object:
+    """
+        Same as xml_sample_events
+    """
+    sampler = context['sampler']
+    system = record['Event']['System']
+    channel = system['Channel'] or ''
+    level = str(system.get('Level', ''))
+    rule = sampler.rule(channel, level)
+    if rule is None:
+        return record
+    if rule.aggregate:
+        event_id = system['EventID']
+        if isinstance(event_id, dict):
+            event_id = event_id['text']
+        sampler.aggregate(channel, system.get('Provider', {}).get('Name', ''), str(event_id), level,
+                          system.get('TimeCreated', {}).get('SystemTime'))
+        return None
+    if sampler.sample(rule, int(system['EventRecordID'])):
+        return record
+    return None
+
+
+xml_remove_binary.values_xform = None  # Binary is not rendered in "values" mode
+xml_render_message.values_xform = values_render_message
+xml_remove_eventdata.values_xform = values_remove_eventdata
+xml_to_json.values_xform = values_to_json
+xml_to_json_xslt.values_xform = values_to_json
+xml_fold_storms.values_xform = values_fold_storms
+xml_sample_events.values_xform = values_sample_events
+xml_truncate_fields.values_xform = values_truncate_fields
+
+xml_drop_regex.needs = 'xml'  # see pipeline.NEEDS
+xml_sample_events.needs = 'xml'
@@ -0,0 +1,92 @@
+import hashlib
+import threading
+
+# Oversized events, see transforms.xml_truncate_fields. Text of event fields (EventData/UserData values, Binary,
+# Message) is truncated to TruncateConfig.field_bytes, then the largest fields are truncated further until all fields
+# fit TruncateConfig.event_bytes. Truncated text ends with marker, original length in bytes (UTF-8) and optional hash
+# of removed remainder are added as attributes (keys in "values" render mode): OriginalLength, TruncatedHash.
+
+HASHES = ('md5', 'sha1', 'sha256')
+
+
+class Truncator:
+    """
+    Size limits and truncation counters per provider. Used by workers concurrently.
+    """
+
+    def __init__(self, config):
+        """
+        Args:
+            config: opts.TruncateConfig
+        """
+        self.field_bytes = config.field_bytes
+        self.event_bytes = config.event_bytes
+        self.marker = config.marker
+        self.marker_bytes = len(config.marker.encode('utf-8'))
+        self.hash = config.hash
+        self.counts = {}  # provider -> [events, fields, bytes removed]
+        self.lock = threading.Lock()
+
+    def limits(self, texts: list) -> list:
+        """
+        Returns (index, size, limit) of texts to truncate, limits are in bytes including marker
+        """
+        sizes = [len(text) if text.isascii() else len(text.encode('utf-8')) for text in texts]
+        caps = [self.field_bytes] if self.field_bytes else []
+        if self.event_bytes:
+            fitted = [min(size, self.field_bytes) for size in sizes] if self.field_bytes else sizes
+            if sum(fitted) > self.event_bytes:
+                caps.append(water_level(fitted, self.event_bytes))
+        if not caps:
+            return []
+        cap = min(caps)
+        return [(i, size, cap) for i, size in enumerate(sizes) if size > cap]
+
+    def truncate(self, text: str, limit: int) -> (str, str, int):
+        """
+        Returns (truncated text with marker, hash of removed remainder or None, removed bytes)
+        """
+        keep = max(0, limit - self.marker_bytes)
+        if text.isascii():
+            head, rest = text[:keep], text[keep:]
+            removed = len(rest)
+            rest = rest.encode('ascii') if self.hash else None
+        else:
+            data = text.encode('utf-8')
+            head = data[:keep].decode('utf-8', 'ignore')  # partial char at cut is dropped
+            rest = data[len(head.encode('utf-8')):]
+            removed = len(rest)
+        digest = hashlib.new(self.hash, rest).hexdigest() if self.hash else None
+        return head + self.marker, digest, removed
+
+    def count(self, provider: str, fields: int, removed: int):
+        with self.lock:
+            counts = self.counts.get(provider)
+            if counts is None:
+                self.counts[provider] = [1, fields, removed]
+            else:
+                counts[0] += 1
+                counts[1] += fields
+                counts[2] += removed
+
+    def stats(self) -> dict:
+        """
+        Returns {provider: {'events', 'fields', 'bytes'}}
+        """
+        with self.lock:
+            return {provider: {'events': events, 'fields': fields, 'bytes': removed}
+                    for provider, (events, fields, removed) in self.counts.items()}
+
+
+def water_level(sizes: list, budget: int) -> int:
+    """
+    Returns the largest cap that fits sizes capped by it into budget: sum(min(size, cap)) <= budget
+    """
+    remaining = budget
+    sizes = sorted(sizes)
+    for i, size in enumerate(sizes):
+        share = remaining // (len(sizes) - i)
+        if size > share:
+            return share
+        remaining -= size
+    return sizes[-1] if sizes else budget
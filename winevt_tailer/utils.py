@@ -2,21 +2,18 @@ import json
 import os
 import sys
 import uuid
-import lxml
-from lxml import etree
-import yaml
 import signal
-import psutil
+import threading
 import ctypes
 import logging.handlers
-import win32evtlog
-import win32event
-import win32file
-import win32api
-import win32process
 import winevt_tailer.errors as errors
 import winevt_tailer.consts as consts
-from win32comext.shell import shell
+
+# pywin32 modules are imported by functions that use them, so modules that do not touch Windows APIs directly
+# (e.g. tailer with replay event source) work without pywin32. lxml, yaml and psutil are imported the same way to keep
+# startup of CLI modes that do not need them fast (see scripts/bench_startup.py)
+
+AGENT_PROCESS_NAMES = ('logdna-agent.exe', 'logdna-agent-svc.exe', 'mezmo-agent.exe', 'mezmo-agent-svc.exe')
 
 
 def dummy_signal_handler(_: int):
@@ -24,12 +21,54 @@ def dummy_signal_handler(_: int):
 
 
 def setup_exit_signal_handler(signal_handler: type(dummy_signal_handler)):
+    import win32api
     signal.signal(signal.SIGINT, lambda signum, _: signal_handler(signum))
     signal.signal(signal.SIGBREAK, lambda signum, _: signal_handler(signum))
     win32api.SetConsoleCtrlHandler(signal_handler, True)  # to catch windows shutdown
 
 
+def get_profiler_event_name(tailer_name: str) -> str:
+    return f'Global\\{consts.TAILER_TYPE}_{tailer_name}_profiler'
+
+
+def setup_profiler_signal_handler(tailer_name: str, signal_handler: type(dummy_signal_handler)):
+    """
+    Windows has no user signals, named event is used instead: signal_handler is called from daemon thread each time
+    the event is set by signal_profiler().
+    """
+    import win32event
+    import pywintypes
+    try:
+        event_h = win32event.CreateEvent(None, 0, 0, get_profiler_event_name(tailer_name))
+    except pywintypes.error:
+        # Global namespace needs SeCreateGlobalPrivilege, use session namespace
+        event_h = win32event.CreateEvent(None, 0, 0, get_profiler_event_name(tailer_name).split('\\', 1)[1])
+
+    def wait_loop():
+        while True:
+            win32event.WaitForSingleObject(event_h, win32event.INFINITE)
+            signal_handler(0)
+
+    threading.Thread(target=wait_loop, name='profiler_signal', daemon=True).start()
+
+
+def signal_profiler(tailer_name: str):
+    """
+    Toggles sampling profiler in running tailer, see setup_profiler_signal_handler()
+    """
+    import win32event
+    import pywintypes
+    try:
+        event_h = win32event.OpenEvent(win32event.EVENT_MODIFY_STATE, False, get_profiler_event_name(tailer_name))
+    except pywintypes.error:
+        event_h = win32event.OpenEvent(win32event.EVENT_MODIFY_STATE, False,
+                                       get_profiler_event_name(tailer_name).split('\\', 1)[1])
+    win32event.SetEvent(event_h)
+    event_h.Close()
+
+
 def is_valid_xpath(s) -> bool:
+    import lxml.etree
     valid = True
     try:
         lxml.etree.XPath(s)
@@ -38,6 +77,22 @@ def is_valid_xpath(s) -> bool:
     return valid
 
 
+def is_valid_query(s) -> bool:
+    """
+    Returns True if s is valid XPath expression or structured XML query (QueryList) with valid XPath in Select and
+    Suppress elements
+    """
+    if not s.lstrip().startswith('<'):
+        return is_valid_xpath(s)
+    import lxml.etree
+    try:
+        query_list = lxml.etree.fromstring(s.strip())
+    except lxml.etree.XMLSyntaxError:
+        return False
+    paths = [elem.text or '' for elem in query_list.iter('Select', 'Suppress')]
+    return query_list.tag == 'QueryList' and bool(paths) and all(is_valid_xpath(path) for path in paths)
+
+
 def get_event_channels() -> [str]:
     """
     Returns list of available channel names:
@@ -47,6 +102,8 @@ def get_event_channels() -> [str]:
     Returns:
         [str]: list of channel names
     """
+    import win32event
+    import win32evtlog
     h = win32event.CreateEvent(None, 0, 0, None)
     ch = win32evtlog.EvtOpenChannelEnum()
     names = []
@@ -65,6 +122,11 @@ def get_event_channels() -> [str]:
 
 
 def replace_file(src_file_name: str, dest_file_name: str):
+    try:
+        import win32file
+    except ImportError:  # not Windows, rename is atomic
+        os.replace(src_file_name, dest_file_name)
+        return
     if not os.path.isfile(dest_file_name):
         open(dest_file_name, 'a').close()
     win32file.ReplaceFile(src_file_name, dest_file_name)
@@ -101,82 +163,116 @@ class RotatingFileHandler(logging.handlers.RotatingFileHandler):
             self.stream = self._open()
 
 
-def store_bookmarks(file_name: str, bookmarks: list, channels: list):
+def store_bookmarks(file_name: str, bookmarks: list, channels: list, source):
     """
     Store bookmarks to file in JSON format
     Args:
         bookmarks: bookmark handles
         channels: list of ChannelConfig
         file_name: destination file. override if exists
+        source: EventSource that bookmarks belong to
     """
     assert len(channels) == len(bookmarks)
-    tmp_file_name = file_name + '.tmp'
     bookmarks_dict = {}
     for i in range(0, len(channels)):
-        ch = channels[i]
-        key = ch.name + '#' + ch.query
-        xml_str = win32evtlog.EvtRender(bookmarks[i], win32evtlog.EvtRenderBookmark)
-        bookmarks_dict[key] = xml_str.replace('\r', '').replace('\n', '')
+        bookmarks_dict[bookmark_key(channels[i])] = render_bookmark(source, bookmarks[i])
+    write_bookmarks_file(file_name, bookmarks_dict)
+
+
+def bookmark_key(channel) -> str:
+    """
+    Returns key of channel bookmark in bookmarks file
+    """
+    return channel.name + '#' + channel.effective_query
+
+
+def render_bookmark(source, bookmark) -> str:
+    """
+    Returns bookmark XML as single line
+    """
+    return source.render_bookmark(bookmark).replace('\r', '').replace('\n', '')
+
+
+def write_bookmarks_file(file_name: str, bookmarks_dict: dict, fsync: bool = False):
+    """
+    Writes bookmarks JSON file: temp file replaces destination file
+    """
+    tmp_file_name = file_name + '.tmp'
     with open(tmp_file_name, 'w') as f:
         json.dump(bookmarks_dict, f)
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
     replace_file(tmp_file_name, file_name)
 
 
-def load_bookmarks(file_name, channels: list) -> list:
+def read_bookmarks_file(file_name: str) -> dict:
+    with open(file_name, 'r') as f:
+        return json.load(f)
+
+
+def load_bookmarks(file_name, channels: list, source) -> list:
     """
     Args: file_name: existing bookmarks file name, JSON channels([ChannelConfig]): list of channels from TailerConfig
+    source(EventSource): creates bookmarks
     Returns: list[handle]: returns list of bookmark handles corresponding to channels. new bookmarks created for
     channels missing in the file
     """
     bookmarks = []
     try:
-        with open(file_name, 'r') as f:
-            bookmarks_dict = json.load(f)
+        bookmarks_dict = read_bookmarks_file(file_name)
         for ch in channels:
-            key = ch.name + '#' + ch.query
-            xml_str = bookmarks_dict.get(key)  # for added or updated channels this may be None
-            bookmarks.append(win32evtlog.EvtCreateBookmark(xml_str))
+            xml_str = bookmarks_dict.get(bookmark_key(ch))  # for added or updated channels this may be None
+            bookmarks.append(source.create_bookmark(xml_str))
     except Exception as ex:
         raise errors.BookmarksError(ex)
     return bookmarks
 
 
 def compose_effective_config(tailer_name, tailer_config: dict, logging_config: dict) -> str:
+    import yaml
     config_dict = {consts.TAILER_TYPE: {tailer_name: tailer_config, 'logging': logging_config}}
     yaml_str = yaml.dump(config_dict, indent=4)
     return yaml_str
 
 
-def get_parent_process(ok_names, limit=10):
+def get_process_ancestry(limit=10) -> [str]:
     """
-    Walk up the process tree until we find a process we like.
+    Returns names of parent processes, the nearest first, up to limit. Process tree is walked once, result is passed
+    to is_service() and is_agent_child().
     """
-    depth = 1
-    this_proc = psutil.Process(os.getpid())
-    next_proc = psutil.Process(this_proc.ppid())
+    import psutil
+    names = []
     try:
-        while depth <= limit:
-            if next_proc.name() in ok_names:
-                return next_proc
-            next_proc = psutil.Process(next_proc.ppid())
-            depth += 1
-    except psutil.NoSuchProcess:
+        proc = psutil.Process(os.getpid())
+        while len(names) < limit:
+            ppid = proc.ppid()
+            if not ppid:
+                break
+            proc = psutil.Process(ppid)
+            names.append(proc.name())
+    except (psutil.NoSuchProcess, psutil.AccessDenied):
         pass
-    return None
+    return names
 
 
-def is_service() -> bool:
+def is_service(ancestry: list = None) -> bool:
     # running as child process of services.exe
-    return get_parent_process(["services.exe"]) is not None
+    if ancestry is None:
+        ancestry = get_process_ancestry()
+    return 'services.exe' in ancestry
 
 
-def is_agent_child() -> bool:
+def is_agent_child(ancestry: list = None) -> bool:
     # running as child process of agent
-    return get_parent_process(
-        ["logdna-agent.exe",
-         "logdna-agent-svc.exe",
-         "mezmo-agent.exe",
-         "mezmo-agent-svc.exe"]) is not None
+    if ancestry is None:
+        ancestry = get_process_ancestry()
+    return any(name in AGENT_PROCESS_NAMES for name in ancestry)
+
+
+def get_thread_locale() -> int:
+    # locale used by EvtOpenPublisherMetadata when Locale is 0
+    return ctypes.windll.kernel32.GetThreadLocale()
 
 
 def is_admin_user() -> bool:
@@ -188,6 +284,10 @@ def is_admin_user() -> bool:
 
 
 def restart_elevated():
+    import win32api
+    import win32event
+    import win32process
+    from win32comext.shell import shell
     params = ' '.join(sys.argv[1:])
     SEE_MASK_NO_CONSOLE = 0x00008000
     SEE_MASK_NOCLOSE_PROCESS = 0x00000040
@@ -0,0 +1,84 @@
+import queue
+import threading
+
+
+class ChannelWaiter:
+    """
+    Waits for channel subscriptions to be signalled: one auto-reset Win32 event per channel, see EvtSubscribe.
+    WaitForMultipleObjects is limited to MAXIMUM_WAIT_OBJECTS handles, up to that number of channels are waited by
+    caller directly. With more channels signals are sharded to groups, each group is waited by own waiter thread
+    together with stop event, signalled channels are queued to caller in order they were signalled. Channel is queued
+    once till caller takes it, caller reads all its events then.
+    """
+
+    def __init__(self, count: int, win32event=None):
+        """
+        Args:
+            count: number of channels
+            win32event: win32event compatible API, default: win32event
+        """
+        if win32event is None:
+            import win32event
+        self.win32event = win32event
+        self.signals = [win32event.CreateEvent(None, 0, 0, None) for _ in range(count)]
+        self.threads = []
+        self.error = None
+        if count <= win32event.MAXIMUM_WAIT_OBJECTS:
+            return
+        self.ready = queue.Queue()  # signalled channels
+        self.queued = [False] * count  # channel is in ready queue
+        self.stop_event = win32event.CreateEvent(None, 1, 0, None)  # manual reset
+        group_size = win32event.MAXIMUM_WAIT_OBJECTS - 1  # one handle is stop event
+        for start in range(0, count, group_size):
+            thread = threading.Thread(target=self._wait_loop, args=(start, self.signals[start:start + group_size]),
+                                      name=f'waiter_{start // group_size}', daemon=True)
+            self.threads.append(thread)
+            thread.start()
+
+    def wait(self, timeout_ms: int):
+        """
+        Waits for any channel to be signalled
+        Returns:
+            int: channel index, None on timeout
+        """
+        wait_object_0 = self.win32event.WAIT_OBJECT_0
+        if not self.threads:
+            signalled = self.win32event.WaitForMultipleObjectsEx(self.signals, False, timeout_ms, True)
+            if wait_object_0 <= signalled < wait_object_0 + len(self.signals):
+                return signalled - wait_object_0
+            return None
+        try:
+            ch_idx = self.ready.get(timeout=timeout_ms / 1000)
+        except queue.Empty:
+            return None
+        if ch_idx is None:
+            raise self.error  # waiter thread failed
+        self.queued[ch_idx] = False
+        return ch_idx
+
+    def close(self):
+        """
+        Stops waiter threads
+        """
+        if self.threads:
+            self.win32event.SetEvent(self.stop_event)
+            for thread in self.threads:
+                thread.join()
+            self.threads = []
+
+    def _wait_loop(self, start: int, signals: list):
+        handles = [self.stop_event] + signals
+        wait_object_0 = self.win32event.WAIT_OBJECT_0
+        try:
+            while True:
+                signalled = self.win32event.WaitForMultipleObjects(handles, False, self.win32event.INFINITE)
+                idx = signalled - wait_object_0
+                if not 0 < idx < len(handles):
+                    return  # stopped
+                ch_idx = start + idx - 1
+                if not self.queued[ch_idx]:
+                    self.queued[ch_idx] = True
+                    self.ready.put(ch_idx)
+        except Exception as ex:
+            self.error = ex
+            self.ready.put(None)
@@ -0,0 +1,115 @@
+import queue
+import threading
+import concurrent.futures
+
+
+class BatchProcessor:
+    """
+    Handles batches of events fetched by reader (Tailer main loop) on the caller thread:
+    process (render, parse, transforms) -> emit (output) -> batch_done (bookmark).
+
+    Handler interface (see Tailer):
+        process_event(ch_idx, event_h) -> object|None: output object or None if event is dropped
+        emit(ch_idx, event_h, event_obj): writes output object
+        end_batch(): called after batch is emitted
+        batch_done(ch_idx, last_event_h): called after batch is emitted with last emitted event
+        output_lock: held while batch is emitted and bookmark is advanced
+    """
+
+    def __init__(self, handler):
+        self.handler = handler
+
+    def submit(self, ch_idx: int, events: list):
+        handler = self.handler
+        outputs = [handler.process_event(ch_idx, event_h) for event_h in events]
+        with handler.output_lock:
+            emit_batch(handler, ch_idx, events, outputs)
+
+    def drain(self):
+        """
+        Waits until all submitted batches are emitted
+        """
+        pass
+
+    def close(self):
+        pass
+
+
+class PipelinedProcessor(BatchProcessor):
+    """
+    Reader thread submits batches, worker pool processes them (render, parse, transforms), writer thread emits
+    outputs in submission order, so output order is the same as read order within and across channels. Bookmarks
+    advance only after events are emitted.
+    Submit blocks when queue_depth batches are in flight. Error in worker or writer is re-raised in reader on next
+    submit() or drain(), batches after failed one are not emitted.
+    """
+
+    def __init__(self, handler, workers: int, queue_depth: int):
+        super().__init__(handler)
+        self.pool = concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix='worker')
+        self.queue = queue.Queue(maxsize=max(1, queue_depth))  # (ch_idx, events, future) in submission order
+        self.error = None
+        self.writer = threading.Thread(target=self._write_loop, name='writer', daemon=True)
+        self.writer.start()
+
+    def submit(self, ch_idx: int, events: list):
+        self._raise_error()
+        future = self.pool.submit(self._process_batch, ch_idx, events)
+        self.queue.put((ch_idx, events, future))
+
+    def drain(self):
+        self.queue.join()
+        self._raise_error()
+
+    def close(self):
+        try:
+            self.drain()
+        finally:
+            self.queue.put(None)
+            self.writer.join()
+            self.pool.shutdown()
+
+    def _process_batch(self, ch_idx: int, events: list) -> list:
+        process_event = self.handler.process_event
+        return [process_event(ch_idx, event_h) for event_h in events]
+
+    def _write_loop(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                if self.error is not None:
+                    continue  # skip the rest, reader stops on error
+                ch_idx, events, future = item
+                outputs = future.result()
+                with self.handler.output_lock:
+                    emit_batch(self.handler, ch_idx, events, outputs)
+            except BaseException as ex:
+                self.error = ex
+            finally:
+                self.queue.task_done()
+
+    def _raise_error(self):
+        if self.error is not None:
+            raise self.error
+
+
+def emit_batch(handler, ch_idx: int, events: list, outputs: list):
+    last_event_h = None
+    for event_h, event_obj in zip(events, outputs):
+        if event_obj is not None:  # None means event was dropped
+            handler.emit(ch_idx, event_h, event_obj)
+            last_event_h = event_h
+    handler.end_batch()
+    if last_event_h is not None:
+        handler.batch_done(ch_idx, last_event_h)
+
+
+def create_processor(handler, workers: int, queue_depth: int) -> BatchProcessor:
+    """
+    Returns inline processor if workers is 0, pipelined otherwise
+    """
+    if workers > 0:
+        return PipelinedProcessor(handler, workers, queue_depth)
+    return BatchProcessor(handler)